@@ -1,10 +1,21 @@
 #!/usr/bin/env python
+import ralphlib.indexer
 import ralphlib.looper
 import ralphlib.options
+import ralphlib.reporter
+import ralphlib.watcher
 
 
 def main() -> None:
-    ralphlib.looper.loop(ralphlib.options.parse_options())
+    options = ralphlib.options.parse_options()
+    if isinstance(options, ralphlib.options.QueryOptions):
+        ralphlib.indexer.query(options)
+    elif isinstance(options, ralphlib.options.ReportOptions):
+        ralphlib.reporter.report(options)
+    elif isinstance(options, ralphlib.options.WatchOptions):
+        ralphlib.watcher.watch(options)
+    else:
+        ralphlib.looper.loop(options)
 
 
 if __name__ == '__main__':
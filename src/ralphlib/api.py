@@ -0,0 +1,81 @@
+import asyncio
+import queue
+import threading
+from typing import TYPE_CHECKING, Any
+
+import ralphlib.events
+import ralphlib.looper
+import ralphlib.types
+
+if TYPE_CHECKING:
+    from collections.abc import AsyncIterator, Callable, Iterator
+
+    from ralphlib.options import RalpherOptions
+
+DONE = object()
+
+
+class Loop:
+    def __init__(self, options: RalpherOptions, cancel: ralphlib.types.CancelToken | None = None) -> None:
+        self.options = ralphlib.looper.resolve_paths(options)
+        self.content = ralphlib.looper.load_prompt(self.options)
+        self.cancel = cancel or ralphlib.types.CancelToken()
+
+    # blocks until the loop stops, events are passed to emit on the loop's threads
+    def run(self, emit: Callable[[ralphlib.events.Event], None] | None = None) -> ralphlib.events.LoopEnd:
+        return ralphlib.looper.run_loop(self.options, self.content, self.cancel, emit)
+
+    def stop(self) -> None:
+        self.cancel.cancel()
+
+    def __iter__(self) -> Iterator[ralphlib.events.Event]:
+        events: queue.Queue[Any] = queue.Queue()
+        thread = threading.Thread(target=self.produce, args=(events.put,), daemon=True)
+        thread.start()
+        finished = False
+        try:
+            while True:
+                event = events.get()
+                if event is DONE:
+                    finished = True
+                    break
+                if isinstance(event, BaseException):
+                    # the loop is over, only its thread is left to finish
+                    finished = True
+                    raise event
+                yield event
+        finally:
+            # the consumer stopped early, the loop has to stop too, a token shared with other loops is left alone otherwise
+            if not finished:
+                self.cancel.cancel()
+            thread.join()
+
+    async def __aiter__(self) -> AsyncIterator[ralphlib.events.Event]:
+        loop = asyncio.get_running_loop()
+        events: asyncio.Queue[Any] = asyncio.Queue()
+        thread = threading.Thread(target=self.produce, args=(lambda event: loop.call_soon_threadsafe(events.put_nowait, event),), daemon=True)
+        thread.start()
+        finished = False
+        try:
+            while True:
+                event = await events.get()
+                if event is DONE:
+                    finished = True
+                    break
+                if isinstance(event, BaseException):
+                    # the loop is over, only its thread is left to finish
+                    finished = True
+                    raise event
+                yield event
+        finally:
+            if not finished:
+                self.cancel.cancel()
+            await asyncio.to_thread(thread.join)
+
+    def produce(self, put: Callable[[Any], None]) -> None:
+        try:
+            self.run(put)
+        except Exception as e:
+            put(e)
+        finally:
+            put(DONE)
@@ -0,0 +1,106 @@
+import gzip
+import hashlib
+import os
+import pathlib
+import tempfile
+import threading
+from typing import TYPE_CHECKING, Any
+
+import orjson
+
+import ralphlib.logger
+
+if TYPE_CHECKING:
+    from ralphlib.options import RalpherOptions
+
+BLOB_DIR = 'blobs'
+GZIP_SUFFIX = '.gz'
+
+gil = threading.Lock()
+known: set[pathlib.Path] = set()
+
+
+def enabled(options: RalpherOptions) -> bool:
+    return not options.no_blobs and bool(options.state or options.progress)
+
+
+def store_dir(options: RalpherOptions) -> pathlib.Path:
+    # next to the state and progress files, so runs sharing a logdir share their blobs
+    root = ralphlib.logger.log_dir(options) if options.logdir else pathlib.Path.cwd()
+    return root / BLOB_DIR
+
+
+def blob_path(root: pathlib.Path, digest: str, compressed: bool) -> pathlib.Path:
+    return root / digest[:2] / (digest + (GZIP_SUFFIX if compressed else ''))
+
+
+def put(options: RalpherOptions, data: bytes) -> dict[str, Any]:
+    digest = hashlib.sha256(data).hexdigest()
+    ref = {'blob': digest, 'size': len(data)}
+    compressed = options.blob_compression == 'gzip'
+    path = blob_path(store_dir(options), digest, compressed)
+    with gil:
+        if path in known:
+            return ref
+    if not path.exists():
+        path.parent.mkdir(parents=True, exist_ok=True)
+        payload = gzip.compress(data, mtime=0) if compressed else data
+        # written under a temporary name first, a reader never sees half a blob
+        fd, tmp = tempfile.mkstemp(dir=path.parent, prefix='.tmp-')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(payload)
+            os.replace(tmp, path)
+        except BaseException:
+            pathlib.Path(tmp).unlink(missing_ok=True)
+            raise
+    with gil:
+        known.add(path)
+    return ref
+
+
+def ref_value(options: RalpherOptions, value: Any) -> Any:
+    # large strings and payloads become references, small ones stay inline
+    if not enabled(options):
+        return value
+    data = value.encode('utf-8') if isinstance(value, str) else orjson.dumps(value, option=orjson.OPT_SORT_KEYS)
+    if len(data) < options.blob_min_size:
+        return value
+    ref = put(options, data)
+    if not isinstance(value, str):
+        ref['json'] = True
+    return ref
+
+
+def ref_text(options: RalpherOptions, text: str) -> str:
+    value = ref_value(options, text)
+    if isinstance(value, str):
+        return value
+    return f'[blob {value["blob"]}, {value["size"]} bytes]'
+
+
+def is_ref(value: Any) -> bool:
+    return isinstance(value, dict) and isinstance(value.get('blob'), str) and 'size' in value
+
+
+def find_root(state_path: pathlib.Path) -> pathlib.Path:
+    # the state file may sit in a subdirectory of the logdir that holds the blobs
+    for parent in state_path.absolute().parents:
+        if (parent / BLOB_DIR).is_dir():
+            return parent / BLOB_DIR
+    return state_path.absolute().parent / BLOB_DIR
+
+
+def load(root: pathlib.Path, value: Any) -> Any:
+    # resolves a reference written by ref_value, anything else is returned as it is
+    if not is_ref(value):
+        return value
+    digest = value['blob']
+    for compressed in (True, False):
+        path = blob_path(root, digest, compressed)
+        if path.exists():
+            data = path.read_bytes()
+            if compressed:
+                data = gzip.decompress(data)
+            return orjson.loads(data) if value.get('json') else data.decode('utf-8')
+    raise FileNotFoundError(f'blob {digest} not found in {root}')
@@ -0,0 +1,120 @@
+import concurrent.futures
+import os
+import pathlib
+import shlex
+import subprocess
+import time
+from typing import TYPE_CHECKING, Any
+
+from loguru import logger
+
+import ralphlib.convergence
+import ralphlib.procgroup
+
+if TYPE_CHECKING:
+    from ralphlib.options import RalpherOptions
+
+CHECK_OUTPUT_LIMIT = 4000  # characters, the tail of the output is kept
+
+
+def enabled(options: RalpherOptions) -> bool:
+    return bool(options.checks or options.check_files)
+
+
+def run(options: RalpherOptions, cache: dict[str, list[dict[str, Any]]]) -> dict[str, Any]:
+    results = [check_file(options, f) for f in options.check_files]
+
+    if options.checks:
+        fingerprint = ralphlib.convergence.workspace_fingerprint(options, None)
+        if fingerprint in cache:
+            command_results = [dict(r, cached=True) for r in cache[fingerprint]]
+        else:
+            command_results = run_commands(options)
+            if not any(r['timed_out'] for r in command_results):
+                # the checks may write to the workspace themselves, e.g. reports, the next iteration starts from there
+                cache[fingerprint] = command_results
+                cache[ralphlib.convergence.workspace_fingerprint(options, None)] = command_results
+        results.extend(command_results)
+
+    return {
+        'passed': all(r['passed'] for r in results),
+        'results': results,
+    }
+
+
+def check_file(options: RalpherOptions, file: str) -> dict[str, Any]:
+    path = pathlib.Path(file).expanduser()
+    if options.cwd and not path.is_absolute():
+        path = ralphlib.convergence.workspace_root(options) / path
+    passed = path.exists()
+    return {
+        'name': file,
+        'kind': 'file',
+        'passed': passed,
+        'output': '' if passed else f'{path} does not exist',
+    }
+
+
+def run_commands(options: RalpherOptions) -> list[dict[str, Any]]:
+    workers = max(1, min(options.check_jobs, len(options.checks)))
+    with concurrent.futures.ThreadPoolExecutor(max_workers=workers, thread_name_prefix='ralpher-check') as pool:
+        return list(pool.map(lambda command: run_command(options, command), options.checks))
+
+
+def run_command(options: RalpherOptions, command: str) -> dict[str, Any]:
+    result: dict[str, Any] = {
+        'name': command,
+        'kind': 'command',
+        'passed': False,
+        'returncode': None,
+        'timed_out': False,
+    }
+    kwargs: dict[str, Any] = {
+        'stdout': subprocess.PIPE,
+        'stderr': subprocess.STDOUT,
+        'stdin': subprocess.DEVNULL,
+        'text': True,
+        'errors': 'replace',
+    }
+    if options.cwd:
+        kwargs['cwd'] = options.cwd
+    if os.name == 'posix':
+        kwargs['start_new_session'] = True
+
+    start = time.monotonic()
+    try:
+        proc = subprocess.Popen(shlex.split(command), **kwargs)  # noqa: S603
+    except OSError as e:
+        logger.warning(f'Check {command} failed to start: {e}')
+        result['output'] = str(e)
+        result['seconds'] = 0.0
+        return result
+
+    try:
+        output, _ = proc.communicate(timeout=options.check_timeout)
+    except subprocess.TimeoutExpired:
+        ralphlib.procgroup.kill(proc)
+        output, _ = proc.communicate()
+        result['timed_out'] = True
+
+    result['seconds'] = time.monotonic() - start
+    result['returncode'] = proc.returncode
+    result['passed'] = proc.returncode == 0 and not result['timed_out']
+    result['output'] = output[-CHECK_OUTPUT_LIMIT:] if output else ''
+    return result
+
+
+def summary_lines(checks: dict[str, Any]) -> str:
+    lines = []
+    for r in checks['results']:
+        status = 'passed' if r['passed'] else 'failed'
+        if r.get('timed_out'):
+            status = 'timed out'
+        details = []
+        if r.get('seconds') is not None:
+            details.append(f'{r["seconds"]:.1f}s')
+        if r.get('cached'):
+            details.append('cached')
+        suffix = f' ({", ".join(details)})' if details else ''
+        lines.append(f'- {r["name"]}: {status}{suffix}')
+    return '\n'.join(lines)
@@ -0,0 +1,187 @@
+import difflib
+import fnmatch
+import glob
+import hashlib
+import os
+import pathlib
+import subprocess
+from typing import TYPE_CHECKING, Any
+
+from loguru import logger
+
+import ralphlib.blobs
+import ralphlib.logger
+
+if TYPE_CHECKING:
+    from collections.abc import Callable
+
+    from ralphlib.options import RalpherOptions
+
+MAX_BACKOFF = 600  # seconds
+IGNORED_DIRS = {'.git', '.hg', '.svn', '__pycache__', '.mypy_cache', '.pytest_cache', '.ruff_cache', 'node_modules'}
+
+
+def workspace_root(options: RalpherOptions) -> pathlib.Path:
+    return pathlib.Path(options.cwd or '.').expanduser().absolute()
+
+
+def own_files(options: RalpherOptions) -> list[tuple[pathlib.Path, str]]:
+    # what the loop writes itself as (directory, name pattern), with logs inside the workspace it would never converge
+    root = workspace_root(options)
+    base = ralphlib.logger.log_dir(options) if options.logdir else pathlib.Path.cwd().absolute()
+    paths = [ralphlib.blobs.store_dir(options).absolute()]
+    if options.logdir and not root.is_relative_to(base):
+        paths.append(base)
+    state = ralphlib.logger.state_file(options)
+    if state:
+        paths.append(state.absolute())
+    if options.log_file:
+        paths.append(base / options.log_file if options.logdir else pathlib.Path(options.log_file).absolute())
+    own = [(path.parent, glob.escape(path.name)) for path in paths]
+    for name in ('stdout', 'stderr', 'progress'):
+        file = getattr(options, name)
+        if file:
+            path = pathlib.Path(file)
+            own.append((base, f'{glob.escape(path.stem)}-*{glob.escape(path.suffix)}'))
+    return own
+
+
+def is_own(path: pathlib.Path, own: list[tuple[pathlib.Path, str]]) -> bool:
+    return any(path.parent == parent and fnmatch.fnmatchcase(path.name, pattern) for parent, pattern in own)
+
+
+def workspace_fingerprint(options: RalpherOptions, outcome: dict[str, Any] | None) -> str:
+    # path, size and modification time of every file, cheap enough to run after every iteration
+    root = workspace_root(options)
+    own = own_files(options)
+    h = hashlib.sha256()
+    for dirpath, dirnames, filenames in os.walk(root):
+        parent = pathlib.Path(dirpath)
+        dirnames[:] = sorted(d for d in dirnames if d not in IGNORED_DIRS and not is_own(parent / d, own))
+        for name in sorted(filenames):
+            if is_own(parent / name, own):
+                continue
+            path = os.path.join(dirpath, name)
+            try:
+                st = os.stat(path, follow_symlinks=False)
+            except OSError:
+                continue
+            rel = os.path.relpath(path, root)
+            h.update(f'{rel}\0{st.st_size}\0{st.st_mtime_ns}\n'.encode('utf-8', errors='replace'))
+    return h.hexdigest()
+
+
+def git_pathspecs(options: RalpherOptions) -> list[str]:
+    root = workspace_root(options)
+    pathspecs = ['.']
+    for parent, pattern in own_files(options):
+        if parent.is_relative_to(root):
+            pathspecs.append(f':(exclude,glob){(parent / pattern).relative_to(root).as_posix()}')
+    return pathspecs
+
+
+def git_fingerprint(options: RalpherOptions, outcome: dict[str, Any] | None) -> str | None:
+    root = workspace_root(options)
+    pathspecs = ['--', *git_pathspecs(options)]
+    h = hashlib.sha256()
+    for args in (['rev-parse', 'HEAD'], ['status', '--porcelain', *pathspecs], ['diff', '--stat', 'HEAD', *pathspecs]):
+        try:
+            result = subprocess.run(  # noqa: S603
+                ['git', '-C', str(root), *args],  # noqa: S607
+                capture_output=True,
+                text=True,
+                errors='replace',
+                check=False,
+            )
+        except OSError as e:
+            logger.warning(f'git fingerprint failed: {e}')
+            return None
+        # outside a repository or before its first commit there is nothing to compare, that counts as a change
+        if result.returncode != 0:
+            logger.warning(f'git fingerprint failed: git {args[0]} exited with {result.returncode}: {result.stderr.strip()}')
+            return None
+        h.update(result.stdout.encode('utf-8'))
+    return h.hexdigest()
+
+
+def tools_fingerprint(options: RalpherOptions, outcome: dict[str, Any] | None) -> str | None:
+    if outcome is None:
+        return None
+    return '\n'.join(outcome['tools_used'])
+
+
+def result_fingerprint(options: RalpherOptions, outcome: dict[str, Any] | None) -> str | None:
+    if outcome is None:
+        return None
+    return outcome['result']
+
+
+def same_result(options: RalpherOptions, previous: str, current: str) -> bool:
+    if previous == current:
+        return True
+    ratio = difflib.SequenceMatcher(None, previous, current, autojunk=False).quick_ratio()
+    if ratio < options.converge_similarity:
+        return False
+    return difflib.SequenceMatcher(None, previous, current, autojunk=False).ratio() >= options.converge_similarity
+
+
+def same_value(options: RalpherOptions, previous: str, current: str) -> bool:
+    return previous == current
+
+
+CHECKS: dict[str, tuple[Callable[[RalpherOptions, dict[str, Any] | None], str | None], Callable[[RalpherOptions, str, str], bool]]] = {
+    'workspace': (workspace_fingerprint, same_value),
+    'git': (git_fingerprint, same_value),
+    'tools': (tools_fingerprint, same_value),
+    'result': (result_fingerprint, same_result),
+}
+
+
+def fingerprint(options: RalpherOptions, outcome: dict[str, Any] | None) -> dict[str, str | None]:
+    fp = {}
+    for name in options.converge:
+        fingerprint_fn, _same_fn = CHECKS[name]
+        fp[name] = fingerprint_fn(options, outcome)
+    return fp
+
+
+def changed(options: RalpherOptions, previous: dict[str, str | None], current: dict[str, str | None]) -> list[str]:
+    names = []
+    for name, value in current.items():
+        _fingerprint_fn, same_fn = CHECKS[name]
+        before = previous.get(name)
+        if before is None or value is None or not same_fn(options, before, value):
+            names.append(name)
+    return names
+
+
+def make_tracker(options: RalpherOptions) -> dict[str, Any]:
+    return {
+        # workspace checks get a baseline, so a first iteration that changes nothing already counts
+        'previous': fingerprint(options, None),
+        'stale': 0,
+    }
+
+
+def update(options: RalpherOptions, tracker: dict[str, Any], outcome: dict[str, Any]) -> dict[str, Any]:
+    current = fingerprint(options, outcome)
+    names = changed(options, tracker['previous'], current)
+    tracker['previous'] = current
+    if names:
+        tracker['stale'] = 0
+    else:
+        tracker['stale'] += 1
+
+    verdict: dict[str, Any] = {
+        'changed': names,
+        'stale_iterations': tracker['stale'],
+        'converged': tracker['stale'] >= options.converge_after,
+    }
+    if verdict['converged'] and options.converge_action == 'backoff':
+        verdict['backoff_seconds'] = backoff_seconds(options, tracker['stale'])
+    return verdict
+
+
+def backoff_seconds(options: RalpherOptions, stale: int) -> float:
+    exponent = max(0, stale - options.converge_after)
+    return min(options.converge_backoff * (2**exponent), MAX_BACKOFF)
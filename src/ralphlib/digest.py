@@ -0,0 +1,107 @@
+import collections
+import datetime
+from typing import TYPE_CHECKING, Any
+
+import ralphlib.looper
+import ralphlib.templater
+
+if TYPE_CHECKING:
+    from ralphlib.options import RalpherOptions
+
+VARIABLES = {'history', 'history_text'}
+ELLIPSIS = '…'
+RESULT_PREFIX = '\n  Result: '
+
+
+def used(prompt: str) -> bool:
+    # only prompts that ask for the history pay for it, and only they are rendered for it
+    return bool(ralphlib.templater.variables(prompt) & VARIABLES)
+
+
+def make_digest(options: RalpherOptions) -> collections.deque:
+    return collections.deque(maxlen=options.digest_iterations)
+
+
+def add(
+    options: RalpherOptions,
+    digest: collections.deque,
+    iteration: int,
+    outcome: dict[str, Any],
+    checks: dict[str, Any] | None,
+    seconds: float,
+) -> None:
+    # the result is capped right away, the digest never holds more than a few budgets worth of text
+    entry = {
+        'iteration': iteration,
+        'seconds': round(seconds, 1),
+        'complete': outcome['complete'],
+        'error': outcome['error'],
+        'watchdog': outcome['watchdog'],
+        'failure': outcome.get('failure'),
+        'tools_used': outcome['tools_used'],
+        'checks': None,
+        'result': truncate(' '.join(outcome['result'].split()), options.digest_bytes),
+    }
+    if checks is not None:
+        entry['checks'] = {
+            'passed': checks['passed'],
+            'failed': [r['name'] for r in checks['results'] if not r['passed']],
+        }
+    digest.append(entry)
+
+
+def truncate(text: str, size: int) -> str:
+    data = text.encode('utf-8')
+    if len(data) <= size:
+        return text
+    ellipsis_size = len(ELLIPSIS.encode('utf-8'))
+    if size < ellipsis_size:
+        return ''
+    return data[: size - ellipsis_size].decode('utf-8', errors='ignore') + ELLIPSIS
+
+
+def headline(entry: dict[str, Any]) -> str:
+    words = []
+    if entry['complete']:
+        words.append('complete')
+    if entry['error']:
+        words.append('error')
+    if entry['failure']:
+        words.append(f'{entry["failure"]} failure')
+    if entry['watchdog']:
+        words.append(f'stopped by watchdog {entry["watchdog"]}')
+    if entry['checks'] is not None:
+        if entry['checks']['passed']:
+            words.append('checks passed')
+        else:
+            words.append(f'checks failed: {", ".join(entry["checks"]["failed"])}')
+    if entry['tools_used']:
+        words.append(f'tools: {", ".join(entry["tools_used"])}')
+    readable = ralphlib.looper.timedelta_to_readable(datetime.timedelta(seconds=entry['seconds']))
+    return f'Iteration {entry["iteration"]} ({readable})' + (f': {"; ".join(words)}' if words else '')
+
+
+def context(options: RalpherOptions, digest: collections.deque) -> dict[str, Any]:
+    # the newest headlines that fit the byte budget, what is left of it is shared equally by their results
+    budget = options.digest_bytes
+    kept = []
+    for entry in reversed(digest):
+        head = headline(entry)
+        cost = len(head.encode('utf-8')) + 1
+        if cost > budget:
+            break
+        budget -= cost
+        kept.append((entry, head))
+    kept.reverse()
+
+    share = budget // len(kept) if kept else 0
+    history = []
+    blocks = []
+    for entry, head in kept:
+        result = truncate(entry['result'], share - len(RESULT_PREFIX))
+        history.append(dict(entry, result=result))
+        blocks.append(f'{head}{RESULT_PREFIX}{result}' if result else head)
+    return {
+        'history': history,
+        'history_text': '\n'.join(blocks),
+    }
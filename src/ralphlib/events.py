@@ -0,0 +1,49 @@
+import dataclasses
+from typing import Any
+
+
+@dataclasses.dataclass(frozen=True)
+class LoopStart:
+    prompt: str
+    max_iterations: int
+
+
+@dataclasses.dataclass(frozen=True)
+class IterationStart:
+    iteration: int
+    prompt: str
+
+
+@dataclasses.dataclass(frozen=True)
+class Delta:
+    iteration: int
+    text: str
+
+
+@dataclasses.dataclass(frozen=True)
+class ToolUse:
+    iteration: int
+    name: str
+    input: str
+
+
+@dataclasses.dataclass(frozen=True)
+class Complete:
+    iteration: int
+
+
+@dataclasses.dataclass(frozen=True)
+class IterationEnd:
+    iteration: int
+    seconds: float
+    outcome: dict[str, Any]
+
+
+@dataclasses.dataclass(frozen=True)
+class LoopEnd:
+    iterations: int
+    seconds: float
+    stopped: list[str]
+
+
+Event = LoopStart | IterationStart | Delta | ToolUse | Complete | IterationEnd | LoopEnd
@@ -0,0 +1,356 @@
+import contextlib
+import datetime
+import hashlib
+import json
+import os
+import pathlib
+import sqlite3
+from typing import TYPE_CHECKING, Any
+
+import orjson
+from loguru import logger
+
+import ralphlib.blobs
+import ralphlib.iteration
+
+if TYPE_CHECKING:
+    from collections.abc import Iterator
+
+    from ralphlib.options import QueryOptions
+
+DB_FILENAME = 'ralpher.sqlite3'
+PROMPT_HEAD_LENGTH = 80
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS files (
+    path TEXT PRIMARY KEY,
+    mtime_ns INTEGER NOT NULL,
+    size INTEGER NOT NULL,
+    offset INTEGER NOT NULL DEFAULT 0,
+    run_id INTEGER,
+    iteration TEXT
+);
+CREATE TABLE IF NOT EXISTS runs (
+    id INTEGER PRIMARY KEY,
+    state_path TEXT NOT NULL UNIQUE,
+    start TEXT,
+    end TEXT,
+    agent TEXT,
+    args TEXT,
+    prompt_hash TEXT,
+    prompt_head TEXT,
+    max_iterations INTEGER,
+    iterations INTEGER,
+    total_time_seconds REAL,
+    stopped TEXT
+);
+CREATE TABLE IF NOT EXISTS iterations (
+    run_id INTEGER NOT NULL,
+    iteration TEXT NOT NULL,
+    start TEXT,
+    end TEXT,
+    time_seconds REAL,
+    complete INTEGER,
+    error INTEGER,
+    watchdog TEXT,
+    tools_used TEXT,
+    PRIMARY KEY (run_id, iteration)
+);
+CREATE TABLE IF NOT EXISTS tool_uses (
+    run_id INTEGER NOT NULL,
+    iteration TEXT NOT NULL,
+    tool_use_id TEXT NOT NULL,
+    name TEXT,
+    input TEXT,
+    start TEXT,
+    seconds REAL,
+    PRIMARY KEY (run_id, tool_use_id)
+);
+CREATE TABLE IF NOT EXISTS results (
+    run_id INTEGER NOT NULL,
+    iteration TEXT NOT NULL,
+    subtype TEXT,
+    is_error INTEGER,
+    duration_ms REAL,
+    duration_api_ms REAL,
+    num_turns INTEGER,
+    total_cost_usd REAL,
+    input_tokens INTEGER,
+    output_tokens INTEGER,
+    result TEXT,
+    PRIMARY KEY (run_id, iteration)
+);
+CREATE INDEX IF NOT EXISTS tool_uses_start ON tool_uses (start);
+CREATE INDEX IF NOT EXISTS tool_uses_name ON tool_uses (name);
+CREATE INDEX IF NOT EXISTS runs_prompt_hash ON runs (prompt_hash);
+"""
+
+
+def db_path(options: QueryOptions) -> pathlib.Path:
+    if options.db:
+        return pathlib.Path(options.db).expanduser().absolute()
+    return pathlib.Path(options.logdir).expanduser().absolute() / DB_FILENAME
+
+
+@contextlib.contextmanager
+def connect(path: pathlib.Path) -> Iterator[sqlite3.Connection]:
+    conn = sqlite3.connect(path)
+    try:
+        conn.row_factory = sqlite3.Row
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        conn.executescript(SCHEMA)
+        yield conn
+    finally:
+        conn.close()
+
+
+def index(options: QueryOptions, conn: sqlite3.Connection) -> None:
+    logdir = pathlib.Path(options.logdir).expanduser().absolute()
+    for path in sorted(logdir.rglob('*.json')):
+        try:
+            with conn:
+                index_state(conn, path)
+        except Exception as e:
+            logger.warning(f'Failed to index {path}: {e}')
+
+
+def file_changed(conn: sqlite3.Connection, path: pathlib.Path) -> tuple[bool, os.stat_result, sqlite3.Row | None]:
+    st = path.stat()
+    row = conn.execute('SELECT * FROM files WHERE path = ?', (str(path),)).fetchone()
+    if row is None:
+        return True, st, None
+    return row['mtime_ns'] != st.st_mtime_ns or row['size'] != st.st_size, st, row
+
+
+def index_state(conn: sqlite3.Connection, path: pathlib.Path) -> None:
+    changed, st, _row = file_changed(conn, path)
+    if changed:
+        with path.open('rb') as fp:
+            state = orjson.loads(fp.read())
+        run_id = ingest_state(conn, path, state) if is_state(state) else None
+        conn.execute(
+            'INSERT INTO files (path, mtime_ns, size, run_id) VALUES (?, ?, ?, ?) '
+            'ON CONFLICT (path) DO UPDATE SET mtime_ns = excluded.mtime_ns, size = excluded.size, run_id = excluded.run_id',
+            (str(path), st.st_mtime_ns, st.st_size, run_id),
+        )
+        if run_id is None:
+            return
+        iterations = state.get('iterations', {})
+    else:
+        run = conn.execute('SELECT id FROM runs WHERE state_path = ?', (str(path),)).fetchone()
+        if run is None:
+            return
+        run_id = run['id']
+        iterations = None
+
+    # the raw logs of a finished iteration can grow after the state was written, always check them
+    logs = conn.execute('SELECT path, iteration FROM files WHERE run_id = ? AND iteration IS NOT NULL', (run_id,)).fetchall()
+    known = {row['path']: row['iteration'] for row in logs}
+    if iterations is not None:
+        for key, it in iterations.items():
+            if isinstance(it, dict) and it.get('stdout'):
+                known[it['stdout']] = key
+    for log_path, key in known.items():
+        index_stdout(conn, pathlib.Path(log_path), run_id, key)
+
+
+def is_state(state: Any) -> bool:
+    return isinstance(state, dict) and 'start' in state and 'max_iterations' in state
+
+
+def ingest_state(conn: sqlite3.Connection, path: pathlib.Path, state: dict[str, Any]) -> int:
+    prompt = state.get('prompt', '')
+    if ralphlib.blobs.is_ref(prompt):
+        try:
+            prompt = ralphlib.blobs.load(ralphlib.blobs.find_root(path), prompt)
+        except (OSError, ValueError) as e:
+            logger.warning(f'Failed to load the prompt of {path}: {e}')
+            prompt = ''
+    if not isinstance(prompt, str):
+        prompt = json.dumps(prompt, sort_keys=True)
+    iterations = state.get('iterations', {})
+    stopped = state.get('stopped')
+    conn.execute(
+        'INSERT INTO runs (state_path, start, end, agent, args, prompt_hash, prompt_head, max_iterations, iterations, total_time_seconds, stopped) '
+        'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?) '
+        'ON CONFLICT (state_path) DO UPDATE SET start = excluded.start, end = excluded.end, agent = excluded.agent, args = excluded.args, '
+        'prompt_hash = excluded.prompt_hash, prompt_head = excluded.prompt_head, max_iterations = excluded.max_iterations, '
+        'iterations = excluded.iterations, total_time_seconds = excluded.total_time_seconds, stopped = excluded.stopped',
+        (
+            str(path),
+            state.get('start'),
+            state.get('end'),
+            state.get('agent'),
+            state.get('args'),
+            hashlib.sha256(prompt.encode('utf-8')).hexdigest(),
+            prompt.strip().splitlines()[0][:PROMPT_HEAD_LENGTH] if prompt.strip() else '',
+            state.get('max_iterations'),
+            len(iterations),
+            state.get('total_time_seconds'),
+            ', '.join(stopped) if isinstance(stopped, list) else stopped,
+        ),
+    )
+    run_id = conn.execute('SELECT id FROM runs WHERE state_path = ?', (str(path),)).fetchone()['id']
+
+    for key, it in iterations.items():
+        if not isinstance(it, dict):
+            continue
+        conn.execute(
+            'INSERT OR REPLACE INTO iterations (run_id, iteration, start, end, time_seconds, complete, error, watchdog, tools_used) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+            (
+                run_id,
+                key,
+                it.get('start'),
+                it.get('end'),
+                it.get('time_seconds'),
+                it.get('complete'),
+                it.get('error'),
+                it.get('watchdog'),
+                ', '.join(it.get('tools_used', [])),
+            ),
+        )
+        for tool_use_id, t in it.get('tool_times', {}).items():
+            conn.execute(
+                'INSERT INTO tool_uses (run_id, iteration, tool_use_id, name, start, seconds) VALUES (?, ?, ?, ?, ?, ?) '
+                'ON CONFLICT (run_id, tool_use_id) DO UPDATE SET start = excluded.start, seconds = excluded.seconds',
+                (run_id, key, tool_use_id, t.get('name'), t.get('start'), t.get('seconds')),
+            )
+    return run_id
+
+
+def index_stdout(conn: sqlite3.Connection, path: pathlib.Path, run_id: int, iteration: str) -> None:
+    try:
+        changed, st, row = file_changed(conn, path)
+    except FileNotFoundError:
+        return
+    if not changed:
+        return
+
+    offset = row['offset'] if row is not None else 0
+    if st.st_size < offset:
+        # rewritten, start over
+        offset = 0
+
+    with path.open('rb') as fp:
+        fp.seek(offset)
+        data = fp.read(st.st_size - offset)
+    # only complete lines, a partial last line is read again next time
+    end = data.rfind(b'\n') + 1
+    for line in data[:end].splitlines():
+        if line.strip():
+            ingest_line(conn, line, run_id, iteration)
+
+    conn.execute(
+        'INSERT INTO files (path, mtime_ns, size, offset, run_id, iteration) VALUES (?, ?, ?, ?, ?, ?) '
+        'ON CONFLICT (path) DO UPDATE SET mtime_ns = excluded.mtime_ns, size = excluded.size, offset = excluded.offset, '
+        'run_id = excluded.run_id, iteration = excluded.iteration',
+        (str(path), st.st_mtime_ns, st.st_size, offset + end, run_id, iteration),
+    )
+
+
+def ingest_line(conn: sqlite3.Connection, line: bytes, run_id: int, iteration: str) -> None:
+    try:
+        payload = orjson.loads(line)
+    except orjson.JSONDecodeError:
+        return
+    if not isinstance(payload, dict):
+        return
+
+    ptype = payload.get('type')
+    if ptype == 'assistant':
+        for c in payload.get('message', {}).get('content', []) or []:
+            if not isinstance(c, dict) or c.get('type') != 'tool_use' or not c.get('id'):
+                continue
+            input_field = c.get('input', {})
+            tool_input = ralphlib.iteration.input_field_to_content(input_field) if isinstance(input_field, dict) else ''
+            conn.execute(
+                'INSERT INTO tool_uses (run_id, iteration, tool_use_id, name, input) VALUES (?, ?, ?, ?, ?) '
+                'ON CONFLICT (run_id, tool_use_id) DO UPDATE SET name = excluded.name, input = excluded.input',
+                (run_id, iteration, c['id'], c.get('name'), tool_input),
+            )
+
+    elif ptype == 'result':
+        usage = payload.get('usage', {}) or {}
+        conn.execute(
+            'INSERT OR REPLACE INTO results (run_id, iteration, subtype, is_error, duration_ms, duration_api_ms, num_turns, total_cost_usd, input_tokens, output_tokens, result) '
+            'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+            (
+                run_id,
+                iteration,
+                payload.get('subtype'),
+                payload.get('is_error'),
+                payload.get('duration_ms'),
+                payload.get('duration_api_ms'),
+                payload.get('num_turns'),
+                payload.get('total_cost_usd'),
+                usage.get('input_tokens'),
+                usage.get('output_tokens'),
+                payload.get('result') if isinstance(payload.get('result'), str) else None,
+            ),
+        )
+
+
+REPORTS = {
+    'runs': (
+        'SELECT start, prompt_head AS task, iterations, max_iterations, stopped, round(total_time_seconds) AS seconds '
+        'FROM runs WHERE start >= :since ORDER BY start DESC LIMIT :limit'
+    ),
+    'slowest-tools': (
+        "SELECT t.start, t.name, t.seconds, substr(replace(t.input, char(10), ' '), 1, 80) AS input, r.prompt_head AS task "
+        'FROM tool_uses t JOIN runs r ON r.id = t.run_id '
+        'WHERE t.seconds IS NOT NULL AND t.start >= :since ORDER BY t.seconds DESC LIMIT :limit'
+    ),
+    'tool-mix': (
+        'SELECT t.name, count(*) AS uses, round(sum(t.seconds), 1) AS total_seconds, round(avg(t.seconds), 2) AS avg_seconds, '
+        'round(max(t.seconds), 2) AS max_seconds '
+        'FROM tool_uses t JOIN runs r ON r.id = t.run_id WHERE r.start >= :since GROUP BY t.name ORDER BY uses DESC LIMIT :limit'
+    ),
+    'tasks': (
+        'SELECT prompt_head AS task, count(*) AS runs, round(avg(iterations), 1) AS avg_iterations, max(iterations) AS max_iterations, '
+        "round(avg(total_time_seconds)) AS avg_seconds, sum(stopped LIKE '%complete%') AS completed "
+        'FROM runs WHERE start >= :since GROUP BY prompt_hash ORDER BY runs DESC LIMIT :limit'
+    ),
+    'errors': (
+        "SELECT coalesce(i.watchdog, CASE WHEN i.error THEN 'error' END, res.subtype) AS reason, count(*) AS iterations, max(i.start) AS last_seen "
+        'FROM iterations i JOIN runs r ON r.id = i.run_id '
+        'LEFT JOIN results res ON res.run_id = i.run_id AND res.iteration = i.iteration '
+        'WHERE r.start >= :since AND (i.error OR i.watchdog IS NOT NULL OR res.is_error) '
+        'GROUP BY reason ORDER BY iterations DESC LIMIT :limit'
+    ),
+    'cost': (
+        'SELECT substr(r.start, 1, 10) AS day, count(DISTINCT r.id) AS runs, count(*) AS iterations, round(sum(res.total_cost_usd), 2) AS cost_usd, '
+        'sum(res.input_tokens) AS input_tokens, sum(res.output_tokens) AS output_tokens '
+        'FROM results res JOIN runs r ON r.id = res.run_id WHERE r.start >= :since GROUP BY day ORDER BY day DESC LIMIT :limit'
+    ),
+}
+
+
+def query(options: QueryOptions) -> None:
+    with connect(db_path(options)) as conn:
+        if not options.no_index:
+            index(options, conn)
+
+        since = ''
+        if options.since is not None:
+            since = (datetime.datetime.now() - datetime.timedelta(days=options.since)).isoformat()
+        rows = conn.execute(REPORTS[options.report], {'since': since, 'limit': options.limit}).fetchall()
+
+    if options.json:
+        print(orjson.dumps([dict(r) for r in rows], option=orjson.OPT_INDENT_2).decode())
+        return
+    if not rows:
+        print('No results')
+        return
+    print(format_table(list(rows[0].keys()), [list(r) for r in rows]))
+
+
+def format_table(headers: list[str], rows: list[list[Any]]) -> str:
+    cells = [headers] + [['' if v is None else str(v) for v in row] for row in rows]
+    widths = [max(len(row[i]) for row in cells) for i in range(len(headers))]
+    lines = []
+    for n, row in enumerate(cells):
+        lines.append('  '.join(v.ljust(w) for v, w in zip(row, widths, strict=True)).rstrip())
+        if n == 0:
+            lines.append('  '.join('-' * w for w in widths))
+    return '\n'.join(lines)
@@ -1,7 +1,14 @@
+import collections
+import contextlib
+import datetime
+import os
+import pathlib
 import re
 import shlex
 import subprocess
 import sys
+import tempfile
+import textwrap
 import threading
 import time
 from typing import TYPE_CHECKING, Any
@@ -10,18 +17,40 @@ import colorama
 import orjson
 from loguru import logger
 
+import ralphlib.blobs
+import ralphlib.events
 import ralphlib.logger
+import ralphlib.procgroup
+import ralphlib.scheduler
 import ralphlib.state
 import ralphlib.types
 
 if TYPE_CHECKING:
     import io
+    from collections.abc import Callable
 
     from ralphlib.options import RalpherOptions
 
 SUBPROCESS_POLL_INTERVAL = 3
+TERMINATE_GRACE_PERIOD = 10
+PROMPT_FILE_PLACEHOLDER = '{prompt_file}'
+STDERR_TAIL_LINES = 20
+BACKGROUND_TOOLS = ['Bash']
+BACKGROUND_POLL_TOOLS = ['TaskOutput', 'BashOutput']
+BACKGROUND_STOP_TOOLS = ['TaskStop', 'KillShell']
+BACKGROUND_FINISHED = ['completed', 'failed', 'killed']
+OVERSIZED_HEAD_SIZE = 64 * 1024  # characters of an oversized line that are inspected
 
 tool_id_regex = re.compile(r'Command running in background with ID: (?P<id>\w+)\.')
+background_status_regex = re.compile(r'<status>(?P<status>\w+)</status>')
+background_exit_code_regex = re.compile(r'<exit_code>(?P<code>-?\d+)</exit_code>')
+head_type_regex = re.compile(r'"type"\s*:\s*"(?P<value>\w+)"')
+head_tool_use_id_regex = re.compile(r'"tool_use_id"\s*:\s*"(?P<value>[^"]+)"')
+head_tool_use_type_regex = re.compile(r'"type"\s*:\s*"tool_use"')
+head_input_regex = re.compile(r'"input"\s*:')
+head_id_regex = re.compile(r'"id"\s*:\s*"(?P<value>[^"]+)"')
+head_name_regex = re.compile(r'"name"\s*:\s*"(?P<value>[^"]+)"')
+head_is_error_regex = re.compile(r'"is_error"\s*:\s*true')
 
 
 def set_complete(context: dict, value: bool) -> bool:
@@ -48,57 +77,228 @@ def get_error(context: dict) -> bool:
     return value
 
 
+def set_watchdog(context: dict, reason: str) -> str:
+    with context['gil']:
+        context['watchdog'] = reason
+    return reason
+
+
+def touch_output(context: dict) -> None:
+    with context['gil']:
+        context['last_output'] = time.monotonic()
+
+
+def get_last_output(context: dict) -> float:
+    with context['gil']:
+        value = context['last_output']
+    return value
+
+
 def add_unknown_tool(context: dict, tool_name: str, input_values: dict) -> None:
     with context['gil']:
         if tool_name not in context['unknown_tools']:
             context['unknown_tools'][tool_name] = input_values
 
 
-def add_background_tool(context: dict, tool_name: str, tool_input: str, tool_id: str) -> None:
+def start_tool_time(context: dict, tool_use_id: str, tool_name: str) -> None:
+    with context['gil']:
+        context['tool_times'][tool_use_id] = {
+            'name': tool_name,
+            'start': datetime.datetime.now().isoformat(),
+            'started': time.monotonic(),
+        }
+
+
+def end_tool_time(context: dict, tool_use_id: str) -> None:
+    with context['gil']:
+        t = context['tool_times'].get(tool_use_id)
+        if t and 'seconds' not in t:
+            t['seconds'] = round(time.monotonic() - t['started'], 3)
+
+
+def add_background_tool(context: dict, tool_name: str, tool_input: str, tool_id: str, command: str) -> None:
     with context['gil']:
         context['background_tools'][tool_id] = {
             'name': tool_name,
             'input': tool_input,
+            'command': command,
+            'task_id': None,
+            'start': datetime.datetime.now().isoformat(),
+            'started': time.monotonic(),
+            'polls': 0,
+            'status': 'running',
         }
 
 
 def add_background_tool_id(context: dict, tool_id: str, tid: str) -> None:
     with context['gil']:
         context['background_id_to_tool'][tid] = tool_id
+        context['background_tools'][tool_id]['task_id'] = tid
+
+
+def finish_background_tool(task: dict, status: str, exit_code: int | None = None) -> None:
+    # called with the gil held
+    if task['status'] != 'running':
+        return
+    task['status'] = status
+    task['end'] = datetime.datetime.now().isoformat()
+    task['seconds'] = round(time.monotonic() - task['started'], 3)
+    if exit_code is not None:
+        task['exit_code'] = exit_code
+
+
+def add_background_call(context: dict, tool_name: str, tool_use_id: str, tid: str) -> None:
+    with context['gil']:
+        tool_id = context['background_id_to_tool'].get(tid)
+        task = context['background_tools'].get(tool_id)
+        if task is None:
+            return
+        if tool_name in BACKGROUND_STOP_TOOLS:
+            finish_background_tool(task, 'stopped')
+        else:
+            task['polls'] += 1
+            context['background_polls'][tool_use_id] = tool_id
+
+
+def update_background_status(context: dict, tool_use_id: str, text: str) -> None:
+    m = background_status_regex.search(text)
+    if not m or m.group('status') not in BACKGROUND_FINISHED:
+        return
+    code = background_exit_code_regex.search(text)
+    with context['gil']:
+        task = context['background_tools'].get(context['background_polls'].get(tool_use_id))
+        if task is not None:
+            finish_background_tool(task, m.group('status'), int(code.group('code')) if code else None)
 
 
-def run(options: RalpherOptions, prompt: str, iteration: int) -> tuple[bool, bool]:
-    context = make_context(options, prompt, iteration)
+def end_background_tools(context: dict) -> None:
+    # whatever is still running when the agent has exited is orphaned, the process group reaping stops it
+    with context['gil']:
+        for task in context['background_tools'].values():
+            if task['status'] != 'running':
+                continue
+            task['running_at_end'] = True
+            if task['command'] and any(runs_command(r, task['command']) for r in context['reaped']):
+                finish_background_tool(task, 'reaped')
+            else:
+                task['seconds'] = round(time.monotonic() - task['started'], 3)
+
+
+def runs_command(process: dict[str, Any], command: str) -> bool:
+    # the command itself, or a shell given the command as its script
+    argv = process.get('argv') or process['command'].split()
+    if command in argv or command == process['command']:
+        return True
     try:
-        process(options, context)
+        return shlex.split(command) == argv
+    except ValueError:
+        return False
+
+
+def run(
+    options: RalpherOptions,
+    prompt: str,
+    iteration: int,
+    deadline: float | None = None,
+    prepared: dict[str, Any] | None = None,
+    cancel: ralphlib.types.CancelToken | None = None,
+    emit: Callable[[ralphlib.events.Event], None] | None = None,
+) -> dict[str, Any]:
+    # the command, prompt file, agent and host slot prepared by the pipeline, if any
+    prepared = prepared or {}
+    proc = prepared.get('proc')
+    slot = prepared.get('slot')
+    context = make_context(options, prompt, iteration, prepared.get('cmd'), prepared.get('prompt_file'))
+    context['cancel'] = cancel or ralphlib.types.CancelToken()
+    context['emit'] = emit
+    try:
+        if slot is not None:
+            # taken along with the pre-started agent
+            with context['gil']:
+                context['slot_limits'] = slot['limits']
+        elif options.host_slots:
+            slot = wait_for_slot(options, context, deadline)
+            if slot is None:
+                if proc is not None:
+                    ralphlib.procgroup.kill(proc)
+                    proc.wait()
+                return outcome(context)
+        process(options, context, deadline, proc)
     except Exception as e:
         logger.exception(f'Exception in run: {e}')
         raise
     finally:
+        if slot is not None:
+            ralphlib.scheduler.release(slot, context['peak_rss'])
         summary(options, context, iteration)
         unmake_context(context)
-    return context['complete'], context['error']
+    return outcome(context)
 
 
-def make_context(options: RalpherOptions, prompt: str, iteration: int) -> dict[str, Any]:
-    cmd = [options.agent]
-    cmd.extend(shlex.split(options.args))
-    cmd.append(prompt)
+def wait_for_slot(options: RalpherOptions, context: dict[str, Any], deadline: float | None) -> dict[str, Any] | None:
+    started = time.monotonic()
+    slot = ralphlib.scheduler.acquire(options, context['cancel'], deadline)
+    waited = time.monotonic() - started
+    with context['gil']:
+        context['queue_wait_seconds'] = waited
+        context['slot_limits'] = slot['limits'] if slot else None
+    if slot is None:
+        if deadline is not None and time.monotonic() >= deadline:
+            set_watchdog(context, 'budget')
+        log_msg(options, context, f'Gave up waiting for a host slot after {waited:.1f} seconds')
+    elif waited >= 1:
+        log_msg(options, context, f'Got a host slot after {waited:.1f} seconds')
+    return slot
+
+
+def make_cmd(options: RalpherOptions, prompt: str, agent: str | None = None) -> tuple[list[str], pathlib.Path | None]:
+    cmd = [agent or options.agent]
+    args = shlex.split(options.args)
+    prompt_file = None
+    if options.prompt_via == 'file':
+        prompt_file = write_prompt_file(options, prompt)
+        if PROMPT_FILE_PLACEHOLDER in options.args:
+            args = [a.replace(PROMPT_FILE_PLACEHOLDER, str(prompt_file)) for a in args]
+        else:
+            args.append(str(prompt_file))
+    cmd.extend(args)
+    if options.prompt_via == 'argv':
+        cmd.append(prompt)
+    return cmd, prompt_file
+
+
+def make_context(options: RalpherOptions, prompt: str, iteration: int, cmd: list[str] | None = None, prompt_file: pathlib.Path | None = None) -> dict[str, Any]:
+    if cmd is None:
+        cmd, prompt_file = make_cmd(options, prompt)
     context: dict[str, Any] = {
         'background_id_to_tool': {},
+        'background_polls': {},
         'background_tools': {},
+        'cancel': ralphlib.types.CancelToken(),
         'cmd': cmd,
         'complete': False,
+        'emit': None,
         'error': False,
         'gil': threading.Lock(),
         'iteration': iteration,
+        'last_output': time.monotonic(),
         'message_type_queue': [],
+        'peak_rss': 0,
         'progress': None,
         'prompt': prompt,
+        'prompt_file': prompt_file,
+        'queue_wait_seconds': 0.0,
+        'reaped': [],
+        'result': '',
+        'returncode': None,
+        'slot_limits': None,
         'stderr': None,
+        'stderr_tail': collections.deque(maxlen=STDERR_TAIL_LINES),
         'stdout': None,
+        'tool_times': {},
         'tools_used_set': set(),
         'unknown_tools': {},
+        'watchdog': None,
     }
     try:
         if options.stdout:
@@ -114,7 +314,30 @@ def make_context(options: RalpherOptions, prompt: str, iteration: int) -> dict[s
 
 
 def unmake_context(context: dict[str, Any]) -> None:
-    pass
+    if context['prompt_file']:
+        context['prompt_file'].unlink(missing_ok=True)
+
+
+def write_prompt_file(options: RalpherOptions, prompt: str) -> pathlib.Path:
+    # the system temp dir, several loops may share a logdir
+    fd, name = tempfile.mkstemp(prefix='ralpher-prompt-', suffix='.md')
+    with os.fdopen(fd, 'w', encoding='utf-8') as f:
+        f.write(prompt)
+    return pathlib.Path(name)
+
+
+def outcome(context: dict[str, Any]) -> dict[str, Any]:
+    with context['gil']:
+        return {
+            'complete': context['complete'],
+            'error': context['error'],
+            'queue_wait_seconds': context['queue_wait_seconds'],
+            'result': context['result'],
+            'returncode': context['returncode'],
+            'stderr_tail': list(context['stderr_tail']),
+            'tools_used': sorted(context['tools_used_set']),
+            'watchdog': context['watchdog'],
+        }
 
 
 def summary(options: RalpherOptions, context: dict[str, Any], iteration: int) -> None:
@@ -132,16 +355,56 @@ def summary(options: RalpherOptions, context: dict[str, Any], iteration: int) ->
         state_payload['unknown_tools'] = {}
         tools = []
         for t in sorted(context['unknown_tools'].keys()):
-            state_payload['unknown_tools'][t] = context['unknown_tools'][t]
+            state_payload['unknown_tools'][t] = ralphlib.blobs.ref_value(options, context['unknown_tools'][t])
             tools.append(f'- {t}')
             keys = sorted(context['unknown_tools'][t].keys())
             for k in keys:
                 v = context['unknown_tools'][t][k]
-                tools.append(f'  - {k}: {v}')
+                tools.append(f'  - {k}: {ralphlib.blobs.ref_text(options, str(v))}')
 
         tools_summary = '\n'.join(tools)
         lines.append(f'\nUnknown tools used:\n{tools_summary}\n')
 
+    if context['tool_times']:
+        state_payload['tool_times'] = {}
+        for tool_use_id, t in context['tool_times'].items():
+            state_payload['tool_times'][tool_use_id] = {k: v for k, v in t.items() if k != 'started'}
+
+    if context['background_tools']:
+        state_payload['background_tasks'] = {}
+        tasks = []
+        for tool_use_id, t in context['background_tools'].items():
+            state_payload['background_tasks'][tool_use_id] = {k: v for k, v in t.items() if k != 'started'}
+            command = t['command'].splitlines()[0] if t['command'] else t['name']
+            running = ', still running at the end' if t.get('running_at_end') else ''
+            tasks.append(
+                f'- {t["task_id"] or tool_use_id}: {command} ({t.get("seconds", 0):.1f} s, {t["polls"]} poll{"s" if t["polls"] != 1 else ""}, {t["status"]}{running})'
+            )
+        tasks_summary = '\n'.join(tasks)
+        lines.append(f'\nBackground tasks:\n{tasks_summary}\n')
+
+    if context['reaped']:
+        state_payload['reaped'] = [{'pid': r['pid'], 'command': r['command']} for r in context['reaped']]
+        procs = []
+        for r in context['reaped']:
+            procs.append(f'- {r["pid"]}: {r["command"]}')
+        procs_summary = '\n'.join(procs)
+        lines.append(f'\nReaped leftover processes:\n{procs_summary}\n')
+
+    if options.host_slots:
+        state_payload['queue_wait_seconds'] = round(context['queue_wait_seconds'], 3)
+        state_payload['slot_limits'] = context['slot_limits']
+        state_payload['peak_rss'] = context['peak_rss']
+
+    suppressed = ralphlib.logger.limiter.reset()
+    if suppressed:
+        state_payload['log_suppressed'] = suppressed
+        lines.append(f'\nSuppressed {sum(suppressed.values())} repeated log messages\n')
+
+    if context['watchdog']:
+        state_payload['watchdog'] = context['watchdog']
+        lines.append(f'\nStopped by watchdog: {context["watchdog"]}\n')
+
     if lines:
         if context['progress']:
             with context['progress'].open('a', encoding='utf-8') as fd:
@@ -151,6 +414,7 @@ def summary(options: RalpherOptions, context: dict[str, Any], iteration: int) ->
             for line in lines:
                 print(line, end='', flush=True)
 
+    if state_payload:
         ralphlib.state.add_to_state(
             options,
             state_payload,
@@ -159,9 +423,7 @@ def summary(options: RalpherOptions, context: dict[str, Any], iteration: int) ->
         )
 
 
-def process(options: RalpherOptions, context: dict[str, Any]) -> None:
-    import ralphlib.looper
-
+def spawn(options: RalpherOptions, cmd: list[str]) -> subprocess.Popen:
     kwargs = {
         'stdout': subprocess.PIPE,
         'stderr': subprocess.PIPE,
@@ -171,12 +433,29 @@ def process(options: RalpherOptions, context: dict[str, Any]) -> None:
     }
     if options.cwd:
         kwargs['cwd'] = options.cwd
+    if options.prompt_via == 'stdin':
+        kwargs['stdin'] = subprocess.PIPE
+    kwargs.update(ralphlib.procgroup.popen_kwargs(options))
 
     proc = subprocess.Popen(  # noqa: S603
-        context['cmd'],
+        cmd,
         **kwargs,
     )
-    log_msg(options, context, f'Started subprocess {proc.pid}')
+    ralphlib.procgroup.apply_limits(options, proc)
+    return proc
+
+
+def process(
+    options: RalpherOptions,
+    context: dict[str, Any],
+    deadline: float | None = None,
+    proc: subprocess.Popen | None = None,
+) -> None:
+    if proc is None:
+        proc = spawn(options, context['cmd'])
+        log_msg(options, context, f'Started subprocess {proc.pid}')
+    else:
+        log_msg(options, context, f'Using pre-started subprocess {proc.pid}')
 
     # Threads to read and print from each pipe concurrently
     stdout_thread = threading.Thread(
@@ -196,26 +475,88 @@ def process(options: RalpherOptions, context: dict[str, Any]) -> None:
         ),
     )
 
-    stdout_thread.start()
-    stderr_thread.start()
+    threads = [stdout_thread, stderr_thread]
+    if proc.stdin:
+        # the prompt may be larger than the pipe buffer, write it while the output is being read
+        threads.append(
+            threading.Thread(
+                target=process_stdin,
+                args=(
+                    options,
+                    context,
+                    proc.stdin,
+                ),
+            )
+        )
+
+    started = time.monotonic()
+    touch_output(context)
+    for thread in threads:
+        thread.start()
 
     # Wait for the process to complete
     while True:
-        if ralphlib.looper.get_should_exit():
+        if context['cancel'].is_cancelled():
             log_msg(options, context, f'Received termination signal. Terminating subprocess {proc.pid}...')
-            proc.terminate()
+            stop_process(options, context, proc)
             break
 
         if proc.poll() is not None:
             break
 
+        if options.host_slots:
+            # the memory the agent needs decides how many agents fit on this host
+            with context['gil']:
+                context['peak_rss'] = max(context['peak_rss'], ralphlib.procgroup.rss(proc.pid))
+
+        reason = check_watchdog(options, context, started, deadline)
+        if reason:
+            set_watchdog(context, reason)
+            log_msg(options, context, f'Watchdog {reason} reached. Terminating subprocess {proc.pid}...')
+            stop_process(options, context, proc)
+            break
+
         time.sleep(SUBPROCESS_POLL_INTERVAL)
 
+    with context['gil']:
+        context['returncode'] = proc.returncode
     log_msg(options, context, f'Process {proc.pid} exited with code {proc.returncode}')
 
+    # Stop anything the agent left running, it would keep the pipes open
+    if os.name == 'posix':
+        reaped = ralphlib.procgroup.reap(proc.pid)
+        if reaped:
+            with context['gil']:
+                context['reaped'] = reaped
+            log_msg(options, context, f'Reaped {len(reaped)} leftover process{"es" if len(reaped) != 1 else ""} of {proc.pid}')
+
     # Join threads to ensure all output is read
-    stdout_thread.join()
-    stderr_thread.join()
+    for thread in threads:
+        thread.join()
+
+    # only now, the last lines may still report tasks as finished
+    end_background_tools(context)
+
+
+def check_watchdog(options: RalpherOptions, context: dict[str, Any], started: float, deadline: float | None) -> str | None:
+    now = time.monotonic()
+    if deadline is not None and now >= deadline:
+        return 'budget'
+    if options.timeout and now - started >= options.timeout:
+        return 'timeout'
+    if options.idle_timeout and now - get_last_output(context) >= options.idle_timeout:
+        return 'idle'
+    return None
+
+
+def stop_process(options: RalpherOptions, context: dict[str, Any], proc: subprocess.Popen) -> None:
+    ralphlib.procgroup.terminate(proc)
+    try:
+        proc.wait(timeout=TERMINATE_GRACE_PERIOD)
+    except subprocess.TimeoutExpired:
+        log_msg(options, context, f'Subprocess {proc.pid} did not terminate. Killing...')
+        ralphlib.procgroup.kill(proc)
+        proc.wait()
 
 
 def log_msg(options: RalpherOptions, context: dict[str, Any], msg: str) -> None:
@@ -229,6 +570,24 @@ def log_msg(options: RalpherOptions, context: dict[str, Any], msg: str) -> None:
         print_progress_eol(context)
 
 
+def emit_message(context: dict[str, Any], message_type: ralphlib.types.MessageType, message: str) -> None:
+    event: ralphlib.events.Event | None = None
+    if message_type in (ralphlib.types.MessageType.CONTENT_START, ralphlib.types.MessageType.CONTENT_DELTA) and message:
+        event = ralphlib.events.Delta(iteration=context['iteration'], text=message)
+    elif message_type == ralphlib.types.MessageType.TOOL_USE:
+        name, _, tool_input = message.partition('\n')
+        event = ralphlib.events.ToolUse(iteration=context['iteration'], name=name, input=textwrap.dedent(tool_input))
+    elif message_type == ralphlib.types.MessageType.COMPLETE:
+        event = ralphlib.events.Complete(iteration=context['iteration'])
+    if event is None:
+        return
+    try:
+        context['emit'](event)
+    except Exception as e:
+        # a failing consumer must not stop the agent's output from being read
+        logger.exception(f'Exception in event callback: {e}')
+
+
 def newline_required(context: dict[str, Any], message_type: ralphlib.types.MessageType) -> bool:
     newline_types = [
         ralphlib.types.MessageType.COMPLETE,
@@ -258,18 +617,30 @@ def process_stdout(
         if context['progress']:
             progressfd = context['progress'].open('a', encoding='utf-8')
 
-        for line in iter(pipe.readline, ''):
-            line = line.strip()
+        while True:
+            line = pipe.readline(options.max_line_size)
             if not line:
-                continue
+                break
+            touch_output(context)
 
-            if logfd:
-                logfd.write(line + '\n')
+            if len(line) >= options.max_line_size and not line.endswith('\n'):
+                message_type, message = process_oversized_line(options, context, pipe, line, logfd)
+            else:
+                line = line.strip()
+                if not line:
+                    continue
+
+                if logfd:
+                    logfd.write(line + '\n')
+
+                message_type, message = process_line(options, context, line)
 
-            message_type, message = process_line(options, context, line)
             if message_type == ralphlib.types.MessageType.NONE:
                 continue
 
+            if context['emit']:
+                emit_message(context, message_type, message)
+
             if progressfd:
                 if message:
                     progressfd.write(message)
@@ -293,6 +664,98 @@ def process_stdout(
             progressfd.close()
 
 
+def process_oversized_line(
+    options: RalpherOptions,
+    context: dict[str, Any],
+    pipe: io.TextIOWrapper,
+    chunk: str,
+    logfd: io.TextIOWrapper | None,
+) -> tuple[ralphlib.types.MessageType, str]:
+    # the line goes to the raw log chunk by chunk, only its head is kept for inspection
+    head = chunk.lstrip()[:OVERSIZED_HEAD_SIZE]
+    overlap = max((len(stop) for stop in options.stops), default=1) - 1
+    tail = ''
+    stopped = False
+    size = 0
+    while chunk:
+        size += len(chunk)
+        if logfd:
+            logfd.write(chunk)
+        scan = tail + chunk
+        if not stopped and any(stop in scan for stop in options.stops):
+            stopped = True
+        tail = scan[-overlap:] if overlap else ''
+        if chunk.endswith('\n'):
+            break
+        chunk = pipe.readline(options.max_line_size)
+        touch_output(context)
+    if logfd and not chunk.endswith('\n'):
+        logfd.write('\n')
+
+    logger.warning(f'Oversized stdout line of {size} characters, iteration {context["iteration"]}: {head[:200]}')
+    return process_head(options, context, head, stopped)
+
+
+def process_head(
+    options: RalpherOptions,
+    context: dict[str, Any],
+    head: str,
+    stopped: bool,
+) -> tuple[ralphlib.types.MessageType, str]:
+    m = head_type_regex.search(head)
+    ptype = m.group('value') if m else ''
+
+    if ptype == 'user':
+        m = head_tool_use_id_regex.search(head)
+        if m:
+            tool_use_id = m.group('value')
+            end_tool_time(context, tool_use_id)
+            if tool_use_id in context['background_tools']:
+                m = tool_id_regex.search(head)
+                if m:
+                    add_background_tool_id(context, tool_use_id, m.group('id'))
+        return ralphlib.types.MessageType.NONE, ''
+
+    if ptype == 'assistant':
+        tool_use = head_tool_use(head)
+        if tool_use:
+            position, tool_use_id, tool_name = tool_use
+            # like process_assistant, a marker in a text block before the tool use completes, one in its input does not
+            if any(stop in head[:position] for stop in options.stops):
+                set_complete(context, True)
+                return ralphlib.types.MessageType.COMPLETE, ''
+            if tool_name == 'UNKNOWN-TOOL':
+                logger.warning(f'Oversized tool use without name: {head[:200]}')
+            context['tools_used_set'].add(tool_name)
+            if tool_use_id:
+                start_tool_time(context, tool_use_id, tool_name)
+            return ralphlib.types.MessageType.TOOL_USE, f'{tool_name}\n  (input too large to show)'
+
+    if ptype == 'result' and head_is_error_regex.search(head):
+        set_error(context, True)
+        return ralphlib.types.MessageType.ERROR, 'oversized error result'
+
+    if stopped and ptype in ['assistant', 'result']:
+        set_complete(context, True)
+        return ralphlib.types.MessageType.COMPLETE, ''
+
+    return ralphlib.types.MessageType.NONE, ''
+
+
+def head_tool_use(head: str) -> tuple[int, str, str] | None:
+    # position, id and name of the first tool use in the head, whatever the order of its keys
+    m = head_tool_use_type_regex.search(head)
+    if not m:
+        return None
+    start = max(0, head.rfind('{', 0, m.start()))
+    # the input may be cut off and may have id and name keys of its own
+    m_input = head_input_regex.search(head, start + 1)
+    keys = head[start : m_input.start() if m_input else len(head)]
+    m_id = head_id_regex.search(keys)
+    m_name = head_name_regex.search(keys)
+    return start, m_id.group('value') if m_id else '', m_name.group('value') if m_name else 'UNKNOWN-TOOL'
+
+
 def print_progress(
     context: dict[str, Any],
     message_type: ralphlib.types.MessageType,
@@ -313,6 +776,22 @@ def print_progress_eol(context: dict[str, Any]) -> None:
         print('', flush=True)
 
 
+def process_stdin(
+    options: RalpherOptions,
+    context: dict[str, Any],
+    pipe: io.TextIOWrapper,
+) -> None:
+    try:
+        pipe.write(context['prompt'])
+        pipe.flush()
+    except OSError as e:
+        logger.warning(f'Agent closed stdin before the prompt was written, iteration {context["iteration"]}: {e}')
+    finally:
+        # closing flushes what is left, which fails the same way when the agent is gone
+        with contextlib.suppress(OSError):
+            pipe.close()
+
+
 def process_stderr(
     options: RalpherOptions,
     context: dict[str, Any],
@@ -323,7 +802,16 @@ def process_stderr(
         if context['stderr']:
             logfd = context['stderr'].open('a', encoding='utf-8')
 
-        for line in iter(pipe.readline, ''):
+        oversized = False
+        for line in iter(lambda: pipe.readline(options.max_line_size), ''):
+            touch_output(context)
+            if oversized or (len(line) >= options.max_line_size and not line.endswith('\n')):
+                # pass long lines straight through to the log
+                if logfd:
+                    logfd.write(line)
+                oversized = not line.endswith('\n')
+                continue
+
             line = line.strip()
             if not line:
                 continue
@@ -331,6 +819,9 @@ def process_stderr(
             if logfd:
                 logfd.write(line + '\n')
 
+            with context['gil']:
+                context['stderr_tail'].append(line)
+
             if not options.quiet:
                 print_error(context, line)
     finally:
@@ -390,10 +881,14 @@ def process_user(
             if content:
                 for c in content:
                     tool_use_id = c.get('tool_use_id')
+                    if tool_use_id:
+                        end_tool_time(context, tool_use_id)
+                    if tool_use_id and tool_use_id in context['background_polls']:
+                        update_background_status(context, tool_use_id, tool_result_text(c))
                     if tool_use_id and tool_use_id in context['background_tools']:
                         tool_type = c.get('type', '')
                         if tool_type == 'tool_result':
-                            cs = c.get('content', '')
+                            cs = tool_result_text(c)
                             if cs:
                                 m = tool_id_regex.match(cs)
                                 if m:
@@ -410,9 +905,6 @@ def process_assistant(
     payload: dict[str, Any],
     line: str,
 ) -> tuple[ralphlib.types.MessageType, str]:
-    background_tools_list = ['Bash']
-    background_task_tool_name = ['TaskOutput', 'TaskStop']
-
     message = payload.get('message', {})
     if message:
         content = message.get('content', [])
@@ -434,25 +926,29 @@ def process_assistant(
                         logger.warning(f'Tool use without name: {line}')
 
                     context['tools_used_set'].add(tool_name)
+                    if c.get('id'):
+                        start_tool_time(context, c['id'], tool_name)
                     vals = [tool_name]
                     tool_input = get_tool_input(c)
-                    if tool_input:
-                        if tool_name in background_task_tool_name and tool_input in context['background_id_to_tool']:
-                            tool_id = context['background_id_to_tool'][tool_input]
-                            vals.append(context['background_tools'][tool_id]['name'])
-                            vals.append(context['background_tools'][tool_id]['input'])
-                        else:
-                            vals.append(tool_input)
-                            if run_in_background:
-                                vals.append('(running in background)')
+                    task_id = get_task_id(c) if tool_name in BACKGROUND_POLL_TOOLS + BACKGROUND_STOP_TOOLS else ''
+                    if task_id in context['background_id_to_tool']:
+                        # polls and stops are labelled with the task, their input may only be its id
+                        tool_id = context['background_id_to_tool'][task_id]
+                        vals.append(context['background_tools'][tool_id]['name'])
+                        vals.append(context['background_tools'][tool_id]['input'])
+                        add_background_call(context, tool_name, c.get('id', ''), task_id)
+                    elif tool_input:
+                        vals.append(tool_input)
+                        if run_in_background:
+                            vals.append('(running in background)')
                     else:
                         logger.warning(f'Tool {tool_name} without input: {line}')
                         add_unknown_tool(context, tool_name, c.get('input', {}))
 
                     # catch starting background tool uses
                     if run_in_background:
-                        if tool_name in background_tools_list:
-                            add_background_tool(context, tool_name, tool_input, c.get('id', ''))
+                        if tool_name in BACKGROUND_TOOLS:
+                            add_background_tool(context, tool_name, tool_input, c.get('id', ''), str(c.get('input', {}).get('command', '')))
                         else:
                             logger.warning(f'Tool {tool_name} not in known background tools list: {line}')
 
@@ -476,6 +972,21 @@ def get_run_in_background(content: dict[str, Any]) -> bool:
     return False
 
 
+def get_task_id(content: dict[str, Any]) -> str:
+    input_field = content.get('input', {})
+    for f in ('task_id', 'bash_id', 'shell_id'):
+        if input_field.get(f):
+            return str(input_field[f])
+    return ''
+
+
+def tool_result_text(content: dict[str, Any]) -> str:
+    cs = content.get('content', '')
+    if isinstance(cs, list):
+        return '\n'.join(c.get('text', '') for c in cs if isinstance(c, dict))
+    return cs if isinstance(cs, str) else ''
+
+
 def get_tool_input(content: dict[str, Any]) -> str:
     tool_input = ''
     input_field = content.get('input', {})
@@ -511,6 +1022,9 @@ def process_result(
     subtype = payload.get('subtype', '')
     is_error = payload.get('is_error', False)
     result = payload.get('result', '')
+    if isinstance(result, str):
+        with context['gil']:
+            context['result'] = result
 
     # errors
     if subtype == 'success' and is_error:
@@ -1,9 +1,55 @@
+import collections
 import pathlib
-from typing import TYPE_CHECKING
+import sys
+import threading
+from typing import TYPE_CHECKING, Any
+
+from loguru import logger
 
 if TYPE_CHECKING:
     from ralphlib.options import RalpherOptions
 
+LIMITED_LEVEL = 30  # WARNING and below are rate limited, errors always get through
+
+
+class LogLimiter:
+    def __init__(self) -> None:
+        self.lock = threading.Lock()
+        self.max_repeats = 0
+        self.max_per_site = 0
+        self.messages: collections.Counter[tuple[str, str]] = collections.Counter()
+        self.sites: collections.Counter[str] = collections.Counter()
+        self.suppressed: collections.Counter[str] = collections.Counter()
+
+    # runs once per message in the logging thread, before the handlers see it
+    def patch(self, record: dict[str, Any]) -> None:
+        if record['level'].no > LIMITED_LEVEL:
+            return
+        site = f'{record["name"]}:{record["line"]}'
+        key = (site, record['message'])
+        with self.lock:
+            self.sites[site] += 1
+            self.messages[key] += 1
+            if (self.max_repeats and self.messages[key] > self.max_repeats) or (self.max_per_site and self.sites[site] > self.max_per_site):
+                self.suppressed[site] += 1
+                record['extra']['suppressed'] = True
+
+    @staticmethod
+    def allowed(record: dict[str, Any]) -> bool:
+        return 'suppressed' not in record['extra']
+
+    # starts counting afresh, returns the messages dropped since the last reset per call site
+    def reset(self) -> dict[str, int]:
+        with self.lock:
+            suppressed = dict(self.suppressed)
+            self.messages.clear()
+            self.sites.clear()
+            self.suppressed.clear()
+        return suppressed
+
+
+limiter = LogLimiter()
+
 
 def init(options: RalpherOptions) -> None:
     if options.logdir:
@@ -11,6 +57,21 @@ def init(options: RalpherOptions) -> None:
         logdir.mkdir(parents=True, exist_ok=True)
 
 
+def configure(options: RalpherOptions) -> None:
+    # enqueued sinks, the reader threads only hand messages over and never wait for the terminal or disk
+    limiter.max_repeats = options.log_repeats
+    limiter.max_per_site = options.log_per_site
+    logger.remove()
+    logger.configure(patcher=limiter.patch)
+    logger.add(sys.stderr, level=options.log_level, serialize=options.log_json, enqueue=True, filter=limiter.allowed)
+    if options.log_file:
+        path = pathlib.Path(options.log_file)
+        if options.logdir:
+            path = log_dir(options) / path
+        path.parent.mkdir(parents=True, exist_ok=True)
+        logger.add(path, level=options.log_level, serialize=options.log_json, enqueue=True, filter=limiter.allowed, encoding='utf-8')
+
+
 def log_dir(options: RalpherOptions) -> pathlib.Path:
     if not options.logdir:
         raise ValueError('logdir is not set')
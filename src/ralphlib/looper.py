@@ -1,36 +1,33 @@
+import dataclasses
 import datetime
-import os
+import pathlib
 import signal
 import sys
-import threading
+import time
 import types
-from typing import TYPE_CHECKING
+from typing import TYPE_CHECKING, Any
 
 import colorama
 from loguru import logger
 
+import ralphlib.blobs
+import ralphlib.checks
+import ralphlib.convergence
+import ralphlib.digest
+import ralphlib.events
 import ralphlib.iteration
 import ralphlib.logger
+import ralphlib.pipeline
 import ralphlib.printer
+import ralphlib.retry
 import ralphlib.state
 import ralphlib.templater
+import ralphlib.types
 
 if TYPE_CHECKING:
-    from ralphlib.options import RalpherOptions
-
-should_exit = False
-should_exit_lock = threading.Lock()
-
+    from collections.abc import Callable
 
-def set_should_exit(value: bool) -> None:
-    global should_exit
-    with should_exit_lock:
-        should_exit = value
-
-
-def get_should_exit() -> bool:
-    with should_exit_lock:
-        return should_exit
+    from ralphlib.options import RalpherOptions
 
 
 class GracefulTerminator:
@@ -39,7 +36,8 @@ class GracefulTerminator:
     SECOND_MESSAGE = '→ Exiting now!'
     EXIT_CODE = 130
 
-    def __init__(self) -> None:
+    def __init__(self, cancel: ralphlib.types.CancelToken) -> None:
+        self.cancel = cancel
         self.first_press = None
         self.is_shutting_down = False
         signal.signal(signal.SIGINT, self.handler)
@@ -68,16 +66,43 @@ class GracefulTerminator:
 
     def perform_shutdown(self) -> None:
         self.is_shutting_down = True
-        set_should_exit(True)
+        self.cancel.cancel()
 
 
 def loop(options: RalpherOptions) -> None:
     colorama.just_fix_windows_console()
-    _terminator = GracefulTerminator()
+    cancel = ralphlib.types.CancelToken()
+    _terminator = GracefulTerminator(cancel)
+
+    options = resolve_paths(options)
+    try:
+        content = load_prompt(options)
+    except ValueError as e:
+        sys.exit(f'Error: {e}')
+
+    ralphlib.logger.configure(options)
+    try:
+        run_loop(options, content, cancel)
+    finally:
+        logger.complete()
+
+
+def resolve_paths(options: RalpherOptions) -> RalpherOptions:
+    # paths relative to --cwd, without changing the working directory of the process
+    if not options.cwd:
+        return options
+    cwd = pathlib.Path(options.cwd).expanduser().absolute()
+    changes = {'cwd': str(cwd)}
+    if options.prompt:
+        changes['prompt'] = str(cwd / pathlib.Path(options.prompt).expanduser())
+    if options.logdir:
+        changes['logdir'] = str(cwd / pathlib.Path(options.logdir).expanduser())
+    elif options.stdout or options.stderr or options.progress or options.state or options.log_file:
+        changes['logdir'] = str(cwd)
+    return dataclasses.replace(options, **changes)
 
-    if options.cwd:
-        os.chdir(options.cwd)
 
+def load_prompt(options: RalpherOptions) -> str:
     content = ''
     if options.prompt:
         with open(options.prompt, 'r', encoding='utf-8') as f:
@@ -85,8 +110,17 @@ def loop(options: RalpherOptions) -> None:
     elif options.prompts:
         content = options.prompts
     if not content:
-        sys.exit('Error: No prompt provided. Use --prompt or provide a prompt as a positional argument.')
+        raise ValueError('No prompt provided. Use --prompt or provide a prompt as a positional argument.')
+    return content
+
 
+def run_loop(
+    options: RalpherOptions,
+    content: str,
+    cancel: ralphlib.types.CancelToken,
+    emit: Callable[[ralphlib.events.Event], None] | None = None,
+) -> ralphlib.events.LoopEnd:
+    emit = emit or no_emit
     ralphlib.logger.init(options)
 
     start = datetime.datetime.now()
@@ -96,7 +130,7 @@ def loop(options: RalpherOptions) -> None:
     ralphlib.printer.prt(options, f'Start at {now}\n\n', 0)
     ralphlib.printer.prt(options, f'Agent:\n{options.agent}\n\n', 0)
     ralphlib.printer.prt(options, f'Args:\n{options.args}\n\n', 0)
-    ralphlib.printer.prt(options, f'Prompt:\n{content}\n\n', 0)
+    ralphlib.printer.prt(options, f'Prompt:\n{content}\n\n', 0, file_s=f'Prompt:\n{ralphlib.blobs.ref_text(options, content)}\n\n')
     ralphlib.printer.prt(options, f'Iterations: {options.iterations}\n\n', 0)
 
     # state json
@@ -104,39 +138,85 @@ def loop(options: RalpherOptions) -> None:
         'start': now,
         'agent': options.agent,
         'args': options.args,
-        'prompt': content,
+        'prompt': ralphlib.blobs.ref_value(options, content),
         'max_iterations': options.iterations,
     }
     ralphlib.state.add_to_state(options, new_state)
+    emit(ralphlib.events.LoopStart(prompt=content, max_iterations=options.iterations))
 
     loop_times = []
+    stopped: list[str] = []
+    deadline = time.monotonic() + options.budget if options.budget else None
+    convergence = ralphlib.convergence.make_tracker(options) if options.converge else None
+    checks = None
+    checks_cache: dict = {}
+    digest = ralphlib.digest.make_digest(options) if ralphlib.digest.used(content) else None
+    # only prompts that ask for the check results are rendered for them, others may not be templates at all
+    checks_used = ralphlib.checks.enabled(options) and 'checks' in ralphlib.templater.variables(content)
+    # the prompt can only be rendered ahead when it does not depend on this iteration's outcome
+    render_ahead = not checks_used and digest is None
+    pacer = ralphlib.retry.TokenBucket(options.launches_per_minute) if options.launches_per_minute else None
+    total_retries = 0
+    total_retry_wait = 0.0
+    total_queue_wait = 0.0
+    pipeline = ralphlib.pipeline.Pipeline(options, pacer) if options.pipeline else None
 
     for i in range(1, options.iterations + 1):
+        if deadline is not None and time.monotonic() >= deadline:
+            s = f'\n{"=" * 5} Loop budget exhausted, stopping before iteration {i}. {"=" * 5}\n\n'
+            ralphlib.printer.prt(options, s, 0)
+            stopped = ['budget']
+            ralphlib.state.add_to_state(options, {'watchdog': 'budget', 'stopped': stopped})
+            break
+
         loop_start = datetime.datetime.now()
         now = loop_start.isoformat()
 
         print_both(options, f'\n\n{"-" * 80}\n\n', i)
-        p = ralphlib.templater.render(options, content, i)
-        s = f'\nStarting iteration {i}/{options.iterations} at {now}\n\nPrompt:\n{p}\n\n'
-        print_both(options, s, i)
+        prepared = pipeline.take(i) if pipeline else None
+        p = prepared['prompt'] if prepared else None
+        if p is None:
+            template_context = {}
+            if checks_used:
+                template_context['checks'] = checks
+            if digest is not None:
+                template_context.update(ralphlib.digest.context(options, digest))
+            p = ralphlib.templater.render(options, content, i, template_context)
+        s = f'\nStarting iteration {i}/{options.iterations} at {now}\n\nPrompt:\n'
+        print_both(options, f'{s}{p}\n\n', i, file_s=f'{s}{ralphlib.blobs.ref_text(options, p)}\n\n')
+        emit(ralphlib.events.IterationStart(iteration=i, prompt=p))
 
         # state json
         iterations_key = ralphlib.logger.iteration_to_str(options, i)
         state_payload = {
             'start': loop_start.isoformat(),
+            'prompt': ralphlib.blobs.ref_value(options, p),
         }
+        for name in ('stdout', 'stderr', 'progress'):
+            file = getattr(options, name)
+            if file:
+                state_payload[name] = str(ralphlib.logger.log_file(options, file, i).absolute())
         ralphlib.state.add_to_state(options, state_payload, key1='iterations', key2=iterations_key)
 
+        if pipeline and i < options.iterations:
+            pipeline.start(i + 1, content, render=render_ahead)
+
         # run the iteration
         try:
-            complete, error = ralphlib.iteration.run(options, prompt=p, iteration=i)
+            outcome = run_iteration(options, p, i, deadline, pacer, cancel, emit, prepared)
         except Exception as e:
             logger.exception(f'Exception during iteration {i}: {e}')
             s = f'\nException during iteration {i}\n'
             ralphlib.printer.prt(options, s, 0)
             ralphlib.printer.prt(options, s, i)
+            stopped = ['exception']
+            ralphlib.state.add_to_state(options, {'stopped': stopped})
             break
 
+        total_retries += outcome['retries']
+        total_retry_wait += outcome['retry_wait_seconds']
+        total_queue_wait += outcome['queue_wait_seconds']
+
         loop_end = datetime.datetime.now()
         now = loop_end.isoformat()
         loop_td = loop_end - loop_start
@@ -158,19 +238,69 @@ def loop(options: RalpherOptions) -> None:
         }
         ralphlib.state.add_to_state(options, state_payload, key1='iterations', key2=iterations_key)
 
-        if complete or error or get_should_exit():
+        complete = outcome['complete']
+        error = outcome['error']
+        watchdog = outcome['watchdog']
+        watchdog_stop = watchdog == 'budget' or (watchdog is not None and options.on_timeout == 'stop')
+        if watchdog == 'budget':
+            ralphlib.state.add_to_state(options, {'watchdog': 'budget'})
+
+        iteration_checks = None
+        if ralphlib.checks.enabled(options) and not (error or watchdog == 'budget' or cancel.is_cancelled()):
+            checks = iteration_checks = ralphlib.checks.run(options, checks_cache)
+            s = f'\nChecks {"passed" if checks["passed"] else "failed"}:\n{ralphlib.checks.summary_lines(checks)}\n'
+            print_both(options, s, i)
+            ralphlib.state.add_to_state(options, {'checks': checks}, key1='iterations', key2=iterations_key)
+            if complete and not checks['passed']:
+                complete = False
+                print_both(options, '\nCompletion claimed but checks failed, continuing\n', i)
+            elif checks['passed'] and options.check_complete:
+                complete = True
+
+        ralphlib.state.add_to_state(options, {'complete': complete, 'error': error}, key1='iterations', key2=iterations_key)
+        if digest is not None:
+            ralphlib.digest.add(options, digest, i, dict(outcome, complete=complete, error=error), iteration_checks, loop_td.total_seconds())
+        emit(ralphlib.events.IterationEnd(iteration=i, seconds=loop_td.total_seconds(), outcome=dict(outcome, complete=complete, error=error)))
+
+        converged = False
+        backoff = 0.0
+        if convergence is not None and not (complete or error):
+            verdict = ralphlib.convergence.update(options, convergence, outcome)
+            ralphlib.state.add_to_state(options, {'convergence': verdict}, key1='iterations', key2=iterations_key)
+            if verdict['converged']:
+                if options.converge_action == 'stop':
+                    converged = True
+                    ralphlib.state.add_to_state(options, {'converged': i})
+                else:
+                    backoff = verdict['backoff_seconds']
+
+        if complete or error or watchdog_stop or converged or cancel.is_cancelled():
             words = []
             if complete:
                 words.append('complete')
             if error:
                 words.append('error')
-            if get_should_exit():
+            if watchdog_stop:
+                words.append(watchdog)
+            if converged:
+                words.append('converged')
+            if cancel.is_cancelled():
                 words.append('termination')
+            ralphlib.state.add_to_state(options, {'stopped': words})
+            stopped = words
 
             s = f'\n{"=" * 5} Loop {", ".join(words)} signal received, stopping after {i} iteration{"s" if i != 1 else ""}. {"=" * 5}\n\n'
             print_both(options, s, i)
             break
 
+        if backoff and i < options.iterations:
+            s = f'\nNo progress for {convergence["stale"]} iterations, waiting {timedelta_to_readable(datetime.timedelta(seconds=backoff))} before the next iteration\n'
+            print_both(options, s, i)
+            cancel.wait(backoff)
+
+    if pipeline:
+        pipeline.discard()
+
     ralphlib.printer.prt(options, '\n\nLoop times\n\n', 0)
     num_loops = len(loop_times)
     num_loops_str_len = len(str(num_loops))
@@ -189,15 +319,84 @@ def loop(options: RalpherOptions) -> None:
     # state json
     new_state = {
         'end': now,
+        'retries': total_retries,
+        'retry_wait_seconds': round(total_retry_wait, 3),
+        'queue_wait_seconds': round(total_queue_wait, 3),
         'total_time_readable': readable,
         'total_time_seconds': td.total_seconds(),
     }
     ralphlib.state.add_to_state(options, new_state)
 
+    loop_end_event = ralphlib.events.LoopEnd(iterations=len(loop_times), seconds=td.total_seconds(), stopped=stopped)
+    emit(loop_end_event)
+    return loop_end_event
+
+
+def no_emit(event: ralphlib.events.Event) -> None:
+    pass
+
+
+def run_iteration(
+    options: RalpherOptions,
+    prompt: str,
+    iteration: int,
+    deadline: float | None,
+    pacer: ralphlib.retry.TokenBucket | None,
+    cancel: ralphlib.types.CancelToken,
+    emit: Callable[[ralphlib.events.Event], None],
+    prepared: dict[str, Any] | None = None,
+) -> dict[str, Any]:
+    retries = 0
+    waited = 0.0
+    queued = 0.0
+    while True:
+        # a pre-started agent already took its launch from the pacer
+        if pacer is not None and (prepared is None or prepared['proc'] is None):
+            wait = pacer.reserve()
+            if wait > 0:
+                print_both(options, f'\nPacing agent launches, waiting {wait:.1f} seconds\n', iteration)
+                cancel.wait(wait)
+                waited += wait
+
+        outcome = ralphlib.iteration.run(options, prompt=prompt, iteration=iteration, deadline=deadline, prepared=prepared, cancel=cancel, emit=emit)
+        queued += outcome['queue_wait_seconds']
+        # a retry always starts a fresh agent, its prompt file is gone with the iteration
+        prepared = None
+        failure = ralphlib.retry.classify(outcome)
+        if failure != ralphlib.retry.TRANSIENT or retries >= options.retries or cancel.is_cancelled():
+            break
+
+        delay = ralphlib.retry.backoff_delay(options, retries + 1)
+        # no retry that would only start once the budget ran out
+        if deadline is not None and time.monotonic() + delay >= deadline:
+            break
+        retries += 1
+        s = f'\nTransient failure in iteration {iteration}, retry {retries}/{options.retries} in {delay:.1f} seconds\n'
+        print_both(options, s, iteration)
+        cancel.wait(delay)
+        waited += delay
+
+    if failure == ralphlib.retry.FATAL:
+        outcome['error'] = True
+    outcome['failure'] = failure
+    outcome['retries'] = retries
+    outcome['retry_wait_seconds'] = waited
+    outcome['queue_wait_seconds'] = queued
+    if failure or retries or waited:
+        state_payload = {
+            'failure': failure,
+            'retries': retries,
+            'retry_wait_seconds': round(waited, 3),
+        }
+        if retries and options.host_slots:
+            state_payload['queue_wait_seconds'] = round(queued, 3)
+        ralphlib.state.add_to_state(options, state_payload, key1='iterations', key2=ralphlib.logger.iteration_to_str(options, iteration))
+    return outcome
+
 
-def print_both(options: RalpherOptions, s: str, iteration: int) -> None:
-    ralphlib.printer.prt(options, s, 0)
-    ralphlib.printer.prt(options, s, iteration, dont_print=True)
+def print_both(options: RalpherOptions, s: str, iteration: int, file_s: str | None = None) -> None:
+    ralphlib.printer.prt(options, s, 0, file_s=file_s)
+    ralphlib.printer.prt(options, s, iteration, dont_print=True, file_s=file_s)
 
 
 def timedelta_to_readable(td: datetime.timedelta, show_seconds: bool = True) -> str:
@@ -1,5 +1,6 @@
 import dataclasses
-from typing import Annotated
+import sys
+from typing import Annotated, Literal
 
 import cappa
 
@@ -76,8 +77,285 @@ class RalpherOptions:
             '<promise>COMPLETE</promise>',
         ]
     )
+    timeout: Annotated[
+        float | None,
+        cappa.Arg(long=True, help='Maximum seconds an iteration may run before the agent is stopped'),
+    ] = None
+    idle_timeout: Annotated[
+        float | None,
+        cappa.Arg(long=True, help='Maximum seconds without agent output on stdout or stderr before the agent is stopped'),
+    ] = None
+    budget: Annotated[
+        float | None,
+        cappa.Arg(long=True, help='Maximum seconds for the whole run. The running agent is stopped and no further iterations are started.'),
+    ] = None
+    on_timeout: Annotated[
+        Literal['continue', 'stop'],
+        cappa.Arg(long=True, help='What to do after an iteration hits --timeout or --idle-timeout: continue with the next iteration or stop the loop'),
+    ] = 'continue'
+    retries: Annotated[
+        int,
+        cappa.Arg(long=True, help='Number of times to retry an iteration that failed transiently, e.g. rate limited or overloaded'),
+    ] = 3
+    retry_delay: Annotated[
+        float,
+        cappa.Arg(long=True, help='Seconds to wait before the first retry, doubled for every further retry, with jitter'),
+    ] = 30
+    retry_max_delay: Annotated[
+        float,
+        cappa.Arg(long=True, help='Maximum seconds to wait before a retry'),
+    ] = 600
+    launches_per_minute: Annotated[
+        float | None,
+        cappa.Arg(long=True, help='Maximum number of agent launches per minute, iterations and retries included'),
+    ] = None
+    max_line_size: Annotated[
+        int,
+        cappa.Arg(
+            long=True,
+            help='Longest agent output line, in characters, that is parsed in full. Longer lines are streamed to the raw log and only their head is inspected.',
+        ),
+    ] = 1024 * 1024
+    pipeline: Annotated[
+        bool,
+        cappa.Arg(
+            long=True,
+            help='Prepare the next iteration while the current one runs: render its prompt where possible, build its command, write its prompt file with --prompt-via file, create its log files and, with --prompt-via stdin, start its agent so it only has to be given the prompt',
+        ),
+    ] = False
+    prompt_via: Annotated[
+        Literal['argv', 'stdin', 'file'],
+        cappa.Arg(
+            long=True,
+            help='How the rendered prompt is given to the agent: as the last argument, written to its stdin, or written to a temporary file whose path replaces {prompt_file} in --args (or is appended to the arguments)',
+        ),
+    ] = 'argv'
+    checks: Annotated[
+        list[str],
+        cappa.Arg(
+            long=True,
+            help='Completion check command, e.g. a test suite or linter, run in --cwd at the end of every iteration. A claimed completion only counts if all checks pass. Can be given multiple times.',
+        ),
+    ] = dataclasses.field(default_factory=list)
+    check_files: Annotated[
+        list[str],
+        cappa.Arg(long=True, help='Completion check that passes when the file exists, relative to --cwd. Can be given multiple times.'),
+    ] = dataclasses.field(default_factory=list)
+    check_timeout: Annotated[
+        float,
+        cappa.Arg(long=True, help='Maximum seconds a single check command may run'),
+    ] = 600
+    check_jobs: Annotated[
+        int,
+        cappa.Arg(long=True, help='Number of check commands to run in parallel'),
+    ] = 4
+    check_complete: Annotated[
+        bool,
+        cappa.Arg(long=True, help='Treat the loop as complete as soon as all checks pass, even without a completion marker'),
+    ] = False
+    converge: Annotated[
+        list[Literal['workspace', 'git', 'tools', 'result']],
+        cappa.Arg(
+            long=True,
+            help='Progress check to run between iterations: workspace (file sizes and times under --cwd), git (HEAD, status and diff --stat of --cwd), tools (set of tools used) or result (similarity of the final result text). Can be given multiple times.',
+        ),
+    ] = dataclasses.field(default_factory=list)
+    converge_after: Annotated[
+        int,
+        cappa.Arg(long=True, help='Number of iterations in a row without progress, according to --converge, before the loop has converged'),
+    ] = 3
+    converge_action: Annotated[
+        Literal['stop', 'backoff'],
+        cappa.Arg(long=True, help='What to do once the loop has converged: stop, or wait before each further iteration'),
+    ] = 'stop'
+    converge_backoff: Annotated[
+        float,
+        cappa.Arg(
+            long=True, help='Seconds to wait after the loop has converged with --converge-action backoff, doubled for every further iteration without progress'
+        ),
+    ] = 30
+    converge_similarity: Annotated[
+        float,
+        cappa.Arg(long=True, help='Result texts at least this similar (0 to 1) count as no progress for --converge result'),
+    ] = 0.95
+    rlimit_as: Annotated[
+        int | None,
+        cappa.Arg(long=True, help='Limit the address space of the agent process, in MiB (RLIMIT_AS)'),
+    ] = None
+    rlimit_cpu: Annotated[
+        int | None,
+        cappa.Arg(long=True, help='Limit the CPU time of the agent process, in seconds (RLIMIT_CPU)'),
+    ] = None
+    rlimit_nofile: Annotated[
+        int | None,
+        cappa.Arg(long=True, help='Limit the number of open files of the agent process (RLIMIT_NOFILE)'),
+    ] = None
+    digest_iterations: Annotated[
+        int,
+        cappa.Arg(long=True, help='Previous iterations available to the prompt template as history and history_text'),
+    ] = 5
+    digest_bytes: Annotated[
+        int,
+        cappa.Arg(long=True, help='Size limit of history_text in bytes, older iterations and long results are cut to fit'),
+    ] = 4000
+    host_slots: Annotated[
+        int | None,
+        cappa.Arg(
+            long=True,
+            help='Run at most this many agents at once on this host, shared by all loops using the same --slots-dir. Fewer slots are handed out while the load average or the available memory does not leave room for another agent.',
+        ),
+    ] = None
+    slots_dir: Annotated[
+        str | None,
+        cappa.Arg(long=True, help='Directory of the slot table shared by loops with --host-slots, by default ~/.cache/ralpher'),
+    ] = None
+    no_blobs: Annotated[
+        bool,
+        cappa.Arg(long=True, help='Write prompts and large payloads into the state and progress files instead of the blob store in the logdir'),
+    ] = False
+    blob_min_size: Annotated[
+        int,
+        cappa.Arg(long=True, help='Prompts and payloads of at least this many bytes are kept in the blob store and referenced by their hash'),
+    ] = 1024
+    blob_compression: Annotated[
+        Literal['gzip', 'none'],
+        cappa.Arg(long=True, help='Compression of new blobs'),
+    ] = 'gzip'
+    log_level: Annotated[
+        Literal['TRACE', 'DEBUG', 'INFO', 'SUCCESS', 'WARNING', 'ERROR', 'CRITICAL'],
+        cappa.Arg(long=True, help='Minimum level of internal log messages'),
+    ] = 'INFO'
+    log_file: Annotated[
+        str | None,
+        cappa.Arg(long=True, help='Write internal log messages to this file, in the logdir if one is given'),
+    ] = None
+    log_json: Annotated[
+        bool,
+        cappa.Arg(long=True, help='Write internal log messages as JSON lines'),
+    ] = False
+    log_repeats: Annotated[
+        int,
+        cappa.Arg(long=True, help='Identical log messages from the same place kept per iteration, further ones are counted and dropped'),
+    ] = 3
+    log_per_site: Annotated[
+        int,
+        cappa.Arg(long=True, help='Log messages from the same place kept per iteration, further ones are counted and dropped'),
+    ] = 50
+
+
+@dataclasses.dataclass
+class QueryOptions:
+    """ralpher query
+
+    index the state and stdout files of a logdir into SQLite and run a report
+    """
+
+    report: Annotated[
+        Literal['runs', 'slowest-tools', 'tool-mix', 'tasks', 'errors', 'cost'],
+        cappa.Arg(help='Report to run', value_name='REPORT'),
+    ] = 'runs'
+    logdir: Annotated[
+        str,
+        cappa.Arg(long=True, help='Directory with ralpher state and stdout files, searched recursively'),
+    ] = '.'
+    db: Annotated[
+        str | None,
+        cappa.Arg(long=True, help='SQLite database file. Default: ralpher.sqlite3 in logdir'),
+    ] = None
+    since: Annotated[
+        float | None,
+        cappa.Arg(long=True, help='Only report on runs started in the last SINCE days'),
+    ] = None
+    limit: Annotated[
+        int,
+        cappa.Arg(long=True, help='Maximum number of rows'),
+    ] = 20
+    json: Annotated[
+        bool,
+        cappa.Arg(long=True, help='Print rows as JSON'),
+    ] = False
+    no_index: Annotated[
+        bool,
+        cappa.Arg(long=True, help='Report on the database as it is, without indexing new files first'),
+    ] = False
+
+
+@dataclasses.dataclass
+class WatchOptions:
+    """ralpher watch
+
+    follow the runs in one or more logdirs
+    """
+
+    logdirs: Annotated[
+        list[str],
+        cappa.Arg(help='Directories with ralpher state files', value_name='LOGDIR'),
+    ] = dataclasses.field(default_factory=lambda: ['.'])
+    interval: Annotated[
+        float,
+        cappa.Arg(long=True, help='Seconds between screen refreshes'),
+    ] = 2
+    recent: Annotated[
+        int,
+        cappa.Arg(long=True, help='Number of recent tool uses to show per run'),
+    ] = 3
+    poll: Annotated[
+        bool,
+        cappa.Arg(long=True, help='Poll for changes even where inotify is available'),
+    ] = False
+    once: Annotated[
+        bool,
+        cappa.Arg(long=True, help='Print the current status once and exit'),
+    ] = False
+
+
+@dataclasses.dataclass
+class ReportOptions:
+    """ralpher report
+
+    summarize the runs in one or more logdirs into a JSON and an HTML report
+    """
+
+    logdirs: Annotated[
+        list[str],
+        cappa.Arg(help='Directories with ralpher state files, searched recursively', value_name='LOGDIR'),
+    ] = dataclasses.field(default_factory=lambda: ['.'])
+    json_file: Annotated[
+        str,
+        cappa.Arg(long=True, help='JSON report file to write'),
+    ] = 'ralpher-report.json'
+    html_file: Annotated[
+        str,
+        cappa.Arg(long=True, help='HTML report file to write'),
+    ] = 'ralpher-report.html'
+    jobs: Annotated[
+        int | None,
+        cappa.Arg(long=True, help='Number of worker processes reading the files. Default: number of CPUs'),
+    ] = None
+    cache: Annotated[
+        str | None,
+        cappa.Arg(
+            long=True,
+            help='File with the per-run summaries of the last report, runs whose files did not change are not read again. Default: .ralpher-report-cache in the first logdir',
+        ),
+    ] = None
+    no_cache: Annotated[
+        bool,
+        cappa.Arg(long=True, help='Read every file, without using or updating the cache'),
+    ] = False
+
+
+COMMANDS: dict[str, type] = {
+    'query': QueryOptions,
+    'report': ReportOptions,
+    'watch': WatchOptions,
+}
 
 
-def parse_options() -> RalpherOptions:
-    options: RalpherOptions = cappa.parse(RalpherOptions)
+def parse_options() -> RalpherOptions | QueryOptions | ReportOptions | WatchOptions:
+    argv = sys.argv[1:]
+    if argv and argv[0] in COMMANDS:
+        command: QueryOptions | ReportOptions | WatchOptions = cappa.parse(COMMANDS[argv[0]], argv=argv[1:])
+        return command
+    options: RalpherOptions = cappa.parse(RalpherOptions, argv=argv)
     return options
@@ -0,0 +1,131 @@
+import contextlib
+import shutil
+import subprocess
+import threading
+import time
+from typing import TYPE_CHECKING, Any
+
+from loguru import logger
+
+import ralphlib.iteration
+import ralphlib.logger
+import ralphlib.procgroup
+import ralphlib.scheduler
+import ralphlib.templater
+import ralphlib.types
+
+if TYPE_CHECKING:
+    import ralphlib.retry
+    from ralphlib.options import RalpherOptions
+
+PRESPAWN_DELAY = 5  # seconds, lets the current agent start up first
+
+
+class Pipeline:
+    def __init__(self, options: RalpherOptions, pacer: ralphlib.retry.TokenBucket | None = None) -> None:
+        self.options = options
+        self.pacer = pacer
+        self.agent = shutil.which(options.agent) or options.agent
+        self.cancelled = threading.Event()
+        self.thread: threading.Thread | None = None
+        self.next: dict[str, Any] | None = None
+
+    def start(self, iteration: int, content: str, render: bool) -> None:
+        self.discard()
+        self.cancelled.clear()
+        self.next = {
+            'iteration': iteration,
+            'prompt': None,
+            'cmd': None,
+            'prompt_file': None,
+            'proc': None,
+            'slot': None,
+        }
+        self.thread = threading.Thread(target=self.prepare, args=(self.next, content, render), daemon=True)
+        self.thread.start()
+
+    def prepare(self, next_iteration: dict[str, Any], content: str, render: bool) -> None:
+        iteration = next_iteration['iteration']
+        try:
+            if render:
+                next_iteration['prompt'] = ralphlib.templater.render(self.options, content, iteration)
+            # the command needs the prompt, unless it is written to stdin; with --prompt-via file this writes the prompt file
+            if next_iteration['prompt'] is not None or self.options.prompt_via == 'stdin':
+                cmd, prompt_file = ralphlib.iteration.make_cmd(self.options, next_iteration['prompt'] or '', agent=self.agent)
+                next_iteration['cmd'] = cmd
+                next_iteration['prompt_file'] = prompt_file
+
+            # create the log files now, not when the first line arrives
+            for name in ('stdout', 'stderr', 'progress'):
+                file = getattr(self.options, name)
+                if file:
+                    ralphlib.logger.log_file(self.options, file, iteration).touch()
+
+            if self.options.prompt_via != 'stdin' or self.cancelled.wait(PRESPAWN_DELAY):
+                return
+            self.launch(next_iteration)
+        except Exception as e:
+            logger.warning(f'Preparing iteration {iteration} failed: {e}')
+
+    def launch(self, next_iteration: dict[str, Any]) -> None:
+        # a pre-started agent counts against --host-slots and --launches-per-minute like any other,
+        # without a free slot and launch right now the next iteration starts its agent itself
+        slot = None
+        if self.options.host_slots:
+            slot = ralphlib.scheduler.acquire(self.options, ralphlib.types.CancelToken(), deadline=time.monotonic())
+            if slot is None:
+                return
+        try:
+            if self.pacer is not None and not self.pacer.try_take():
+                return
+            next_iteration['proc'] = ralphlib.iteration.spawn(self.options, next_iteration['cmd'])
+            next_iteration['slot'] = slot
+        finally:
+            if slot is not None and next_iteration['slot'] is None:
+                ralphlib.scheduler.release(slot, 0)
+
+    # the prepared prompt, command, prompt file, agent and host slot, whichever of them could be prepared
+    def take(self, iteration: int) -> dict[str, Any] | None:
+        if self.thread is None or self.next is None or self.next['iteration'] != iteration:
+            self.discard()
+            return None
+        self.cancelled.set()
+        self.thread.join()
+        prepared = self.next
+        self.next = None
+        self.thread = None
+
+        proc = prepared['proc']
+        if proc is not None and proc.poll() is not None:
+            # the agent gave up waiting for its prompt, start a fresh one
+            logger.warning(f'Pre-started agent {proc.pid} for iteration {iteration} exited with code {proc.returncode}')
+            stop(proc)
+            prepared['proc'] = None
+            if prepared['slot'] is not None:
+                ralphlib.scheduler.release(prepared['slot'], 0)
+                prepared['slot'] = None
+        return prepared
+
+    def discard(self) -> None:
+        if self.thread is None:
+            return
+        self.cancelled.set()
+        self.thread.join()
+        if self.next is not None and self.next['proc'] is not None:
+            stop(self.next['proc'])
+        if self.next is not None and self.next['slot'] is not None:
+            ralphlib.scheduler.release(self.next['slot'], 0)
+        if self.next is not None and self.next['prompt_file'] is not None:
+            self.next['prompt_file'].unlink(missing_ok=True)
+        self.next = None
+        self.thread = None
+
+
+def stop(proc: subprocess.Popen) -> None:
+    # killed first, closing stdin flushes into the pipe and could block on an agent that does not read it
+    ralphlib.procgroup.kill(proc)
+    proc.wait()
+    for pipe in (proc.stdin, proc.stdout, proc.stderr):
+        if pipe:
+            with contextlib.suppress(OSError):
+                pipe.close()
@@ -6,11 +6,11 @@ if TYPE_CHECKING:
     from ralphlib.options import RalpherOptions
 
 
-def prt(options: RalpherOptions, s: str, iteration: int, dont_print: bool = False) -> None:
+def prt(options: RalpherOptions, s: str, iteration: int, dont_print: bool = False, file_s: str | None = None) -> None:
     if options.progress:
         path = ralphlib.logger.log_file(options, options.progress, iteration)
         with path.open('a', encoding='utf-8') as f:
-            f.write(s)
+            f.write(s if file_s is None else file_s)
 
     if options.quiet or dont_print:
         return
@@ -0,0 +1,186 @@
+import contextlib
+import os
+import pathlib
+import signal
+import subprocess
+import time
+from typing import TYPE_CHECKING, Any
+
+from loguru import logger
+
+if TYPE_CHECKING:
+    from ralphlib.options import RalpherOptions
+
+REAP_GRACE_PERIOD = 5
+REAP_POLL_INTERVAL = 0.1
+MEBIBYTE = 1024 * 1024
+
+
+def popen_kwargs(options: RalpherOptions) -> dict[str, Any]:
+    if os.name != 'posix':
+        return {}
+    return {
+        # own session and process group, so that stopping the agent also stops anything it started
+        'start_new_session': True,
+    }
+
+
+def resource_limits(options: RalpherOptions) -> dict[str, int]:
+    limits = {}
+    if options.rlimit_as:
+        limits['RLIMIT_AS'] = options.rlimit_as * MEBIBYTE
+    if options.rlimit_cpu:
+        limits['RLIMIT_CPU'] = options.rlimit_cpu
+    if options.rlimit_nofile:
+        limits['RLIMIT_NOFILE'] = options.rlimit_nofile
+    return limits
+
+
+def apply_limits(options: RalpherOptions, proc: subprocess.Popen) -> None:
+    # set from the outside once the agent runs, a preexec_fn is not safe while other threads are running
+    limits = resource_limits(options)
+    if not limits or os.name != 'posix':
+        return
+    import resource
+
+    if not hasattr(resource, 'prlimit'):
+        logger.warning(f'Resource limits are not supported on this platform, not applied to {proc.pid}')
+        return
+    for name, value in limits.items():
+        rlimit = getattr(resource, name)
+        try:
+            _soft, hard = resource.prlimit(proc.pid, rlimit)
+            if hard != resource.RLIM_INFINITY:
+                value = min(value, hard)
+            resource.prlimit(proc.pid, rlimit, (value, hard))
+        except ProcessLookupError:
+            # already gone, nothing left to limit
+            return
+
+
+def terminate(proc: subprocess.Popen) -> None:
+    if os.name == 'posix':
+        signal_group(proc.pid, signal.SIGTERM)
+    else:
+        proc.terminate()
+
+
+def kill(proc: subprocess.Popen) -> None:
+    if os.name == 'posix':
+        signal_group(proc.pid, signal.SIGKILL)
+    else:
+        proc.kill()
+
+
+def signal_group(pgid: int, sig: int) -> None:
+    with contextlib.suppress(ProcessLookupError, PermissionError):
+        os.killpg(pgid, sig)
+
+
+def members(pgid: int) -> list[dict[str, Any]]:
+    if os.name != 'posix':
+        return []
+    proc_dir = pathlib.Path('/proc')
+    if proc_dir.is_dir():
+        return members_from_proc(proc_dir, pgid)
+    return members_from_ps(pgid)
+
+
+def members_from_proc(proc_dir: pathlib.Path, pgid: int) -> list[dict[str, Any]]:
+    found = []
+    for entry in proc_dir.iterdir():
+        if not entry.name.isdigit():
+            continue
+        try:
+            stat = (entry / 'stat').read_text()
+            cmdline = (entry / 'cmdline').read_bytes()
+        except OSError:
+            continue
+        # the command name is in parentheses and may contain spaces
+        fields = stat[stat.rfind(')') + 2 :].split()
+        state, entry_pgid = fields[0], int(fields[2])
+        if entry_pgid != pgid or state == 'Z':
+            continue
+        argv = [a.decode('utf-8', errors='replace') for a in cmdline.split(b'\0')[:-1]]
+        command = ' '.join(argv).strip()
+        if not command:
+            command = stat[stat.find('(') + 1 : stat.rfind(')')]
+        found.append({'pid': int(entry.name), 'command': command, 'argv': argv})
+    return found
+
+
+def members_from_ps(pgid: int) -> list[dict[str, Any]]:
+    try:
+        result = subprocess.run(  # noqa: S603
+            ['ps', '-A', '-o', 'pid=,pgid=,stat=,command='],  # noqa: S607
+            capture_output=True,
+            text=True,
+            errors='replace',
+            check=False,
+        )
+    except OSError:
+        return []
+    found = []
+    for line in result.stdout.splitlines():
+        parts = line.split(None, 3)
+        if len(parts) < 3:
+            continue
+        pid, entry_pgid, state = parts[0], parts[1], parts[2]
+        if not pid.isdigit() or not entry_pgid.isdigit() or int(entry_pgid) != pgid or state.startswith('Z'):
+            continue
+        command = parts[3] if len(parts) > 3 else ''
+        # ps does not keep the boundaries between arguments
+        found.append({'pid': int(pid), 'command': command, 'argv': command.split()})
+    return found
+
+
+def reap(pgid: int) -> list[dict[str, Any]]:
+    leftovers = members(pgid)
+    if not leftovers:
+        return []
+
+    signal_group(pgid, signal.SIGTERM)
+    waited = 0.0
+    while waited < REAP_GRACE_PERIOD and members(pgid):
+        time.sleep(REAP_POLL_INTERVAL)
+        waited += REAP_POLL_INTERVAL
+
+    if members(pgid):
+        signal_group(pgid, signal.SIGKILL)
+    return leftovers
+
+
+def rss(pgid: int) -> int:
+    # resident memory of the whole group in bytes, 0 where it cannot be measured
+    if os.name != 'posix':
+        return 0
+    proc_dir = pathlib.Path('/proc')
+    if not proc_dir.is_dir():
+        return rss_from_ps(pgid)
+    page_size = os.sysconf('SC_PAGE_SIZE')
+    total = 0
+    for member in members_from_proc(proc_dir, pgid):
+        try:
+            total += int((proc_dir / str(member['pid']) / 'statm').read_text().split()[1]) * page_size
+        except OSError, ValueError, IndexError:
+            continue
+    return total
+
+
+def rss_from_ps(pgid: int) -> int:
+    try:
+        result = subprocess.run(  # noqa: S603
+            ['ps', '-A', '-o', 'pgid=,rss='],  # noqa: S607
+            capture_output=True,
+            text=True,
+            errors='replace',
+            check=False,
+        )
+    except OSError:
+        return 0
+    total = 0
+    for line in result.stdout.splitlines():
+        parts = line.split()
+        if len(parts) == 2 and parts[0].isdigit() and parts[1].isdigit() and int(parts[0]) == pgid:
+            total += int(parts[1]) * 1024
+    return total
@@ -0,0 +1,319 @@
+import collections
+import concurrent.futures
+import datetime
+import os
+import pathlib
+import statistics
+from typing import TYPE_CHECKING, Any
+
+import jinja2
+import orjson
+from loguru import logger
+
+import ralphlib.blobs
+import ralphlib.indexer
+import ralphlib.looper
+
+if TYPE_CHECKING:
+    from ralphlib.options import ReportOptions
+
+CACHE_FILENAME = '.ralpher-report-cache'
+CACHE_VERSION = 1
+REASON_LENGTH = 80
+PROMPT_HEAD_LENGTH = 80
+CHUNK_SIZE = 16  # state files handed to a worker at a time
+
+HTML_TEMPLATE = """<!DOCTYPE html>
+<html>
+<head>
+<meta charset="utf-8">
+<title>ralpher report</title>
+<style>
+body { font-family: sans-serif; margin: 2em; }
+table { border-collapse: collapse; margin-bottom: 2em; }
+th, td { border: 1px solid #ccc; padding: 0.25em 0.75em; text-align: left; }
+td.number { text-align: right; }
+.bar { background: #4a90d9; height: 0.8em; }
+</style>
+</head>
+<body>
+<h1>ralpher report</h1>
+<p>Generated {{ report.generated }} from {{ report.runs }} runs in {{ report.logdirs | join(', ') }}</p>
+
+<h2>Overview</h2>
+<table>
+<tr><th>Runs</th><td class="number">{{ report.runs }}</td></tr>
+<tr><th>Completed</th><td class="number">{{ report.completed }} ({{ '%.0f' | format(report.completion_rate * 100) }}%)</td></tr>
+<tr><th>Iterations</th><td class="number">{{ report.iterations }}</td></tr>
+{% for key, value in report.iteration_seconds.items() %}
+<tr><th>Iteration seconds, {{ key }}</th><td class="number">{{ value }}</td></tr>
+{% endfor %}
+<tr><th>Cost (USD)</th><td class="number">{{ report.cost_usd }}</td></tr>
+</table>
+
+<h2>Iterations per run</h2>
+<table>
+<tr><th>Iterations</th><th>Runs</th><th></th></tr>
+{% for row in report.iterations_per_run %}
+<tr><td class="number">{{ row.iterations }}</td><td class="number">{{ row.runs }}</td><td><div class="bar" style="width: {{ (row.runs / report.runs * 300) | round | int }}px"></div></td></tr>
+{% endfor %}
+</table>
+
+<h2>Stop reasons</h2>
+<table>
+<tr><th>Reason</th><th>Runs</th></tr>
+{% for row in report.stop_reasons %}
+<tr><td>{{ row.reason }}</td><td class="number">{{ row.runs }}</td></tr>
+{% endfor %}
+</table>
+
+<h2>Tool mix</h2>
+<table>
+<tr><th>Tool</th><th>Uses</th><th>Total seconds</th><th>Average seconds</th></tr>
+{% for row in report.tools %}
+<tr><td>{{ row.name }}</td><td class="number">{{ row.uses }}</td><td class="number">{{ row.seconds }}</td><td class="number">{{ row.avg_seconds }}</td></tr>
+{% endfor %}
+</table>
+
+<h2>Error reasons</h2>
+<table>
+<tr><th>Reason</th><th>Iterations</th></tr>
+{% for row in report.errors %}
+<tr><td>{{ row.reason }}</td><td class="number">{{ row.iterations }}</td></tr>
+{% endfor %}
+</table>
+
+<h2>Runs</h2>
+<table>
+<tr><th>Start</th><th>Task</th><th>Iterations</th><th>Stopped</th><th>Time</th><th>State file</th></tr>
+{% for run in report.run_list %}
+<tr><td>{{ run.start }}</td><td>{{ run.task }}</td><td class="number">{{ run.iterations }}/{{ run.max_iterations }}</td><td>{{ run.stopped | join(', ') }}</td><td>{{ run.time_readable }}</td><td>{{ run.path }}</td></tr>
+{% endfor %}
+</table>
+</body>
+</html>
+"""
+
+
+def cache_path(options: ReportOptions) -> pathlib.Path:
+    if options.cache:
+        return pathlib.Path(options.cache).expanduser().absolute()
+    return pathlib.Path(options.logdirs[0]).expanduser().absolute() / CACHE_FILENAME
+
+
+def load_cache(path: pathlib.Path) -> dict[str, Any]:
+    try:
+        cache = orjson.loads(path.read_bytes())
+    except OSError, orjson.JSONDecodeError:
+        return {}
+    if not isinstance(cache, dict) or cache.get('version') != CACHE_VERSION:
+        return {}
+    return cache.get('runs', {})
+
+
+def save_cache(path: pathlib.Path, runs: dict[str, Any]) -> None:
+    tmp = path.with_name(path.name + '.tmp')
+    tmp.write_bytes(orjson.dumps({'version': CACHE_VERSION, 'runs': runs}))
+    tmp.replace(path)
+
+
+def file_stats(paths: list[str]) -> dict[str, list[int] | None]:
+    stats: dict[str, list[int] | None] = {}
+    for path in paths:
+        try:
+            st = os.stat(path)
+        except OSError:
+            stats[path] = None
+            continue
+        stats[path] = [st.st_mtime_ns, st.st_size]
+    return stats
+
+
+def is_fresh(entry: dict[str, Any] | None) -> bool:
+    # a run is read again when its state file or any of its logs changed
+    return entry is not None and file_stats(list(entry['stats'])) == entry['stats']
+
+
+def summarize(path: str) -> dict[str, Any] | None:
+    # runs in a worker process, everything it returns is plain JSON
+    stats = file_stats([path])
+    try:
+        with open(path, 'rb') as fp:
+            state = orjson.loads(fp.read())
+    except OSError, orjson.JSONDecodeError:
+        return None
+    if not ralphlib.indexer.is_state(state):
+        return {'stats': stats, 'summary': None}
+
+    prompt = state.get('prompt', '')
+    if ralphlib.blobs.is_ref(prompt):
+        try:
+            prompt = ralphlib.blobs.load(ralphlib.blobs.find_root(pathlib.Path(path)), prompt)
+        except OSError, ValueError:
+            prompt = ''
+    if not isinstance(prompt, str):
+        prompt = ''
+
+    stopped = state.get('stopped') or []
+    summary: dict[str, Any] = {
+        'path': path,
+        'start': state.get('start'),
+        'task': prompt.strip().splitlines()[0][:PROMPT_HEAD_LENGTH] if prompt.strip() else '',
+        'max_iterations': state.get('max_iterations'),
+        'iterations': 0,
+        'stopped': stopped if isinstance(stopped, list) else [stopped],
+        'total_seconds': state.get('total_time_seconds'),
+        'iteration_seconds': [],
+        'tools': {},
+        'errors': {},
+        'cost_usd': 0.0,
+    }
+
+    for it in state.get('iterations', {}).values():
+        if not isinstance(it, dict):
+            continue
+        summary['iterations'] += 1
+        if it.get('time_seconds') is not None:
+            summary['iteration_seconds'].append(it['time_seconds'])
+        for t in it.get('tool_times', {}).values():
+            tool = summary['tools'].setdefault(t.get('name', '?'), {'uses': 0, 'seconds': 0.0})
+            tool['uses'] += 1
+            tool['seconds'] += t.get('seconds') or 0.0
+
+        reasons = []
+        if it.get('watchdog'):
+            reasons.append(f'watchdog {it["watchdog"]}')
+        if it.get('failure'):
+            reasons.append(f'{it["failure"]} failure')
+        if it.get('stdout'):
+            stats.update(file_stats([it['stdout']]))
+            result = read_result(it['stdout'])
+            if result is not None:
+                summary['cost_usd'] += result.get('total_cost_usd') or 0.0
+                if result.get('is_error'):
+                    text = result.get('result') if isinstance(result.get('result'), str) else ''
+                    reasons.append(' '.join(text.split())[:REASON_LENGTH] or f'error result {result.get("subtype", "")}'.strip())
+        if it.get('error') and not reasons:
+            reasons.append('error')
+        for reason in reasons:
+            summary['errors'][reason] = summary['errors'].get(reason, 0) + 1
+
+    return {'stats': stats, 'summary': summary}
+
+
+def read_result(path: str) -> dict[str, Any] | None:
+    # the last result line of a stdout log, other lines are not parsed
+    result = None
+    try:
+        with open(path, 'rb') as fp:
+            for line in fp:
+                if b'"result"' not in line:
+                    continue
+                try:
+                    payload = orjson.loads(line)
+                except orjson.JSONDecodeError:
+                    continue
+                if isinstance(payload, dict) and payload.get('type') == 'result':
+                    result = payload
+    except OSError:
+        return None
+    return result
+
+
+def percentile(values: list[float], q: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+def combine(options: ReportOptions, summaries: list[dict[str, Any]]) -> dict[str, Any]:
+    summaries = sorted(summaries, key=lambda s: s['start'] or '', reverse=True)
+    completed = sum('complete' in s['stopped'] for s in summaries)
+    seconds = [x for s in summaries for x in s['iteration_seconds']]
+    iterations_per_run = collections.Counter(s['iterations'] for s in summaries)
+    stop_reasons = collections.Counter(reason for s in summaries for reason in (s['stopped'] or ['not stopped']))
+    errors: collections.Counter[str] = collections.Counter()
+    tools: dict[str, dict[str, float]] = {}
+    for s in summaries:
+        errors.update(s['errors'])
+        for name, t in s['tools'].items():
+            tool = tools.setdefault(name, {'uses': 0, 'seconds': 0.0})
+            tool['uses'] += t['uses']
+            tool['seconds'] += t['seconds']
+
+    iteration_seconds = {}
+    if seconds:
+        iteration_seconds = {
+            'mean': round(statistics.fmean(seconds), 1),
+            'median': round(statistics.median(seconds), 1),
+            'p90': round(percentile(seconds, 0.9), 1),
+            'max': round(max(seconds), 1),
+        }
+
+    return {
+        'generated': datetime.datetime.now().replace(microsecond=0).isoformat(),
+        'logdirs': options.logdirs,
+        'runs': len(summaries),
+        'completed': completed,
+        'completion_rate': round(completed / len(summaries), 3) if summaries else 0.0,
+        'iterations': len(seconds),
+        'iteration_seconds': iteration_seconds,
+        'cost_usd': round(sum(s['cost_usd'] for s in summaries), 2),
+        'iterations_per_run': [{'iterations': k, 'runs': v} for k, v in sorted(iterations_per_run.items())],
+        'stop_reasons': [{'reason': k, 'runs': v} for k, v in stop_reasons.most_common()],
+        'tools': [
+            {'name': name, 'uses': t['uses'], 'seconds': round(t['seconds'], 1), 'avg_seconds': round(t['seconds'] / t['uses'], 2) if t['uses'] else 0.0}
+            for name, t in sorted(tools.items(), key=lambda item: item[1]['uses'], reverse=True)
+        ],
+        'errors': [{'reason': k, 'iterations': v} for k, v in errors.most_common()],
+        'run_list': [
+            dict(
+                {k: v for k, v in s.items() if k not in ('iteration_seconds', 'tools', 'errors')},
+                time_readable=ralphlib.looper.timedelta_to_readable(datetime.timedelta(seconds=s['total_seconds'])) if s['total_seconds'] is not None else '',
+            )
+            for s in summaries
+        ],
+    }
+
+
+def find_states(options: ReportOptions) -> list[str]:
+    # the report may be written into a logdir, it is rewritten every time and would never be cached
+    outputs = {str(pathlib.Path(f).expanduser().absolute()) for f in (options.json_file, options.html_file)}
+    outputs.add(str(cache_path(options)))
+    paths = set()
+    for logdir in options.logdirs:
+        root = pathlib.Path(logdir).expanduser().absolute()
+        paths.update(str(path) for path in root.rglob('*.json'))
+    return sorted(paths - outputs)
+
+
+def report(options: ReportOptions) -> None:
+    paths = find_states(options)
+    cache_file = cache_path(options)
+    cached = {} if options.no_cache else load_cache(cache_file)
+
+    runs = {path: cached[path] for path in paths if is_fresh(cached.get(path))}
+    todo = [path for path in paths if path not in runs]
+    if len(todo) > 1 and options.jobs != 1:
+        with concurrent.futures.ProcessPoolExecutor(max_workers=options.jobs) as pool:
+            results = list(pool.map(summarize, todo, chunksize=CHUNK_SIZE))
+    else:
+        results = [summarize(path) for path in todo]
+    for path, result in zip(todo, results, strict=True):
+        if result is None:
+            logger.warning(f'Failed to read {path}')
+            continue
+        runs[path] = result
+
+    if not options.no_cache:
+        try:
+            save_cache(cache_file, runs)
+        except OSError as e:
+            logger.warning(f'Failed to write the report cache {cache_file}: {e}')
+
+    data = combine(options, [r['summary'] for r in runs.values() if r['summary'] is not None])
+    pathlib.Path(options.json_file).write_bytes(orjson.dumps(data, option=orjson.OPT_INDENT_2))
+    html = jinja2.Environment(autoescape=True).from_string(HTML_TEMPLATE).render(report=data)
+    pathlib.Path(options.html_file).write_text(html, encoding='utf-8')
+
+    print(f'{data["runs"]} runs, {data["completed"]} completed, {len(todo)} of {len(paths)} state files read')
+    print(f'Wrote {options.json_file} and {options.html_file}')
@@ -0,0 +1,75 @@
+import random
+import re
+import threading
+import time
+from typing import TYPE_CHECKING, Any
+
+if TYPE_CHECKING:
+    from ralphlib.options import RalpherOptions
+
+TRANSIENT = 'transient'
+FATAL = 'fatal'
+
+fatal_regex = re.compile(
+    r'invalid api key|invalid x-api-key|authentication|unauthori[sz]ed|\b401\b|\b403\b|credit balance|billing',
+    re.IGNORECASE,
+)
+transient_regex = re.compile(
+    r'rate.?limit|too many requests|\b429\b|overloaded|\b529\b|\b50[234]\b|internal server error|timed? ?out|timeout|econnreset|econnrefused|etimedout|'
+    r'socket hang up|network error|connection (?:error|reset|refused)|temporarily unavailable|try again',
+    re.IGNORECASE,
+)
+
+
+def classify(outcome: dict[str, Any]) -> str | None:
+    # a stopped agent (watchdog or termination) is not a failure of the agent itself
+    if outcome['watchdog'] or outcome['complete']:
+        return None
+    failed_exit = outcome['returncode'] is not None and outcome['returncode'] > 0
+    if not outcome['error'] and not failed_exit:
+        return None
+
+    text = '\n'.join([outcome['result'], *outcome['stderr_tail']])
+    if fatal_regex.search(text):
+        return FATAL
+    if transient_regex.search(text):
+        return TRANSIENT
+    # an error result stops the loop, a bare nonzero exit code does not
+    return FATAL if outcome['error'] else None
+
+
+def backoff_delay(options: RalpherOptions, attempt: int) -> float:
+    delay = min(options.retry_delay * (2 ** (attempt - 1)), options.retry_max_delay)
+    # equal jitter, loops that failed together do not retry together
+    return delay / 2 + random.uniform(0, delay / 2)
+
+
+class TokenBucket:
+    def __init__(self, per_minute: float) -> None:
+        self.capacity = max(1.0, per_minute)
+        self.rate = per_minute / 60
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    # takes a token, returns the seconds to wait before it may be used
+    def reserve(self) -> float:
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            self.tokens -= 1
+            if self.tokens >= 0:
+                return 0.0
+            return -self.tokens / self.rate
+
+    # takes a token only if one is available right away
+    def try_take(self) -> bool:
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            if self.tokens < 1:
+                return False
+            self.tokens -= 1
+            return True
@@ -0,0 +1,176 @@
+import contextlib
+import os
+import pathlib
+import sqlite3
+import time
+import uuid
+from typing import TYPE_CHECKING, Any
+
+from loguru import logger
+
+if TYPE_CHECKING:
+    from collections.abc import Iterator
+
+    import ralphlib.types
+    from ralphlib.options import RalpherOptions
+
+DB_FILENAME = 'slots.sqlite3'
+SLOT_POLL_INTERVAL = 2  # seconds between attempts to get a slot
+DEFAULT_AGENT_RSS = 1024 * 1024 * 1024  # bytes assumed per agent until one has been measured
+MEMORY_RESERVE = 512 * 1024 * 1024  # bytes of available memory left alone
+RSS_SAMPLES = 20  # recent iterations the memory estimate is based on
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS slots (
+    token TEXT PRIMARY KEY,
+    pid INTEGER NOT NULL,
+    acquired REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS queue (
+    token TEXT PRIMARY KEY,
+    pid INTEGER NOT NULL,
+    enqueued REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS samples (
+    id INTEGER PRIMARY KEY,
+    finished REAL NOT NULL,
+    rss INTEGER NOT NULL
+);
+"""
+
+
+def db_path(options: RalpherOptions) -> pathlib.Path:
+    if options.slots_dir:
+        root = pathlib.Path(options.slots_dir).expanduser()
+    else:
+        root = pathlib.Path(os.environ.get('XDG_CACHE_HOME') or '~/.cache').expanduser() / 'ralpher'
+    return root.absolute() / DB_FILENAME
+
+
+@contextlib.contextmanager
+def connect(path: pathlib.Path) -> Iterator[sqlite3.Connection]:
+    path.parent.mkdir(parents=True, exist_ok=True)
+    # autocommit mode, transactions are started explicitly with BEGIN IMMEDIATE
+    conn = sqlite3.connect(path, timeout=30, isolation_level=None)
+    try:
+        conn.row_factory = sqlite3.Row
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.executescript(SCHEMA)
+        yield conn
+    finally:
+        conn.close()
+
+
+def pid_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def remove_stale(conn: sqlite3.Connection) -> None:
+    # slots and places in the queue of loops that died without giving them back
+    for table in ('slots', 'queue'):
+        for row in conn.execute(f'SELECT DISTINCT pid FROM {table}').fetchall():  # noqa: S608
+            if not pid_alive(row['pid']):
+                conn.execute(f'DELETE FROM {table} WHERE pid = ?', (row['pid'],))  # noqa: S608
+
+
+def available_memory() -> int | None:
+    try:
+        with open('/proc/meminfo', encoding='utf-8') as f:
+            for line in f:
+                if line.startswith('MemAvailable:'):
+                    return int(line.split()[1]) * 1024
+    except OSError, ValueError, IndexError:
+        pass
+    return None
+
+
+def agent_rss(conn: sqlite3.Connection) -> int:
+    row = conn.execute('SELECT max(rss) AS rss FROM (SELECT rss FROM samples ORDER BY finished DESC LIMIT ?)', (RSS_SAMPLES,)).fetchone()
+    return row['rss'] or DEFAULT_AGENT_RSS
+
+
+def capacity(options: RalpherOptions, conn: sqlite3.Connection, held: int) -> dict[str, int]:
+    # running agents already show in the load and the used memory, so they count on top of the headroom
+    limits = {'max': options.host_slots}
+    try:
+        load = os.getloadavg()[0]
+    except OSError:
+        load = None
+    if load is not None:
+        limits['load'] = held + int(max(0.0, (os.cpu_count() or 1) - load))
+    memory = available_memory()
+    if memory is not None:
+        limits['memory'] = held + max(0, memory - MEMORY_RESERVE) // agent_rss(conn)
+    # one agent may always run, otherwise a busy host would starve every loop
+    limits['slots'] = max(1, min(limits.values()))
+    return limits
+
+
+def try_acquire(options: RalpherOptions, conn: sqlite3.Connection, token: str) -> dict[str, int] | None:
+    conn.execute('BEGIN IMMEDIATE')
+    try:
+        remove_stale(conn)
+        held = conn.execute('SELECT count(*) FROM slots').fetchone()[0]
+        limits = capacity(options, conn, held)
+        # first come, first served
+        ahead = conn.execute(
+            'SELECT count(*) FROM queue WHERE enqueued < (SELECT enqueued FROM queue WHERE token = :token) '
+            'OR (enqueued = (SELECT enqueued FROM queue WHERE token = :token) AND token < :token)',
+            {'token': token},
+        ).fetchone()[0]
+        if held + ahead >= limits['slots']:
+            conn.execute('COMMIT')
+            return None
+        conn.execute('DELETE FROM queue WHERE token = ?', (token,))
+        conn.execute('INSERT INTO slots (token, pid, acquired) VALUES (?, ?, ?)', (token, os.getpid(), time.time()))
+        conn.execute('COMMIT')
+    except BaseException:
+        conn.execute('ROLLBACK')
+        raise
+    return limits
+
+
+# waits for a slot, returns the slot or None when cancelled or out of time while waiting
+def acquire(options: RalpherOptions, cancel: ralphlib.types.CancelToken, deadline: float | None = None) -> dict[str, Any] | None:
+    path = db_path(options)
+    token = uuid.uuid4().hex
+    started = time.monotonic()
+    with connect(path) as conn:
+        conn.execute('INSERT INTO queue (token, pid, enqueued) VALUES (?, ?, ?)', (token, os.getpid(), time.time()))
+        try:
+            while True:
+                limits = try_acquire(options, conn, token)
+                if limits is not None:
+                    return {
+                        'token': token,
+                        'path': path,
+                        'limits': limits,
+                        'wait_seconds': time.monotonic() - started,
+                    }
+                wait = SLOT_POLL_INTERVAL
+                if deadline is not None:
+                    wait = min(wait, deadline - time.monotonic())
+                if wait <= 0 or cancel.wait(wait):
+                    return None
+        finally:
+            conn.execute('DELETE FROM queue WHERE token = ?', (token,))
+
+
+def release(slot: dict[str, Any], peak_rss: int) -> None:
+    try:
+        with connect(slot['path']) as conn:
+            conn.execute('BEGIN IMMEDIATE')
+            conn.execute('DELETE FROM slots WHERE token = ?', (slot['token'],))
+            if peak_rss:
+                conn.execute('INSERT INTO samples (finished, rss) VALUES (?, ?)', (time.time(), peak_rss))
+                conn.execute('DELETE FROM samples WHERE id NOT IN (SELECT id FROM samples ORDER BY finished DESC LIMIT ?)', (RSS_SAMPLES,))
+            conn.execute('COMMIT')
+    except sqlite3.Error as e:
+        # a slot that is not given back is cleaned up once this process has exited
+        logger.warning(f'Failed to release slot {slot["token"]}: {e}')
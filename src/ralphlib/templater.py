@@ -1,18 +1,21 @@
-from typing import TYPE_CHECKING
+from typing import TYPE_CHECKING, Any
 
 import jinja2
+import jinja2.meta
 
 if TYPE_CHECKING:
     from ralphlib.options import RalpherOptions
 
 
-def render(options: RalpherOptions, prompt: str, iteration: int) -> str:
-    if not options.vars:
+def render(options: RalpherOptions, prompt: str, iteration: int, extra: dict[str, Any] | None = None) -> str:
+    if not options.vars and not extra:
         return prompt
 
-    context: dict[str, str] = {
+    context: dict[str, Any] = {
         'iteration': str(iteration),
     }
+    if extra:
+        context.update(extra)
     for var in options.vars:
         if '=' not in var:
             continue
@@ -22,3 +25,11 @@ def render(options: RalpherOptions, prompt: str, iteration: int) -> str:
     template = jinja2.Template(prompt)
     prompt = template.render(**context)
     return prompt
+
+
+def variables(prompt: str) -> set[str]:
+    # the variables a prompt asks for, none when it is not a valid template
+    try:
+        return jinja2.meta.find_undeclared_variables(jinja2.Environment(autoescape=False).parse(prompt))  # noqa: S701
+    except jinja2.TemplateSyntaxError:
+        return set()
@@ -1,4 +1,5 @@
 import enum
+import threading
 
 
 class MessageType(enum.IntEnum):
@@ -10,3 +11,18 @@ class MessageType(enum.IntEnum):
     CONTENT_DELTA = 5
     TOOL_USE = 6
     COMPLETE = 7
+
+
+class CancelToken:
+    def __init__(self) -> None:
+        self.event = threading.Event()
+
+    def cancel(self) -> None:
+        self.event.set()
+
+    def is_cancelled(self) -> bool:
+        return self.event.is_set()
+
+    # sleeps until cancelled or the timeout passes, returns whether it was cancelled
+    def wait(self, timeout: float | None = None) -> bool:
+        return self.event.wait(timeout)
@@ -0,0 +1,333 @@
+import collections
+import ctypes
+import ctypes.util
+import datetime
+import os
+import pathlib
+import select
+import sys
+import time
+from typing import TYPE_CHECKING, Any
+
+import colorama
+import orjson
+
+import ralphlib.indexer
+import ralphlib.iteration
+import ralphlib.looper
+
+if TYPE_CHECKING:
+    from ralphlib.options import WatchOptions
+
+RESCAN_INTERVAL = 10  # seconds, looking for new state files
+RATE_WINDOW = 30  # seconds
+MAX_PARTIAL_LINE = 1024 * 1024  # bytes kept of an incomplete line, longer lines are skipped
+INITIAL_TAIL = 64 * 1024  # bytes read of a log that is already there when watching starts
+MIN_REDRAW_INTERVAL = 0.25  # seconds, file events do not redraw more often than this
+CHARS_PER_TOKEN = 4
+
+IN_MODIFY = 0x00000002
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_NONBLOCK = os.O_NONBLOCK
+IN_CLOEXEC = os.O_CLOEXEC
+
+
+class Inotify:
+    def __init__(self) -> None:
+        libc_name = ctypes.util.find_library('c')
+        if not sys.platform.startswith('linux') or not libc_name:
+            raise OSError('inotify not available')
+        self.libc = ctypes.CDLL(libc_name, use_errno=True)
+        self.fd = self.libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), 'inotify_init1 failed')
+        self.missing: set[pathlib.Path] = set()
+
+    def add(self, path: pathlib.Path) -> None:
+        mask = IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE
+        if self.libc.inotify_add_watch(self.fd, os.fsencode(path), mask) < 0:
+            # not created yet or already removed, polled until a rescan finds it
+            self.missing.add(path)
+        else:
+            self.missing.discard(path)
+
+    def retry(self) -> None:
+        for path in list(self.missing):
+            self.add(path)
+
+    def wait(self, timeout: float) -> bool:
+        readable, _, _ = select.select([self.fd], [], [], timeout)
+        if not readable:
+            return False
+        # the events only wake us up, what changed is found from the stat cache
+        while True:
+            try:
+                if not os.read(self.fd, 65536):
+                    break
+            except BlockingIOError:
+                break
+        return True
+
+    def close(self) -> None:
+        os.close(self.fd)
+
+
+class Poller:
+    def add(self, path: pathlib.Path) -> None:
+        pass
+
+    def retry(self) -> None:
+        pass
+
+    def wait(self, timeout: float) -> bool:
+        time.sleep(timeout)
+        return False
+
+    def close(self) -> None:
+        pass
+
+
+def make_waiter(options: WatchOptions) -> Inotify | Poller:
+    if options.poll:
+        return Poller()
+    try:
+        return Inotify()
+    except OSError:
+        return Poller()
+
+
+def stat_changed(cache: dict[str, tuple[int, int]], path: pathlib.Path) -> os.stat_result | None:
+    try:
+        st = path.stat()
+    except OSError:
+        return None
+    key = (st.st_mtime_ns, st.st_size)
+    if cache.get(str(path)) == key:
+        return None
+    cache[str(path)] = key
+    return st
+
+
+def make_run(options: WatchOptions, path: pathlib.Path, name: str) -> dict[str, Any]:
+    return {
+        'name': name,
+        'state_path': path,
+        'start': None,
+        'end': None,
+        'iteration': None,
+        'max_iterations': None,
+        'stopped': None,
+        'stdout': None,
+        'offset': 0,
+        'partial': b'',
+        'skipping': False,
+        'tokens': collections.deque(),
+        'tools': collections.deque(maxlen=options.recent),
+        'result': None,
+    }
+
+
+def discover(options: WatchOptions, runs: dict[str, dict[str, Any]], waiter: Inotify | Poller) -> None:
+    # state files anywhere below the logdirs, like query and report find them
+    waiter.retry()
+    for logdir in options.logdirs:
+        root = pathlib.Path(logdir).expanduser().absolute()
+        for path in root.rglob('*.json'):
+            if str(path) in runs:
+                continue
+            name = str(path.relative_to(root)) if len(options.logdirs) == 1 else str(path)
+            runs[str(path)] = make_run(options, path, name)
+            if path.parent != root:
+                waiter.add(path.parent)
+
+
+def update_state(run: dict[str, Any], stat_cache: dict[str, tuple[int, int]], waiter: Inotify | Poller) -> None:
+    path = run['state_path']
+    st = stat_changed(stat_cache, path)
+    if st is None:
+        return
+    try:
+        state = orjson.loads(path.read_bytes())
+    except OSError, orjson.JSONDecodeError:
+        # caught in the middle of a write, try again next time
+        stat_cache.pop(str(path), None)
+        return
+    if not ralphlib.indexer.is_state(state):
+        return
+
+    run['start'] = state.get('start')
+    run['end'] = state.get('end')
+    run['max_iterations'] = state.get('max_iterations')
+    run['stopped'] = state.get('stopped')
+    iterations = state.get('iterations', {})
+    if iterations:
+        key = max(iterations, key=lambda k: int(k) if k.isdigit() else 0)
+        if key != run['iteration']:
+            first = run['iteration'] is None
+            run['iteration'] = key
+            stdout = iterations[key].get('stdout')
+            if stdout != run['stdout']:
+                run['stdout'] = stdout
+                run['offset'] = 0
+                run['partial'] = b''
+                run['skipping'] = False
+                run['result'] = None
+                if stdout:
+                    waiter.add(pathlib.Path(stdout).parent)
+                    if first:
+                        tail_offset(run, pathlib.Path(stdout))
+
+
+def tail_offset(run: dict[str, Any], path: pathlib.Path) -> None:
+    # only the end of a log that was written before we started watching, from the first whole line in it
+    try:
+        with path.open('rb') as fp:
+            size = fp.seek(0, os.SEEK_END)
+            if size <= INITIAL_TAIL:
+                return
+            run['offset'] = size - INITIAL_TAIL
+            fp.seek(run['offset'] - 1)
+            run['skipping'] = fp.read(1) != b'\n'
+    except OSError:
+        return
+
+
+def update_stdout(run: dict[str, Any], stat_cache: dict[str, tuple[int, int]]) -> None:
+    if not run['stdout']:
+        return
+    path = pathlib.Path(run['stdout'])
+    st = stat_changed(stat_cache, path)
+    if st is None:
+        return
+    if st.st_size < run['offset']:
+        # truncated, read again from the start
+        run['offset'] = 0
+        run['partial'] = b''
+        run['skipping'] = False
+    if st.st_size == run['offset']:
+        return
+
+    with path.open('rb') as fp:
+        fp.seek(run['offset'])
+        data = fp.read(st.st_size - run['offset'])
+    run['offset'] += len(data)
+
+    now = time.monotonic()
+    lines = data.split(b'\n')
+    lines[0] = run['partial'] + lines[0]
+    run['partial'] = lines.pop()
+    for line in lines:
+        if run['skipping']:
+            run['skipping'] = False
+            continue
+        if line:
+            update_line(run, line, now)
+    if len(run['partial']) > MAX_PARTIAL_LINE:
+        run['partial'] = b''
+        run['skipping'] = True
+
+
+def update_line(run: dict[str, Any], line: bytes, now: float) -> None:
+    try:
+        payload = orjson.loads(line)
+    except orjson.JSONDecodeError:
+        return
+    if not isinstance(payload, dict):
+        return
+
+    ptype = payload.get('type')
+    if ptype == 'stream_event':
+        delta = payload.get('event', {}).get('delta', {})
+        text = delta.get('text') or delta.get('partial_json') or ''
+        if text:
+            run['tokens'].append((now, len(text) / CHARS_PER_TOKEN))
+    elif ptype == 'assistant':
+        for c in payload.get('message', {}).get('content', []) or []:
+            if isinstance(c, dict) and c.get('type') == 'tool_use':
+                input_field = c.get('input', {})
+                tool_input = ralphlib.iteration.input_field_to_content(input_field) if isinstance(input_field, dict) else ''
+                run['tools'].append(f'{c.get("name", "?")} {tool_input.splitlines()[0] if tool_input else ""}'.strip())
+    elif ptype == 'result':
+        run['result'] = 'error' if payload.get('is_error') else payload.get('subtype', 'done')
+
+
+def token_rate(run: dict[str, Any], now: float) -> float:
+    tokens = run['tokens']
+    while tokens and tokens[0][0] < now - RATE_WINDOW:
+        tokens.popleft()
+    return sum(t for _, t in tokens) / RATE_WINDOW
+
+
+def elapsed(run: dict[str, Any]) -> str:
+    if not run['start']:
+        return ''
+    try:
+        start = datetime.datetime.fromisoformat(run['start'])
+        end = datetime.datetime.fromisoformat(run['end']) if run['end'] else datetime.datetime.now()
+    except ValueError:
+        return ''
+    return ralphlib.looper.timedelta_to_readable(end - start)
+
+
+def status(run: dict[str, Any]) -> tuple[str, str]:
+    if run['stopped']:
+        words = ', '.join(run['stopped'])
+        color = colorama.Fore.GREEN if 'complete' in run['stopped'] else colorama.Fore.RED
+        return words, color
+    if run['end']:
+        return 'finished', colorama.Fore.WHITE
+    if run['result']:
+        return f'iteration {run["result"]}', colorama.Fore.YELLOW
+    return 'running', colorama.Fore.CYAN
+
+
+def render(options: WatchOptions, runs: dict[str, dict[str, Any]]) -> str:
+    now = time.monotonic()
+    # other JSON files in the logdirs are no runs
+    shown = [run for run in runs.values() if run['max_iterations'] is not None]
+    out = [f'{colorama.Style.BRIGHT}ralpher watch{colorama.Style.RESET_ALL}  {datetime.datetime.now().replace(microsecond=0).isoformat()}  {len(shown)} runs\n']
+    for run in sorted(shown, key=lambda r: r['start'] or '', reverse=True):
+        words, color = status(run)
+        iteration = f'{int(run["iteration"]) if run["iteration"] else 0}/{run["max_iterations"]}'
+        rate = token_rate(run, now)
+        out.append(
+            f'{color}{run["name"]}{colorama.Style.RESET_ALL}  iteration {iteration}  {elapsed(run)}  {rate:.1f} tok/s  {color}{words}{colorama.Style.RESET_ALL}'
+        )
+        recent = list(run['tools'])[-options.recent :]
+        for tool in recent:
+            out.append(f'    {colorama.Fore.MAGENTA}{tool[:100]}{colorama.Style.RESET_ALL}')
+    return '\n'.join(out)
+
+
+def watch(options: WatchOptions) -> None:
+    colorama.just_fix_windows_console()
+    runs: dict[str, dict[str, Any]] = {}
+    stat_cache: dict[str, tuple[int, int]] = {}
+    waiter = make_waiter(options)
+    for logdir in options.logdirs:
+        waiter.add(pathlib.Path(logdir).expanduser().absolute())
+
+    last_scan = 0.0
+    try:
+        while True:
+            if time.monotonic() - last_scan >= RESCAN_INTERVAL:
+                discover(options, runs, waiter)
+                last_scan = time.monotonic()
+            for run in runs.values():
+                update_state(run, stat_cache, waiter)
+                update_stdout(run, stat_cache)
+
+            screen = render(options, runs)
+            if options.once:
+                print(screen)
+                return
+            print('\033[2J\033[H' + screen, flush=True)
+            drawn = time.monotonic()
+            if waiter.wait(options.interval):
+                time.sleep(max(0.0, drawn + MIN_REDRAW_INTERVAL - time.monotonic()))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        waiter.close()
@@ -0,0 +1,29 @@
+import pathlib
+import sys
+from collections.abc import Callable
+
+import pytest
+
+import ralphlib.api
+import ralphlib.events
+import ralphlib.iteration
+import ralphlib.options
+import ralphlib.types
+
+
+@pytest.fixture(autouse=True)
+def short_poll(monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.setattr(ralphlib.iteration, 'SUBPROCESS_POLL_INTERVAL', 0.1)
+
+
+# runs the loop on an agent script written to tmp_path, keyword arguments are options
+@pytest.fixture
+def run_agent(tmp_path: pathlib.Path) -> Callable[..., list[ralphlib.events.Event]]:
+    def run(agent: str, args: str = '', cancel: ralphlib.types.CancelToken | None = None, **kwargs) -> list[ralphlib.events.Event]:
+        agent_file = tmp_path / 'agent.py'
+        agent_file.write_text(agent)
+        defaults = {'prompts': 'do it', 'quiet': True, 'cwd': str(tmp_path), 'state': 'state.json'}
+        options = ralphlib.options.RalpherOptions(agent=sys.executable, args=f'{agent_file} {args}'.rstrip(), **(defaults | kwargs))
+        return list(ralphlib.api.Loop(options, cancel))
+
+    return run
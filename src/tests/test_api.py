@@ -0,0 +1,69 @@
+import json
+import pathlib
+import sys
+from collections.abc import Callable
+
+import pytest
+
+import ralphlib.api
+import ralphlib.events
+import ralphlib.looper
+import ralphlib.options
+import ralphlib.types
+
+AGENT = """
+import json
+print(json.dumps({'type': 'assistant', 'message': {'content': [{'type': 'tool_use', 'id': 't1', 'name': 'Bash', 'input': {'command': 'ls'}}]}}))
+print(json.dumps({'type': 'result', 'subtype': 'success', 'is_error': False, 'result': 'done <promise>COMPLETE</promise>'}))
+"""
+
+
+def test_loop_events(tmp_path: pathlib.Path, run_agent: Callable[..., list[ralphlib.events.Event]]) -> None:
+    events = run_agent(AGENT, iterations=3)
+
+    assert [type(e) for e in events] == [
+        ralphlib.events.LoopStart,
+        ralphlib.events.IterationStart,
+        ralphlib.events.ToolUse,
+        ralphlib.events.Complete,
+        ralphlib.events.IterationEnd,
+        ralphlib.events.LoopEnd,
+    ]
+    assert events[2].name == 'Bash'
+    assert events[2].input == 'ls'
+    assert events[-1].stopped == ['complete']
+    # relative paths are resolved against cwd
+    state = json.loads((tmp_path / 'state.json').read_text())
+    assert state['stopped'] == ['complete']
+
+
+def test_loop_shared_token(tmp_path: pathlib.Path, run_agent: Callable[..., list[ralphlib.events.Event]]) -> None:
+    cancel = ralphlib.types.CancelToken()
+
+    # a loop that ends on its own leaves the token to the other loops sharing it
+    first = run_agent(AGENT, cancel=cancel, iterations=3)
+    assert not cancel.is_cancelled()
+    second = run_agent(AGENT, cancel=cancel, iterations=3)
+
+    assert first[-1].stopped == ['complete']
+    assert second[-1].stopped == ['complete']
+
+    # one that is left early stops them all
+    options = ralphlib.options.RalpherOptions(agent=sys.executable, args=str(tmp_path / 'agent.py'), prompts='do it', quiet=True, cwd=str(tmp_path))
+    for _event in ralphlib.api.Loop(options, cancel):
+        break
+    assert cancel.is_cancelled()
+
+
+def test_loop_exception(tmp_path: pathlib.Path, monkeypatch: pytest.MonkeyPatch) -> None:
+    def fail(*args, **kwargs) -> None:
+        raise RuntimeError('agent not found')
+
+    monkeypatch.setattr(ralphlib.looper, 'run_iteration', fail)
+    options = ralphlib.options.RalpherOptions(agent='agent', prompts='do it', quiet=True, cwd=str(tmp_path), state='state.json')
+
+    events = list(ralphlib.api.Loop(options))
+
+    assert events[-1].stopped == ['exception']
+    state = json.loads((tmp_path / 'state.json').read_text())
+    assert state['stopped'] == ['exception']
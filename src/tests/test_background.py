@@ -0,0 +1,117 @@
+import json
+import pathlib
+from collections.abc import Callable
+
+import pytest
+
+import ralphlib.events
+import ralphlib.iteration
+import ralphlib.options
+import ralphlib.types
+
+
+def assistant(tool_use_id: str, name: str, tool_input: dict) -> str:
+    return json.dumps({'type': 'assistant', 'message': {'content': [{'type': 'tool_use', 'id': tool_use_id, 'name': name, 'input': tool_input}]}})
+
+
+def user(tool_use_id: str, content: str | list) -> str:
+    return json.dumps({'type': 'user', 'message': {'role': 'user', 'content': [{'type': 'tool_result', 'tool_use_id': tool_use_id, 'content': content}]}})
+
+
+def make_context() -> tuple[ralphlib.options.RalpherOptions, dict]:
+    options = ralphlib.options.RalpherOptions(agent='agent', prompts='do it')
+    return options, ralphlib.iteration.make_context(options, 'do it', 1)
+
+
+def start(options: ralphlib.options.RalpherOptions, context: dict, tool_use_id: str, command: str, task_id: str) -> None:
+    message_type, message = ralphlib.iteration.process_line(options, context, assistant(tool_use_id, 'Bash', {'command': command, 'run_in_background': True}))
+    assert message_type == ralphlib.types.MessageType.TOOL_USE
+    assert message == f'Bash\n  {command}\n(running in background)'
+    # the result of a background start is a list of text blocks
+    ralphlib.iteration.process_line(
+        options,
+        context,
+        user(tool_use_id, [{'type': 'text', 'text': f'Command running in background with ID: {task_id}. Output is being written to: /tmp/{task_id}.output'}]),
+    )
+
+
+def test_lifecycle() -> None:
+    options, context = make_context()
+    start(options, context, 'toolu_1', 'npm run dev', 'b1')
+    task = context['background_tools']['toolu_1']
+    assert task['task_id'] == 'b1'
+    assert task['status'] == 'running'
+
+    # polls are labelled with the task they poll
+    message_type, message = ralphlib.iteration.process_line(options, context, assistant('toolu_2', 'BashOutput', {'bash_id': 'b1'}))
+    assert message_type == ralphlib.types.MessageType.TOOL_USE
+    assert message == 'BashOutput\nBash\n  npm run dev'
+    ralphlib.iteration.process_line(options, context, user('toolu_2', '<status>running</status>\n<stdout>ready</stdout>'))
+    assert task['polls'] == 1
+    assert task['status'] == 'running'
+
+    ralphlib.iteration.process_line(options, context, assistant('toolu_3', 'TaskOutput', {'task_id': 'b1'}))
+    ralphlib.iteration.process_line(options, context, user('toolu_3', [{'type': 'text', 'text': '<status>failed</status>\n<exit_code>2</exit_code>'}]))
+    assert task['polls'] == 2
+    assert task['status'] == 'failed'
+    assert task['exit_code'] == 2
+    assert 'seconds' in task
+
+
+def test_stop() -> None:
+    options, context = make_context()
+    start(options, context, 'toolu_1', 'sleep 100', 'b1')
+
+    message_type, message = ralphlib.iteration.process_line(options, context, assistant('toolu_2', 'KillShell', {'shell_id': 'b1'}))
+    assert message == 'KillShell\nBash\n  sleep 100'
+    task = context['background_tools']['toolu_1']
+    assert task['status'] == 'stopped'
+    assert task['polls'] == 0
+
+    # a late poll result does not change a finished task
+    ralphlib.iteration.process_line(options, context, assistant('toolu_3', 'BashOutput', {'bash_id': 'b1'}))
+    ralphlib.iteration.process_line(options, context, user('toolu_3', '<status>completed</status><exit_code>0</exit_code>'))
+    assert task['status'] == 'stopped'
+    assert 'exit_code' not in task
+
+
+def test_end_background_tools() -> None:
+    options, context = make_context()
+    start(options, context, 'toolu_1', 'npm run dev', 'b1')
+    start(options, context, 'toolu_2', 'sleep 100', 'b2')
+    start(options, context, 'toolu_3', 'python -m http.server', 'b3')
+    # only whole commands count, a process that merely mentions one does not
+    context['reaped'] = [
+        {'pid': 10, 'command': 'npm run dev', 'argv': ['npm', 'run', 'dev']},
+        {'pid': 11, 'command': 'sh -c sleep 100', 'argv': ['sh', '-c', 'sleep 100']},
+        {'pid': 12, 'command': 'grep python -m http.server.log', 'argv': ['grep', 'python -m http.server.log']},
+    ]
+
+    ralphlib.iteration.end_background_tools(context)
+
+    tasks = context['background_tools']
+    assert [tasks[t]['status'] for t in ('toolu_1', 'toolu_2', 'toolu_3')] == ['reaped', 'reaped', 'running']
+    assert all(tasks[t]['running_at_end'] for t in tasks)
+
+
+# starts a background task like the Bash tool and exits without stopping it
+AGENT = """
+import json
+import subprocess
+subprocess.Popen(['sleep', '100'])
+print(json.dumps({'type': 'assistant', 'message': {'content': [{'type': 'tool_use', 'id': 'toolu_1', 'name': 'Bash', 'input': {'command': 'sleep 100', 'run_in_background': True}}]}}))
+print(json.dumps({'type': 'user', 'message': {'role': 'user', 'content': [{'type': 'tool_result', 'tool_use_id': 'toolu_1', 'content': 'Command running in background with ID: b1. Output is being written to: /tmp/b1'}]}}))
+print(json.dumps({'type': 'result', 'subtype': 'success', 'is_error': False, 'result': 'started'}))
+"""
+
+
+@pytest.mark.skipif(not pathlib.Path('/proc').is_dir(), reason='needs /proc')
+def test_reaped(tmp_path: pathlib.Path, run_agent: Callable[..., list[ralphlib.events.Event]]) -> None:
+    run_agent(AGENT, iterations=1)
+
+    state = json.loads((tmp_path / 'state.json').read_text())
+    iteration = state['iterations']['1']
+    assert [r['command'] for r in iteration['reaped']] == ['sleep 100']
+    task = iteration['background_tasks']['toolu_1']
+    assert task['task_id'] == 'b1'
+    assert task['status'] == 'reaped'
@@ -0,0 +1,23 @@
+import pathlib
+
+import ralphlib.blobs
+import ralphlib.options
+
+
+def test_blobs(tmp_path: pathlib.Path) -> None:
+    options = ralphlib.options.RalpherOptions(logdir=str(tmp_path), state='state.json', blob_min_size=16)
+    prompt = 'Fix the tests\n' * 100
+
+    ref = ralphlib.blobs.ref_value(options, prompt)
+    assert ralphlib.blobs.is_ref(ref)
+    assert ralphlib.blobs.ref_value(options, prompt) == ref
+    assert len(list((tmp_path / 'blobs').rglob('*.gz'))) == 1
+    assert ralphlib.blobs.load(ralphlib.blobs.find_root(tmp_path / 'state.json'), ref) == prompt
+
+    payload = {'content': 'x' * 100, 'file_path': 'a.py'}
+    ref = ralphlib.blobs.ref_value(options, payload)
+    assert ralphlib.blobs.load(tmp_path / 'blobs', ref) == payload
+
+    # small values stay inline
+    assert ralphlib.blobs.ref_value(options, 'short') == 'short'
+    assert ralphlib.blobs.load(tmp_path / 'blobs', 'short') == 'short'
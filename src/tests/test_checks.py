@@ -0,0 +1,103 @@
+import pathlib
+import time
+from collections.abc import Callable
+
+import ralphlib.checks
+import ralphlib.events
+import ralphlib.options
+
+AGENT = """
+import json
+import sys
+with open('prompts.txt', 'a') as f:
+    f.write(sys.argv[-1] + '\\n')
+print(json.dumps({'type': 'result', 'subtype': 'success', 'is_error': False, 'result': 'done <promise>COMPLETE</promise>'}))
+"""
+
+
+def test_parallel(tmp_path: pathlib.Path) -> None:
+    options = ralphlib.options.RalpherOptions(cwd=str(tmp_path), checks=['sleep 0.5'] * 4, check_jobs=4)
+
+    started = time.monotonic()
+    checks = ralphlib.checks.run(options, {})
+
+    assert time.monotonic() - started < 1.5
+    assert checks['passed']
+    assert [r['returncode'] for r in checks['results']] == [0, 0, 0, 0]
+
+
+def test_failed_and_files(tmp_path: pathlib.Path) -> None:
+    (tmp_path / 'done.txt').write_text('')
+    options = ralphlib.options.RalpherOptions(cwd=str(tmp_path), checks=['true', "sh -c 'echo broken; exit 3'"], check_files=['done.txt', 'missing.txt'])
+
+    checks = ralphlib.checks.run(options, {})
+
+    assert not checks['passed']
+    assert [(r['name'], r['passed']) for r in checks['results']] == [
+        ('done.txt', True),
+        ('missing.txt', False),
+        ('true', True),
+        ("sh -c 'echo broken; exit 3'", False),
+    ]
+    assert checks['results'][3]['returncode'] == 3
+    assert checks['results'][3]['output'] == 'broken\n'
+
+
+def test_timeout(tmp_path: pathlib.Path) -> None:
+    # the background sleep keeps the output pipe open, only killing the group ends it
+    options = ralphlib.options.RalpherOptions(cwd=str(tmp_path), checks=["sh -c 'sleep 100 & sleep 100'"], check_timeout=0.5)
+
+    started = time.monotonic()
+    cache: dict = {}
+    checks = ralphlib.checks.run(options, cache)
+
+    assert time.monotonic() - started < 10
+    assert not checks['passed']
+    assert checks['results'][0]['timed_out']
+    # a timeout says nothing about the workspace, it is not cached
+    assert cache == {}
+
+
+def test_cache(tmp_path: pathlib.Path) -> None:
+    # the check writes to the workspace itself, that is no change by the agent
+    options = ralphlib.options.RalpherOptions(cwd=str(tmp_path), checks=["sh -c 'echo run >> runs.log'"])
+    cache: dict = {}
+
+    first = ralphlib.checks.run(options, cache)
+    second = ralphlib.checks.run(options, cache)
+    assert not first['results'][0].get('cached')
+    assert second['results'][0]['cached']
+    assert second['passed']
+    assert (tmp_path / 'runs.log').read_text() == 'run\n'
+
+    (tmp_path / 'main.py').write_text('print()')
+    third = ralphlib.checks.run(options, cache)
+    assert not third['results'][0].get('cached')
+    assert (tmp_path / 'runs.log').read_text() == 'run\nrun\n'
+
+
+def test_claimed_completion_overridden(run_agent: Callable[..., list[ralphlib.events.Event]]) -> None:
+    events = run_agent(AGENT, iterations=2, checks=['false'])
+
+    ends = [e for e in events if isinstance(e, ralphlib.events.IterationEnd)]
+    assert [e.outcome['complete'] for e in ends] == [False, False]
+    assert events[-1].stopped == []
+
+    events = run_agent(AGENT, iterations=2, checks=['true'])
+    assert events[-1].stopped == ['complete']
+    assert events[-1].iterations == 1
+
+
+def test_prompt_not_a_template(tmp_path: pathlib.Path, run_agent: Callable[..., list[ralphlib.events.Event]]) -> None:
+    # prompts that do not ask for the check results are sent as they are
+    prompt = 'Keep {{ and {% as they are'
+    run_agent(AGENT, prompts=prompt, iterations=2, checks=['false'])
+
+    assert (tmp_path / 'prompts.txt').read_text() == f'{prompt}\n{prompt}\n'
+
+
+def test_prompt_with_checks(tmp_path: pathlib.Path, run_agent: Callable[..., list[ralphlib.events.Event]]) -> None:
+    prompt = '{% if checks %}failed: {{ checks.results[0].name }}{% else %}first{% endif %}'
+    run_agent(AGENT, prompts=prompt, iterations=2, checks=['false'])
+
+    assert (tmp_path / 'prompts.txt').read_text() == 'first\nfailed: false\n'
@@ -0,0 +1,118 @@
+import pathlib
+import subprocess
+from collections.abc import Callable
+
+import pytest
+
+import ralphlib.convergence
+import ralphlib.events
+import ralphlib.options
+
+
+def make_outcome(result: str, tools: list[str]) -> dict:
+    return {
+        'result': result,
+        'tools_used': tools,
+    }
+
+
+def test_convergence_stale_iterations() -> None:
+    options = ralphlib.options.RalpherOptions(
+        converge=['tools', 'result'],
+        converge_after=2,
+    )
+    tracker = ralphlib.convergence.make_tracker(options)
+
+    verdict = ralphlib.convergence.update(options, tracker, make_outcome('Fixed the parser and updated the tests.', ['Bash', 'Edit']))
+    assert verdict['changed'] == ['tools', 'result']
+    assert not verdict['converged']
+
+    verdict = ralphlib.convergence.update(options, tracker, make_outcome('Fixed the parser and updated the tests.', ['Bash', 'Edit']))
+    assert verdict['changed'] == []
+    assert verdict['stale_iterations'] == 1
+    assert not verdict['converged']
+
+    verdict = ralphlib.convergence.update(options, tracker, make_outcome('Fixed the parser and updated the tests.', ['Bash', 'Edit']))
+    assert verdict['stale_iterations'] == 2
+    assert verdict['converged']
+
+    verdict = ralphlib.convergence.update(options, tracker, make_outcome('Nothing left to do.', ['Bash', 'Edit']))
+    assert verdict['changed'] == ['result']
+    assert verdict['stale_iterations'] == 0
+
+
+def test_convergence_backoff() -> None:
+    options = ralphlib.options.RalpherOptions(
+        converge=['tools'],
+        converge_after=1,
+        converge_action='backoff',
+        converge_backoff=10,
+    )
+    tracker = ralphlib.convergence.make_tracker(options)
+    ralphlib.convergence.update(options, tracker, make_outcome('', ['Read']))
+    assert ralphlib.convergence.update(options, tracker, make_outcome('', ['Read']))['backoff_seconds'] == 10
+    assert ralphlib.convergence.update(options, tracker, make_outcome('', ['Read']))['backoff_seconds'] == 20
+
+
+IDLE_AGENT = """
+import json
+print(json.dumps({'type': 'result', 'subtype': 'success', 'is_error': False, 'result': 'Nothing to do.'}))
+"""
+
+
+@pytest.mark.parametrize('check', ['workspace', 'git'])
+def test_convergence_logs_in_workspace(tmp_path: pathlib.Path, run_agent: Callable[..., list[ralphlib.events.Event]], check: str) -> None:
+    if check == 'git':
+        for args in (['init', '-q'], ['-c', 'user.name=t', '-c', 'user.email=t@t', 'commit', '-q', '--allow-empty', '-m', 'init']):
+            subprocess.run(['git', '-C', str(tmp_path), *args], check=True)  # noqa: S603, S607
+    # the state, logs and blobs written by the loop itself are no progress
+    events = run_agent(
+        IDLE_AGENT,
+        prompts='do it ' * 100,
+        progress='progress.txt',
+        stdout='stdout.jsonl',
+        log_file='ralpher.log',
+        blob_min_size=16,
+        iterations=5,
+        converge=[check],
+        converge_after=1,
+    )
+
+    assert events[-1].stopped == ['converged']
+    assert events[-1].iterations == 1
+    assert (tmp_path / 'blobs').is_dir()
+
+
+# changes the workspace every iteration
+WORKING_AGENT = """
+import json
+with open('work.txt', 'a') as f:
+    f.write('more\\n')
+print(json.dumps({'type': 'result', 'subtype': 'success', 'is_error': False, 'result': 'Nothing to do.'}))
+"""
+
+
+@pytest.mark.parametrize('repository', [False, True])
+def test_convergence_git_unavailable(
+    tmp_path: pathlib.Path, monkeypatch: pytest.MonkeyPatch, run_agent: Callable[..., list[ralphlib.events.Event]], repository: bool
+) -> None:
+    # outside a repository, or in one without commits, git fails every time, which is no sign of convergence
+    monkeypatch.setenv('GIT_CEILING_DIRECTORIES', str(tmp_path.parent))
+    if repository:
+        subprocess.run(['git', '-C', str(tmp_path), 'init', '-q'], check=True)  # noqa: S603, S607
+
+    events = run_agent(WORKING_AGENT, iterations=4, converge=['git'], converge_after=2)
+
+    assert events[-1].stopped == []
+    assert events[-1].iterations == 4
+
+
+def test_own_files_logdir(tmp_path: pathlib.Path) -> None:
+    options = ralphlib.options.RalpherOptions(cwd=str(tmp_path), logdir=str(tmp_path / 'logs'), state='state.json')
+    (tmp_path / 'logs').mkdir()
+    (tmp_path / 'logs' / 'state.json').write_text('{}')
+    before = ralphlib.convergence.workspace_fingerprint(options, None)
+    (tmp_path / 'logs' / 'state.json').write_text('{"iterations": {}}')
+    assert ralphlib.convergence.workspace_fingerprint(options, None) == before
+    (tmp_path / 'main.py').write_text('')
+    assert ralphlib.convergence.workspace_fingerprint(options, None) != before
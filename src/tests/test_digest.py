@@ -0,0 +1,36 @@
+import ralphlib.digest
+import ralphlib.options
+
+
+def make_outcome(result: str) -> dict:
+    return {
+        'complete': False,
+        'error': False,
+        'watchdog': None,
+        'failure': None,
+        'tools_used': ['Bash', 'Edit'],
+        'result': result,
+    }
+
+
+def test_used() -> None:
+    assert ralphlib.digest.used('Last time:\n{{ history_text }}')
+    assert ralphlib.digest.used('{% for h in history %}{{ h.result }}{% endfor %}')
+    assert not ralphlib.digest.used('Fix the tests in iteration {{ iteration }}')
+    assert not ralphlib.digest.used('Not a template {{')
+
+
+def test_digest_budget() -> None:
+    options = ralphlib.options.RalpherOptions(digest_iterations=3, digest_bytes=600)
+    digest = ralphlib.digest.make_digest(options)
+    checks = {'passed': False, 'results': [{'name': 'pytest', 'passed': False}, {'name': 'ruff', 'passed': True}]}
+    for i in range(1, 11):
+        ralphlib.digest.add(options, digest, i, make_outcome(f'result {i} ' + 'ä' * 1000), checks if i == 10 else None, 65)
+        context = ralphlib.digest.context(options, digest)
+        assert len(context['history_text'].encode('utf-8')) <= options.digest_bytes
+
+    assert [h['iteration'] for h in context['history']] == [8, 9, 10]
+    assert context['history'][-1]['checks'] == {'passed': False, 'failed': ['pytest']}
+    assert 'Iteration 10 (1 minute 5 seconds): checks failed: pytest; tools: Bash, Edit' in context['history_text']
+    assert context['history'][-1]['result'].startswith('result 10 ä')
+    assert context['history'][-1]['result'].endswith('…')
@@ -0,0 +1,64 @@
+import json
+import pathlib
+
+import ralphlib.indexer
+import ralphlib.options
+
+
+def write_run(logdir: pathlib.Path) -> pathlib.Path:
+    stdout = logdir / 'stdout-1.jsonl'
+    lines = [
+        {'type': 'system', 'subtype': 'init'},
+        {'type': 'assistant', 'message': {'content': [{'type': 'tool_use', 'id': 'toolu_1', 'name': 'Bash', 'input': {'command': 'make test'}}]}},
+        {'type': 'result', 'subtype': 'success', 'is_error': False, 'num_turns': 3, 'total_cost_usd': 0.5, 'result': 'done'},
+    ]
+    stdout.write_text(''.join(json.dumps(line) + '\n' for line in lines))
+    state = {
+        'start': '2026-01-01T10:00:00',
+        'agent': 'claude',
+        'prompt': 'Fix the tests\nand more',
+        'max_iterations': 3,
+        'stopped': ['complete'],
+        'iterations': {
+            '1': {
+                'start': '2026-01-01T10:00:00',
+                'stdout': str(stdout),
+                'complete': True,
+                'tool_times': {'toolu_1': {'name': 'Bash', 'start': '2026-01-01T10:00:05', 'seconds': 12.5}},
+            },
+        },
+    }
+    path = logdir / 'state.json'
+    path.write_text(json.dumps(state))
+    return stdout
+
+
+def test_indexer(tmp_path: pathlib.Path) -> None:
+    stdout = write_run(tmp_path)
+    options = ralphlib.options.QueryOptions(logdir=str(tmp_path))
+    with ralphlib.indexer.connect(ralphlib.indexer.db_path(options)) as conn:
+        ralphlib.indexer.index(options, conn)
+        tool = conn.execute('SELECT * FROM tool_uses').fetchone()
+        assert tool['name'] == 'Bash'
+        assert tool['input'] == 'make test'
+        assert tool['seconds'] == 12.5
+        run = conn.execute('SELECT * FROM runs').fetchone()
+        assert run['prompt_head'] == 'Fix the tests'
+        assert run['stopped'] == 'complete'
+
+        # appended lines are picked up, already indexed ones are not read again
+        with stdout.open('a') as fd:
+            fd.write(
+                json.dumps(
+                    {'type': 'assistant', 'message': {'content': [{'type': 'tool_use', 'id': 'toolu_2', 'name': 'Read', 'input': {'file_path': 'a.py'}}]}}
+                )
+            )
+        ralphlib.indexer.index(options, conn)
+        assert conn.execute('SELECT count(*) FROM tool_uses').fetchone()[0] == 1
+        with stdout.open('a') as fd:
+            fd.write('\n')
+        ralphlib.indexer.index(options, conn)
+        assert conn.execute('SELECT count(*) FROM tool_uses').fetchone()[0] == 2
+
+        rows = conn.execute(ralphlib.indexer.REPORTS['slowest-tools'], {'since': '', 'limit': 10}).fetchall()
+        assert rows[0]['seconds'] == 12.5
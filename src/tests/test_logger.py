@@ -0,0 +1,26 @@
+from loguru import logger
+
+import ralphlib.logger
+
+
+def test_log_limiter() -> None:
+    limiter = ralphlib.logger.LogLimiter()
+    limiter.max_repeats = 2
+    limiter.max_per_site = 3
+    messages = []
+    logger.configure(patcher=limiter.patch)
+    handler_id = logger.add(messages.append, format='{message}', filter=limiter.allowed)
+    try:
+        for _ in range(5):
+            logger.warning('same')
+        for i in range(5):
+            logger.warning(f'other {i}')
+        logger.error('same')
+    finally:
+        logger.remove(handler_id)
+        logger.configure(patcher=None)
+
+    assert [m.strip() for m in messages] == ['same', 'same', 'other 0', 'other 1', 'other 2', 'same']
+    suppressed = limiter.reset()
+    assert sorted(suppressed.values()) == [2, 3]
+    assert limiter.reset() == {}
@@ -0,0 +1,61 @@
+import json
+import pathlib
+from collections.abc import Callable
+
+import ralphlib.events
+
+MAX_LINE_SIZE = 1000
+MARKER = '<promise>COMPLETE</promise>'
+OPTIONS = {'stdout': 'stdout.jsonl', 'iterations': 1, 'retries': 0, 'max_line_size': MAX_LINE_SIZE}
+
+# key order other than type, id, name, and the marker inside the tool input
+TOOL_USE = {'id': 't1', 'name': 'Write', 'type': 'tool_use', 'input': {'file_path': 'a.md', 'content': 'x' * 5000 + MARKER}}
+TOOL_RESULT = {'type': 'tool_result', 'tool_use_id': 't1', 'content': [{'type': 'text', 'text': 'y' * 5000}]}
+
+
+# prints the given lines like an agent
+def agent(lines: list[dict]) -> str:
+    return f'import json\nfor line in {lines!r}:\n    print(json.dumps(line))\n'
+
+
+def outcome(events: list[ralphlib.events.Event]) -> dict:
+    return next(e for e in events if isinstance(e, ralphlib.events.IterationEnd)).outcome
+
+
+def test_tool_use_and_result(tmp_path: pathlib.Path, run_agent: Callable[..., list[ralphlib.events.Event]]) -> None:
+    lines = [
+        {'type': 'assistant', 'message': {'id': 'msg_1', 'content': [TOOL_USE]}},
+        {'type': 'user', 'message': {'content': [TOOL_RESULT]}},
+        {'type': 'result', 'subtype': 'success', 'is_error': False, 'result': 'done'},
+    ]
+    events = run_agent(agent(lines), **OPTIONS)
+
+    tool_uses = [e for e in events if isinstance(e, ralphlib.events.ToolUse)]
+    assert [e.name for e in tool_uses] == ['Write']
+    assert not any(isinstance(e, ralphlib.events.Complete) for e in events)
+    assert not outcome(events)['complete']
+    assert outcome(events)['tools_used'] == ['Write']
+    # oversized lines still reach the raw log in full
+    logged = (tmp_path / 'stdout-1.jsonl').read_text().splitlines()
+    assert [json.loads(line) for line in logged] == lines
+
+
+def test_marker_before_tool_use(run_agent: Callable[..., list[ralphlib.events.Event]]) -> None:
+    events = run_agent(agent([{'type': 'assistant', 'message': {'content': [{'type': 'text', 'text': f'All done {MARKER}'}, TOOL_USE]}}]), **OPTIONS)
+
+    assert any(isinstance(e, ralphlib.events.Complete) for e in events)
+    assert outcome(events)['complete']
+
+
+def test_error_result(run_agent: Callable[..., list[ralphlib.events.Event]]) -> None:
+    events = run_agent(agent([{'type': 'result', 'subtype': 'success', 'is_error': True, 'result': 'z' * 5000}]), **OPTIONS)
+
+    assert outcome(events)['error']
+    assert events[-1].stopped == ['error']
+
+
+def test_marker_in_result(run_agent: Callable[..., list[ralphlib.events.Event]]) -> None:
+    events = run_agent(agent([{'type': 'result', 'subtype': 'success', 'is_error': False, 'result': 'z' * 5000 + MARKER}]), **OPTIONS)
+
+    assert outcome(events)['complete']
+    assert events[-1].stopped == ['complete']
@@ -0,0 +1,200 @@
+import pathlib
+import sys
+import time
+from collections.abc import Callable
+
+import pytest
+
+import ralphlib.events
+import ralphlib.options
+import ralphlib.pipeline
+import ralphlib.retry
+import ralphlib.scheduler
+import ralphlib.types
+
+# waits for its prompt like an agent started ahead of time
+WAITING_AGENT = """
+import sys
+sys.stdin.read()
+"""
+
+EXITING_AGENT = """
+import sys
+sys.exit(3)
+"""
+
+
+@pytest.fixture(autouse=True)
+def no_delay(monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.setattr(ralphlib.pipeline, 'PRESPAWN_DELAY', 0)
+
+
+def make_options(tmp_path: pathlib.Path, agent: str, prompt_via: str = 'stdin', **kwargs) -> ralphlib.options.RalpherOptions:
+    agent_file = tmp_path / 'agent.py'
+    agent_file.write_text(agent)
+    return ralphlib.options.RalpherOptions(
+        agent=sys.executable,
+        args=str(agent_file),
+        prompt_via=prompt_via,
+        cwd=str(tmp_path),
+        logdir=str(tmp_path),
+        stdout='stdout.jsonl',
+        vars=['name=World'],
+        iterations=3,
+        **kwargs,
+    )
+
+
+def wait_prepared(pipeline: ralphlib.pipeline.Pipeline) -> None:
+    assert pipeline.thread is not None
+    pipeline.thread.join()
+
+
+def test_take(tmp_path: pathlib.Path) -> None:
+    pipeline = ralphlib.pipeline.Pipeline(make_options(tmp_path, WAITING_AGENT))
+    pipeline.start(2, 'Hello {{ name }}, iteration {{ iteration }}', render=True)
+    wait_prepared(pipeline)
+
+    prepared = pipeline.take(2)
+    assert prepared is not None
+    proc = prepared['proc']
+    try:
+        assert prepared['prompt'] == 'Hello World, iteration 2'
+        assert prepared['cmd'] == [sys.executable, str(tmp_path / 'agent.py')]
+        assert proc is not None
+        assert proc.poll() is None
+        assert prepared['slot'] is None
+        assert (tmp_path / 'stdout-2.jsonl').exists()
+    finally:
+        ralphlib.pipeline.stop(proc)
+    assert proc.returncode is not None
+    # taken only once
+    assert pipeline.take(2) is None
+
+
+def test_take_other_iteration(tmp_path: pathlib.Path) -> None:
+    pipeline = ralphlib.pipeline.Pipeline(make_options(tmp_path, WAITING_AGENT))
+    pipeline.start(2, 'do it', render=False)
+    wait_prepared(pipeline)
+    proc = pipeline.next['proc']
+
+    assert pipeline.take(3) is None
+    assert proc.poll() is not None
+
+
+def test_discard(tmp_path: pathlib.Path) -> None:
+    pipeline = ralphlib.pipeline.Pipeline(make_options(tmp_path, WAITING_AGENT))
+    pipeline.start(2, 'do it', render=False)
+    wait_prepared(pipeline)
+    proc = pipeline.next['proc']
+
+    pipeline.discard()
+
+    assert proc.poll() is not None
+    assert pipeline.next is None
+    assert pipeline.take(2) is None
+
+
+def test_prompt_file(tmp_path: pathlib.Path) -> None:
+    pipeline = ralphlib.pipeline.Pipeline(make_options(tmp_path, WAITING_AGENT, prompt_via='file'))
+    pipeline.start(2, 'Hello {{ name }}', render=True)
+    wait_prepared(pipeline)
+
+    # written ahead, the agent itself is only started with the iteration
+    prepared = pipeline.take(2)
+    assert prepared is not None
+    assert prepared['proc'] is None
+    prompt_file = prepared['prompt_file']
+    assert prompt_file.read_text() == 'Hello World'
+    assert prepared['cmd'] == [sys.executable, str(tmp_path / 'agent.py'), str(prompt_file)]
+    prompt_file.unlink()
+
+    # a prompt file that is not used is removed
+    pipeline.start(3, 'do it', render=True)
+    wait_prepared(pipeline)
+    prompt_file = pipeline.next['prompt_file']
+    pipeline.discard()
+    assert not prompt_file.exists()
+
+    # a prompt that is only rendered with the iteration needs its command built then too
+    pipeline.start(4, 'do it', render=False)
+    wait_prepared(pipeline)
+    assert pipeline.take(4)['cmd'] is None
+
+
+def test_take_exited(tmp_path: pathlib.Path) -> None:
+    pipeline = ralphlib.pipeline.Pipeline(make_options(tmp_path, EXITING_AGENT))
+    pipeline.start(2, 'do it', render=True)
+    wait_prepared(pipeline)
+    pipeline.next['proc'].wait()
+
+    # the next iteration starts a fresh agent
+    prepared = pipeline.take(2)
+    assert prepared is not None
+    assert prepared['prompt'] == 'do it'
+    assert prepared['proc'] is None
+    assert prepared['slot'] is None
+
+
+def test_pacer(tmp_path: pathlib.Path) -> None:
+    pacer = ralphlib.retry.TokenBucket(1)
+    pacer.reserve()
+    pipeline = ralphlib.pipeline.Pipeline(make_options(tmp_path, WAITING_AGENT), pacer)
+    pipeline.start(2, 'do it', render=True)
+    wait_prepared(pipeline)
+
+    # no launch left, the agent is started with the iteration once the pacer allows it
+    prepared = pipeline.take(2)
+    assert prepared is not None
+    assert prepared['prompt'] == 'do it'
+    assert prepared['proc'] is None
+
+
+def test_host_slots(tmp_path: pathlib.Path) -> None:
+    options = make_options(tmp_path, WAITING_AGENT, host_slots=1, slots_dir=str(tmp_path / 'slots'))
+    held = ralphlib.scheduler.acquire(options, ralphlib.types.CancelToken(), deadline=time.monotonic())
+    assert held is not None
+
+    pipeline = ralphlib.pipeline.Pipeline(options)
+    pipeline.start(2, 'do it', render=True)
+    wait_prepared(pipeline)
+    prepared = pipeline.take(2)
+    assert prepared is not None
+    assert prepared['proc'] is None
+    assert prepared['slot'] is None
+
+    # with the slot free the pre-started agent holds it until the iteration is over
+    ralphlib.scheduler.release(held, 0)
+    pipeline.start(3, 'do it', render=True)
+    wait_prepared(pipeline)
+    prepared = pipeline.take(3)
+    assert prepared is not None
+    proc = prepared['proc']
+    slot = prepared['slot']
+    assert proc is not None
+    assert slot is not None
+    assert ralphlib.scheduler.acquire(options, ralphlib.types.CancelToken(), deadline=time.monotonic()) is None
+    ralphlib.pipeline.stop(proc)
+    ralphlib.scheduler.release(slot, 0)
+
+
+@pytest.mark.parametrize('prompt_via', ['argv', 'stdin', 'file'])
+def test_loop(tmp_path: pathlib.Path, run_agent: Callable[..., list[ralphlib.events.Event]], prompt_via: str) -> None:
+    agent = """
+import json
+import pathlib
+import sys
+if sys.argv[1] == 'stdin':
+    prompt = sys.stdin.read()
+elif sys.argv[1] == 'file':
+    prompt = pathlib.Path(sys.argv[2]).read_text()
+else:
+    prompt = sys.argv[2]
+with open('prompts.txt', 'a') as f:
+    f.write(prompt + '\\n')
+print(json.dumps({'type': 'result', 'subtype': 'success', 'is_error': False, 'result': 'done'}))
+"""
+    events = run_agent(agent, prompt_via, prompt_via=prompt_via, pipeline=True, prompts='iteration {{ iteration }}', vars=['name=World'], iterations=3)
+
+    assert events[-1].iterations == 3
+    assert (tmp_path / 'prompts.txt').read_text() == 'iteration 1\niteration 2\niteration 3\n'
@@ -0,0 +1,64 @@
+import os
+import pathlib
+import resource
+import subprocess
+import sys
+import time
+
+import pytest
+
+import ralphlib.options
+import ralphlib.procgroup
+
+pytestmark = pytest.mark.skipif(not pathlib.Path('/proc').is_dir(), reason='needs /proc')
+
+
+def spawn(cmd: list[str], options: ralphlib.options.RalpherOptions | None = None) -> subprocess.Popen:
+    options = options or ralphlib.options.RalpherOptions()
+    proc = subprocess.Popen(cmd, **ralphlib.procgroup.popen_kwargs(options))  # noqa: S603
+    ralphlib.procgroup.apply_limits(options, proc)
+    return proc
+
+
+def test_reap(monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.setattr(ralphlib.procgroup, 'REAP_GRACE_PERIOD', 2)
+    # the shell exits right away and leaves the sleep behind in its process group
+    proc = spawn(['sh', '-c', 'sleep 100 &'])
+    proc.wait()
+
+    leftovers = ralphlib.procgroup.members_from_proc(pathlib.Path('/proc'), proc.pid)
+    assert [m['command'] for m in leftovers] == ['sleep 100']
+
+    reaped = ralphlib.procgroup.reap(proc.pid)
+    assert [m['command'] for m in reaped] == ['sleep 100']
+    assert ralphlib.procgroup.members(proc.pid) == []
+    assert ralphlib.procgroup.reap(proc.pid) == []
+
+
+def test_reap_after_grace_period(monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.setattr(ralphlib.procgroup, 'REAP_GRACE_PERIOD', 0.5)
+    # SIGTERM is ignored, only SIGKILL stops it
+    proc = spawn(['sh', '-c', "trap '' TERM; (trap '' TERM; sleep 100) &"])
+    proc.wait()
+    assert ralphlib.procgroup.members(proc.pid)
+
+    ralphlib.procgroup.reap(proc.pid)
+    deadline = time.monotonic() + 5
+    while ralphlib.procgroup.members(proc.pid) and time.monotonic() < deadline:
+        time.sleep(0.1)
+    assert ralphlib.procgroup.members(proc.pid) == []
+
+
+@pytest.mark.skipif(not hasattr(resource, 'prlimit'), reason='needs prlimit')
+def test_apply_limits() -> None:
+    options = ralphlib.options.RalpherOptions(rlimit_nofile=64, rlimit_cpu=100)
+    proc = spawn([sys.executable, '-c', 'import time; time.sleep(100)'], options)
+    try:
+        assert resource.prlimit(proc.pid, resource.RLIMIT_NOFILE)[0] == 64
+        assert resource.prlimit(proc.pid, resource.RLIMIT_CPU)[0] == 100
+        # the limits of this process are left alone
+        assert resource.getrlimit(resource.RLIMIT_CPU)[0] != 100
+        assert os.getpgid(proc.pid) == proc.pid
+    finally:
+        ralphlib.procgroup.kill(proc)
+        proc.wait()
@@ -0,0 +1,85 @@
+import json
+import pathlib
+from collections.abc import Callable
+
+import ralphlib.events
+
+# records the prompt it was given and how, then claims completion
+AGENT = """
+import json
+import pathlib
+import sys
+
+if sys.argv[1] == 'stdin':
+    prompt = sys.stdin.read()
+elif sys.argv[1] == 'file':
+    path = pathlib.Path(sys.argv[2])
+    prompt = path.read_text()
+else:
+    prompt = sys.argv[2]
+pathlib.Path('seen.json').write_text(json.dumps({'argv': sys.argv[1:], 'prompt': prompt}))
+print(json.dumps({'type': 'result', 'subtype': 'success', 'is_error': False, 'result': '<promise>COMPLETE</promise>'}))
+"""
+
+# exits without reading its stdin
+DEAF_AGENT = """
+import json
+print(json.dumps({'type': 'result', 'subtype': 'success', 'is_error': False, 'result': '<promise>COMPLETE</promise>'}))
+"""
+
+
+def seen(tmp_path: pathlib.Path) -> dict:
+    return json.loads((tmp_path / 'seen.json').read_text())
+
+
+def test_argv(tmp_path: pathlib.Path, run_agent: Callable[..., list[ralphlib.events.Event]]) -> None:
+    events = run_agent(AGENT, 'argv', prompt_via='argv', iterations=1)
+
+    assert seen(tmp_path) == {'argv': ['argv', 'do it'], 'prompt': 'do it'}
+    assert events[-1].stopped == ['complete']
+
+
+def test_stdin(tmp_path: pathlib.Path, run_agent: Callable[..., list[ralphlib.events.Event]]) -> None:
+    events = run_agent(AGENT, 'stdin', prompt_via='stdin', iterations=1)
+
+    assert seen(tmp_path) == {'argv': ['stdin'], 'prompt': 'do it'}
+    assert events[-1].stopped == ['complete']
+
+
+def test_stdin_large_prompt(tmp_path: pathlib.Path, run_agent: Callable[..., list[ralphlib.events.Event]]) -> None:
+    # far larger than a pipe buffer, the agent reads it while it is written
+    prompt = 'Fix the failing tests in the project.\n' * 100_000
+    events = run_agent(AGENT, 'stdin', prompts=prompt, prompt_via='stdin', iterations=1)
+
+    assert seen(tmp_path)['prompt'] == prompt
+    assert events[-1].stopped == ['complete']
+
+
+def test_stdin_not_read(run_agent: Callable[..., list[ralphlib.events.Event]]) -> None:
+    # the agent going away before the prompt was written is not an error of the loop
+    prompt = 'Fix the failing tests in the project.\n' * 100_000
+    events = run_agent(DEAF_AGENT, prompts=prompt, prompt_via='stdin', iterations=1)
+
+    assert events[-1].stopped == ['complete']
+
+
+def test_file(tmp_path: pathlib.Path, run_agent: Callable[..., list[ralphlib.events.Event]]) -> None:
+    events = run_agent(AGENT, 'file', prompt_via='file', iterations=1)
+
+    data = seen(tmp_path)
+    assert data['prompt'] == 'do it'
+    assert data['argv'][0] == 'file'
+    # appended to the arguments and removed once the iteration is over
+    prompt_file = pathlib.Path(data['argv'][1])
+    assert prompt_file.name.startswith('ralpher-prompt-')
+    assert not prompt_file.exists()
+    assert events[-1].stopped == ['complete']
+
+
+def test_file_placeholder(tmp_path: pathlib.Path, run_agent: Callable[..., list[ralphlib.events.Event]]) -> None:
+    prompt = 'Fix the failing tests in the project.\n' * 100_000
+    run_agent(AGENT, 'file {prompt_file} --verbose', prompts=prompt, prompt_via='file', iterations=1)
+
+    data = seen(tmp_path)
+    assert data['prompt'] == prompt
+    assert data['argv'][2] == '--verbose'
@@ -0,0 +1,64 @@
+import json
+import pathlib
+
+import pytest
+
+import ralphlib.options
+import ralphlib.reporter
+
+
+def write_run(logdir: pathlib.Path, name: str, stopped: list[str], error: bool) -> None:
+    stdout = logdir / f'{name}-stdout-1.jsonl'
+    result = {'type': 'result', 'subtype': 'success', 'is_error': error, 'result': 'API Error: overloaded' if error else 'done', 'total_cost_usd': 0.5}
+    stdout.write_text(json.dumps(result) + '\n')
+    state = {
+        'start': '2026-01-01T10:00:00',
+        'prompt': 'Fix the tests\nand more',
+        'max_iterations': 3,
+        'stopped': stopped,
+        'total_time_seconds': 120,
+        'iterations': {
+            '1': {
+                'time_seconds': 100,
+                'error': error,
+                'stdout': str(stdout),
+                'tool_times': {'toolu_1': {'name': 'Bash', 'seconds': 12.5}, 'toolu_2': {'name': 'Read', 'seconds': 0.5}},
+            },
+        },
+    }
+    (logdir / f'{name}.json').write_text(json.dumps(state))
+
+
+def test_report(tmp_path: pathlib.Path, capsys: pytest.CaptureFixture) -> None:
+    write_run(tmp_path, 'a', ['complete'], False)
+    write_run(tmp_path, 'b', ['error'], True)
+    options = ralphlib.options.ReportOptions(
+        logdirs=[str(tmp_path)],
+        json_file=str(tmp_path / 'report.json'),
+        html_file=str(tmp_path / 'report.html'),
+        jobs=1,
+    )
+    ralphlib.reporter.report(options)
+
+    data = json.loads((tmp_path / 'report.json').read_text())
+    assert data['runs'] == 2
+    assert data['completion_rate'] == 0.5
+    assert data['iterations_per_run'] == [{'iterations': 1, 'runs': 2}]
+    assert data['tools'][0] == {'name': 'Bash', 'uses': 2, 'seconds': 25.0, 'avg_seconds': 12.5}
+    assert data['errors'] == [{'reason': 'API Error: overloaded', 'iterations': 1}]
+    assert data['cost_usd'] == 1.0
+    assert data['run_list'][0]['task'] == 'Fix the tests'
+    assert 'Fix the tests' in (tmp_path / 'report.html').read_text()
+
+    assert '2 of 2 state files read' in capsys.readouterr().out
+
+    # the report written into the logdir is no state file, nothing changed so nothing is read
+    ralphlib.reporter.report(options)
+    assert '2 runs, 1 completed, 0 of 2 state files read' in capsys.readouterr().out
+
+    # only the changed run is read again
+    cache = ralphlib.reporter.load_cache(ralphlib.reporter.cache_path(options))
+    assert all(ralphlib.reporter.is_fresh(entry) for entry in cache.values())
+    (tmp_path / 'b-stdout-1.jsonl').write_text('')
+    assert not ralphlib.reporter.is_fresh(cache[str(tmp_path / 'b.json')])
+    assert ralphlib.reporter.is_fresh(cache[str(tmp_path / 'a.json')])
@@ -0,0 +1,116 @@
+import json
+import pathlib
+import sys
+import time
+from collections.abc import Callable
+
+import ralphlib.events
+import ralphlib.looper
+import ralphlib.options
+import ralphlib.retry
+import ralphlib.types
+
+# rate limited on its first launch, completes on the next one
+FLAKY_AGENT = """
+import json
+import pathlib
+calls = pathlib.Path('calls.txt')
+with calls.open('a') as f:
+    f.write('call\\n')
+if len(calls.read_text().splitlines()) == 1:
+    print(json.dumps({'type': 'result', 'subtype': 'success', 'is_error': True, 'result': 'API Error: 429 rate_limit_error'}))
+else:
+    print(json.dumps({'type': 'result', 'subtype': 'success', 'is_error': False, 'result': 'done <promise>COMPLETE</promise>'}))
+"""
+
+
+def make_outcome(**kwargs: object) -> dict:
+    outcome = {
+        'complete': False,
+        'error': False,
+        'result': '',
+        'returncode': 0,
+        'stderr_tail': [],
+        'watchdog': None,
+    }
+    outcome.update(kwargs)
+    return outcome
+
+
+def test_classify() -> None:
+    assert ralphlib.retry.classify(make_outcome()) is None
+    assert ralphlib.retry.classify(make_outcome(error=True, result='API Error: 429 rate_limit_error')) == ralphlib.retry.TRANSIENT
+    assert ralphlib.retry.classify(make_outcome(returncode=1, stderr_tail=['Error: overloaded_error'])) == ralphlib.retry.TRANSIENT
+    assert ralphlib.retry.classify(make_outcome(error=True, result='Invalid API key · Please run /login')) == ralphlib.retry.FATAL
+    assert ralphlib.retry.classify(make_outcome(error=True, result='Something went wrong')) == ralphlib.retry.FATAL
+    assert ralphlib.retry.classify(make_outcome(returncode=1)) is None
+    assert ralphlib.retry.classify(make_outcome(returncode=-15, watchdog='idle')) is None
+
+
+def test_backoff_delay() -> None:
+    options = ralphlib.options.RalpherOptions(retry_delay=10, retry_max_delay=60)
+    for attempt, delay in [(1, 10), (2, 20), (3, 40), (4, 60), (10, 60)]:
+        assert delay / 2 <= ralphlib.retry.backoff_delay(options, attempt) <= delay
+
+
+def test_token_bucket() -> None:
+    bucket = ralphlib.retry.TokenBucket(2)
+    assert bucket.reserve() == 0
+    assert bucket.reserve() == 0
+    assert 29 < bucket.reserve() <= 30
+
+
+def calls(tmp_path: pathlib.Path) -> int:
+    return len((tmp_path / 'calls.txt').read_text().splitlines())
+
+
+def iteration_end(events: list[ralphlib.events.Event]) -> ralphlib.events.IterationEnd:
+    return next(e for e in events if isinstance(e, ralphlib.events.IterationEnd))
+
+
+def test_retry(tmp_path: pathlib.Path, run_agent: Callable[..., list[ralphlib.events.Event]]) -> None:
+    events = run_agent(FLAKY_AGENT, iterations=1, retry_delay=0.2, retry_max_delay=0.2)
+
+    assert calls(tmp_path) == 2
+    outcome = iteration_end(events).outcome
+    assert outcome['complete']
+    assert outcome['failure'] is None
+    assert outcome['retries'] == 1
+    assert 0.1 <= outcome['retry_wait_seconds'] <= 0.2
+    assert events[-1].stopped == ['complete']
+    state = json.loads((tmp_path / 'state.json').read_text())
+    assert state['iterations']['1']['retries'] == 1
+    assert state['iterations']['1']['retry_wait_seconds'] == round(outcome['retry_wait_seconds'], 3)
+
+
+def test_retry_paced(tmp_path: pathlib.Path) -> None:
+    agent = tmp_path / 'agent.py'
+    agent.write_text(FLAKY_AGENT)
+    options = ralphlib.looper.resolve_paths(
+        ralphlib.options.RalpherOptions(agent=sys.executable, args=str(agent), prompts='do it', quiet=True, cwd=str(tmp_path), retry_delay=0)
+    )
+    # one launch a second
+    pacer = ralphlib.retry.TokenBucket(1)
+    pacer.rate = 1
+
+    started = time.monotonic()
+    outcome = ralphlib.looper.run_iteration(options, 'do it', 1, None, pacer, ralphlib.types.CancelToken(), ralphlib.looper.no_emit)
+
+    # the retry waits for its launch like any other
+    assert calls(tmp_path) == 2
+    assert outcome['retries'] == 1
+    assert 0 < outcome['retry_wait_seconds'] <= 1
+    assert time.monotonic() - started >= 1
+
+
+def test_retry_budget(tmp_path: pathlib.Path, run_agent: Callable[..., list[ralphlib.events.Event]]) -> None:
+    # a retry that could only start after the budget is not tried
+    started = time.monotonic()
+    events = run_agent(FLAKY_AGENT, iterations=1, retry_delay=20, retry_max_delay=20, budget=5)
+
+    assert time.monotonic() - started < 5
+    assert calls(tmp_path) == 1
+    outcome = iteration_end(events).outcome
+    assert outcome['failure'] == ralphlib.retry.TRANSIENT
+    assert outcome['retries'] == 0
+    assert outcome['retry_wait_seconds'] == 0
@@ -0,0 +1,41 @@
+import pathlib
+
+import pytest
+
+import ralphlib.options
+import ralphlib.scheduler
+import ralphlib.types
+
+
+def test_slots(tmp_path: pathlib.Path, monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.setattr(ralphlib.scheduler, 'SLOT_POLL_INTERVAL', 0.05)
+    monkeypatch.setattr(ralphlib.scheduler, 'available_memory', lambda: None)
+    monkeypatch.setattr(ralphlib.scheduler.os, 'getloadavg', lambda: (0.0, 0.0, 0.0))
+    options = ralphlib.options.RalpherOptions(host_slots=1, slots_dir=str(tmp_path))
+    cancel = ralphlib.types.CancelToken()
+
+    slot = ralphlib.scheduler.acquire(options, cancel)
+    assert slot is not None
+    assert slot['limits']['slots'] == 1
+
+    # the only slot is taken, waiting ends with the deadline
+    now = ralphlib.scheduler.time.monotonic()
+    assert ralphlib.scheduler.acquire(options, cancel, deadline=now + 0.2) is None
+
+    ralphlib.scheduler.release(slot, 2 * 1024 * 1024)
+    slot = ralphlib.scheduler.acquire(options, cancel, deadline=now + 10)
+    assert slot is not None
+    with ralphlib.scheduler.connect(ralphlib.scheduler.db_path(options)) as conn:
+        assert ralphlib.scheduler.agent_rss(conn) == 2 * 1024 * 1024
+        assert conn.execute('SELECT count(*) FROM queue').fetchone()[0] == 0
+    ralphlib.scheduler.release(slot, 0)
+
+
+def test_capacity(tmp_path: pathlib.Path, monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.setattr(ralphlib.scheduler.os, 'cpu_count', lambda: 8)
+    monkeypatch.setattr(ralphlib.scheduler.os, 'getloadavg', lambda: (6.5, 0.0, 0.0))
+    monkeypatch.setattr(ralphlib.scheduler, 'available_memory', lambda: ralphlib.scheduler.MEMORY_RESERVE + 3 * ralphlib.scheduler.DEFAULT_AGENT_RSS)
+    options = ralphlib.options.RalpherOptions(host_slots=10, slots_dir=str(tmp_path))
+    with ralphlib.scheduler.connect(ralphlib.scheduler.db_path(options)) as conn:
+        limits = ralphlib.scheduler.capacity(options, conn, held=2)
+    assert limits == {'max': 10, 'load': 3, 'memory': 5, 'slots': 3}
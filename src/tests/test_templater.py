@@ -12,3 +12,8 @@ def test_templater() -> None:
     prompt = '{{ greeting }}, {{ name }}!'
     rendered = ralphlib.templater.render(options, prompt, 1)
     assert rendered == 'Hello, World!'
+
+
+def test_variables() -> None:
+    assert ralphlib.templater.variables('{% if checks %}{{ checks.passed }}{% endif %} {{ iteration }}') == {'checks', 'iteration'}
+    assert ralphlib.templater.variables('Keep {{ as it is') == set()
@@ -0,0 +1,84 @@
+import json
+import pathlib
+from collections.abc import Callable
+
+import ralphlib.events
+
+SILENT_AGENT = """
+import time
+time.sleep(60)
+"""
+
+CHATTY_AGENT = """
+import json
+import time
+while True:
+    print(json.dumps({'type': 'assistant', 'message': {'content': [{'type': 'text', 'text': 'working'}]}}), flush=True)
+    time.sleep(0.05)
+"""
+
+
+def load_state(tmp_path: pathlib.Path) -> dict:
+    return json.loads((tmp_path / 'state.json').read_text())
+
+
+def iteration_ends(events: list[ralphlib.events.Event]) -> list[ralphlib.events.IterationEnd]:
+    return [e for e in events if isinstance(e, ralphlib.events.IterationEnd)]
+
+
+def test_timeout_continues(tmp_path: pathlib.Path, run_agent: Callable[..., list[ralphlib.events.Event]]) -> None:
+    events = run_agent(CHATTY_AGENT, iterations=2, timeout=0.5)
+    state = load_state(tmp_path)
+
+    ends = iteration_ends(events)
+    assert [e.outcome['watchdog'] for e in ends] == ['timeout', 'timeout']
+    assert events[-1].stopped == []
+    assert 'stopped' not in state
+
+
+def test_timeout_stop(tmp_path: pathlib.Path, run_agent: Callable[..., list[ralphlib.events.Event]]) -> None:
+    events = run_agent(CHATTY_AGENT, iterations=3, timeout=0.5, on_timeout='stop')
+    state = load_state(tmp_path)
+
+    ends = iteration_ends(events)
+    assert [e.outcome['watchdog'] for e in ends] == ['timeout']
+    assert events[-1].stopped == ['timeout']
+    assert state['stopped'] == ['timeout']
+
+
+def test_idle(tmp_path: pathlib.Path, run_agent: Callable[..., list[ralphlib.events.Event]]) -> None:
+    events = run_agent(SILENT_AGENT, iterations=3, idle_timeout=0.5, on_timeout='stop')
+    state = load_state(tmp_path)
+
+    ends = iteration_ends(events)
+    assert [e.outcome['watchdog'] for e in ends] == ['idle']
+    assert ends[0].seconds < 10
+    assert state['stopped'] == ['idle']
+
+
+def test_idle_not_reached_while_chatty(run_agent: Callable[..., list[ralphlib.events.Event]]) -> None:
+    events = run_agent(CHATTY_AGENT, iterations=1, idle_timeout=0.5, timeout=1.5)
+
+    assert [e.outcome['watchdog'] for e in iteration_ends(events)] == ['timeout']
+
+
+def test_budget(tmp_path: pathlib.Path, run_agent: Callable[..., list[ralphlib.events.Event]]) -> None:
+    # the budget stops the loop whatever --on-timeout says
+    events = run_agent(SILENT_AGENT, iterations=3, budget=0.5)
+    state = load_state(tmp_path)
+
+    ends = iteration_ends(events)
+    assert [e.outcome['watchdog'] for e in ends] == ['budget']
+    assert events[-1].stopped == ['budget']
+    assert state['watchdog'] == 'budget'
+    assert state['stopped'] == ['budget']
+
+
+def test_budget_before_iteration(tmp_path: pathlib.Path, run_agent: Callable[..., list[ralphlib.events.Event]]) -> None:
+    events = run_agent(SILENT_AGENT, iterations=3, budget=1e-9)
+    state = load_state(tmp_path)
+
+    assert iteration_ends(events) == []
+    assert events[-1].stopped == ['budget']
+    assert state['watchdog'] == 'budget'
+    assert state['stopped'] == ['budget']
@@ -0,0 +1,144 @@
+import json
+import pathlib
+
+import pytest
+
+import ralphlib.options
+import ralphlib.watcher
+
+
+def tool_line(name: str, command: str) -> bytes:
+    payload = {'type': 'assistant', 'message': {'content': [{'type': 'tool_use', 'id': 't', 'name': name, 'input': {'command': command}}]}}
+    return json.dumps(payload).encode() + b'\n'
+
+
+def make_run(tmp_path: pathlib.Path) -> tuple[dict, pathlib.Path]:
+    options = ralphlib.options.WatchOptions(logdirs=[str(tmp_path)], recent=10)
+    run = ralphlib.watcher.make_run(options, tmp_path / 'state.json', 'state.json')
+    stdout = tmp_path / 'stdout-1.jsonl'
+    stdout.write_bytes(b'')
+    run['stdout'] = str(stdout)
+    return run, stdout
+
+
+def append(path: pathlib.Path, data: bytes) -> None:
+    with path.open('ab') as fp:
+        fp.write(data)
+
+
+def test_update_stdout_append(tmp_path: pathlib.Path) -> None:
+    run, stdout = make_run(tmp_path)
+    stat_cache: dict = {}
+
+    append(stdout, tool_line('Bash', 'ls') + tool_line('Bash', 'pwd')[:20])
+    ralphlib.watcher.update_stdout(run, stat_cache)
+    assert list(run['tools']) == ['Bash ls']
+
+    # the rest of the partial line
+    append(stdout, tool_line('Bash', 'pwd')[20:])
+    ralphlib.watcher.update_stdout(run, stat_cache)
+    assert list(run['tools']) == ['Bash ls', 'Bash pwd']
+    assert run['offset'] == stdout.stat().st_size
+    assert run['partial'] == b''
+
+    # nothing new, nothing read
+    ralphlib.watcher.update_stdout(run, stat_cache)
+    assert list(run['tools']) == ['Bash ls', 'Bash pwd']
+
+
+def test_update_stdout_truncated(tmp_path: pathlib.Path) -> None:
+    run, stdout = make_run(tmp_path)
+    stat_cache: dict = {}
+    append(stdout, tool_line('Bash', 'ls') * 3)
+    ralphlib.watcher.update_stdout(run, stat_cache)
+
+    stdout.write_bytes(tool_line('Read', 'a'))
+    ralphlib.watcher.update_stdout(run, stat_cache)
+    assert list(run['tools'])[-1] == 'Read a'
+    assert run['offset'] == stdout.stat().st_size
+
+
+def test_update_stdout_long_line(tmp_path: pathlib.Path) -> None:
+    run, stdout = make_run(tmp_path)
+    stat_cache: dict = {}
+
+    # more than MAX_PARTIAL_LINE without a newline is dropped, the rest of the line is skipped
+    long_line = tool_line('Write', 'x' * (ralphlib.watcher.MAX_PARTIAL_LINE + 1000))
+    append(stdout, long_line[: ralphlib.watcher.MAX_PARTIAL_LINE + 10])
+    ralphlib.watcher.update_stdout(run, stat_cache)
+    assert run['partial'] == b''
+    assert run['skipping']
+
+    append(stdout, long_line[ralphlib.watcher.MAX_PARTIAL_LINE + 10 :] + tool_line('Bash', 'ls'))
+    ralphlib.watcher.update_stdout(run, stat_cache)
+    assert list(run['tools']) == ['Bash ls']
+    assert not run['skipping']
+
+
+@pytest.mark.parametrize('aligned', [False, True])
+def test_update_state_mid_file(tmp_path: pathlib.Path, monkeypatch: pytest.MonkeyPatch, aligned: bool) -> None:
+    # a log that is already there is only read from near its end, starting with a whole line
+    line = tool_line('Bash', 'ls')
+    monkeypatch.setattr(ralphlib.watcher, 'INITIAL_TAIL', len(line) if aligned else len(line) + 5)
+    stdout = tmp_path / 'stdout-1.jsonl'
+    stdout.write_bytes(tool_line('Read', 'a') + tool_line('Read', 'b') + line)
+    (tmp_path / 'state.json').write_text(json.dumps({'start': '2026-01-01T00:00:00', 'max_iterations': 3, 'iterations': {'1': {'stdout': str(stdout)}}}))
+    options = ralphlib.options.WatchOptions(logdirs=[str(tmp_path)], recent=10)
+    run = ralphlib.watcher.make_run(options, tmp_path / 'state.json', 'state.json')
+    stat_cache: dict = {}
+
+    ralphlib.watcher.update_state(run, stat_cache, ralphlib.watcher.Poller())
+    ralphlib.watcher.update_stdout(run, stat_cache)
+
+    assert run['iteration'] == '1'
+    assert run['max_iterations'] == 3
+    assert list(run['tools']) == ['Bash ls']
+
+
+def test_discover_and_render(tmp_path: pathlib.Path) -> None:
+    (tmp_path / 'a').mkdir()
+    (tmp_path / 'a' / 'state.json').write_text(json.dumps({'start': '2026-01-01T00:00:00', 'max_iterations': 3, 'stopped': ['complete']}))
+    (tmp_path / 'ralpher-report.json').write_text(json.dumps({'runs': []}))
+    options = ralphlib.options.WatchOptions(logdirs=[str(tmp_path)])
+    runs: dict = {}
+    stat_cache: dict = {}
+
+    ralphlib.watcher.discover(options, runs, ralphlib.watcher.Poller())
+    for run in runs.values():
+        ralphlib.watcher.update_state(run, stat_cache, ralphlib.watcher.Poller())
+    screen = ralphlib.watcher.render(options, runs)
+
+    assert sorted(run['name'] for run in runs.values()) == ['a/state.json', 'ralpher-report.json']
+    assert '1 runs' in screen
+    assert 'a/state.json' in screen
+    assert 'complete' in screen
+
+
+def test_missing_dirs(tmp_path: pathlib.Path) -> None:
+    try:
+        waiter = ralphlib.watcher.Inotify()
+    except OSError:
+        pytest.skip('inotify not available')
+    logdir = tmp_path / 'logs'
+    options = ralphlib.options.WatchOptions(logdirs=[str(logdir)])
+    runs: dict = {}
+    try:
+        # a logdir or a log directory that is not there yet is watched once a rescan finds it
+        waiter.add(logdir)
+        stdout = logdir / 'run' / 'stdout-1.jsonl'
+        run = ralphlib.watcher.make_run(options, tmp_path / 'state.json', 'state.json')
+        (tmp_path / 'state.json').write_text(json.dumps({'start': '2026-01-01T00:00:00', 'max_iterations': 3, 'iterations': {'1': {'stdout': str(stdout)}}}))
+        ralphlib.watcher.update_state(run, {}, waiter)
+        assert waiter.missing == {logdir, stdout.parent}
+
+        stdout.parent.mkdir(parents=True)
+        ralphlib.watcher.discover(options, runs, waiter)
+        assert waiter.missing == set()
+    finally:
+        waiter.close()
+
+
+def test_watch_missing_logdir(tmp_path: pathlib.Path, capsys: pytest.CaptureFixture[str]) -> None:
+    ralphlib.watcher.watch(ralphlib.options.WatchOptions(logdirs=[str(tmp_path / 'missing')], once=True))
+
+    assert '0 runs' in capsys.readouterr().out